@@ -0,0 +1,69 @@
+import os
+import threading
+
+from pydub import AudioSegment
+
+from mixer import EPISODE_CHANNELS, EPISODE_FRAME_RATE, to_array
+
+AUDIO_EXTENSIONS = (".mp3", ".wav")
+
+
+# Decoded sound assets. sounds/ is scanned once; each file is decoded once, on first use,
+# to the episode's frame rate and channel layout and handed out as a read-only array, so
+# slices are zero-copy views. Pools are meant to live as long as the process.
+class AssetPool:
+    def __init__(self, sounds_dir="sounds", frame_rate=EPISODE_FRAME_RATE, channels=EPISODE_CHANNELS):
+        self.sounds_dir = sounds_dir
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self._decoded = {}
+        self._lock = threading.Lock()
+        self.categories = {}
+        if os.path.isdir(sounds_dir):
+            for entry in sorted(os.scandir(sounds_dir), key=lambda e: e.name):
+                if entry.is_dir():
+                    self.categories[entry.name] = sorted(
+                        os.path.join(entry.path, name) for name in os.listdir(entry.path)
+                        if name.lower().endswith(AUDIO_EXTENSIONS)
+                    )
+
+    def load(self, path):
+        with self._lock:
+            samples = self._decoded.get(path)
+        if samples is None:
+            audio = AudioSegment.from_file(path).set_channels(self.channels)
+            samples = to_array(audio, self.frame_rate)
+            samples.flags.writeable = False
+            with self._lock:
+                samples = self._decoded.setdefault(path, samples)
+        return samples
+
+    # Path of a random sound from a sounds/ subdirectory, or None if there are none
+    def choose_path(self, category, rng):
+        paths = self.categories.get(category)
+        if not paths:
+            return None
+        return rng.choice(paths)
+
+    # A random sound from a sounds/ subdirectory, or None if there are none
+    def choose(self, category, rng):
+        path = self.choose_path(category, rng)
+        return self.load(path) if path else None
+
+    def decoded_bytes(self):
+        with self._lock:
+            return sum(samples.nbytes for samples in self._decoded.values())
+
+
+_shared_pools = {}
+_shared_pools_lock = threading.Lock()
+
+
+# One pool per sounds directory and layout for the whole process, so a long-running
+# renderer decodes each asset once no matter how many episodes it makes
+def shared_pool(sounds_dir="sounds", frame_rate=EPISODE_FRAME_RATE, channels=EPISODE_CHANNELS):
+    key = (os.path.abspath(sounds_dir), frame_rate, channels)
+    with _shared_pools_lock:
+        if key not in _shared_pools:
+            _shared_pools[key] = AssetPool(sounds_dir, frame_rate, channels)
+        return _shared_pools[key]
@@ -0,0 +1,81 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from episode_index import EpisodeIndex
+from feed_builder import FeedBuilder
+from podcast_manager import channel_settings
+from storage import FilesystemStorage
+
+
+# Counts what each run uploads
+class CountingStorage(FilesystemStorage):
+    def __init__(self, root):
+        super().__init__(root)
+        self.puts = 0
+        self.bytes_put = 0
+
+    def put(self, key, body, *args, **kwargs):
+        self.puts += 1
+        self.bytes_put += len(body)
+        return super().put(key, body, *args, **kwargs)
+
+
+def synthetic_episode(i):
+    published = datetime(2020, 1, 1, tzinfo=timezone.utc) + timedelta(days=i)
+    return {
+        "id": i,
+        "title": f"Episode {i}: the one where everything is rewritten in Rust",
+        "summary": "Today on the show: " + " ".join(f"story {i}.{n} & <friends>" for n in range(8)),
+        "mp3_key": f"{published.strftime('%Y%m%d')}_{i}.mp3",
+        "pub_date": published.isoformat(),
+        "is_test": i % 50 == 0,
+        "duration": "00:12:34",
+    }
+
+
+def run(label, storage, cache_dir, max_items):
+    storage.puts = storage.bytes_put = 0
+    start = time.perf_counter()
+    # Fresh objects each time, as a new upload_podcast.py run would have
+    builder = FeedBuilder(EpisodeIndex(storage, cache_dir=cache_dir), channel_settings(), cache_dir,
+                          max_items)
+    written = builder.publish()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed * 1000:9.1f} ms  {builder.items_rendered:>6} items rendered  "
+          f"{storage.puts:>3} uploads  {storage.bytes_put / 1e3:9.1f} kB  "
+          f"{', '.join(written) or '-' if len(written) <= 3 else f'{len(written)} feeds'}")
+
+
+def add_episode(storage, cache_dir, episode_id):
+    index = EpisodeIndex(storage, cache_dir=cache_dir)
+    record = index.create(lambda claimed: {**synthetic_episode(episode_id), "id": claimed})
+    index.publish(record)
+
+
+def bench(count, max_items):
+    with tempfile.TemporaryDirectory() as work_dir:
+        storage = CountingStorage(os.path.join(work_dir, "bucket"))
+        cache_dir = os.path.join(work_dir, "cache")
+        storage.put("index.json", json.dumps({"episodes": [synthetic_episode(i) for i in range(1, count + 1)]}))
+        print(f"--- {count} episodes, max_items={max_items} ---")
+        add_episode(storage, cache_dir, count + 1)
+        run("cold (empty cache)", storage, cache_dir, max_items)
+        run("warm, nothing changed", storage, cache_dir, max_items)
+        add_episode(storage, cache_dir, count + 2)
+        run("warm, one new episode", storage, cache_dir, max_items)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark incremental RSS generation on a synthetic catalog.")
+    parser.add_argument("--episodes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--max-items", type=int, default=100, help="Cap for podcast.rss (0 for no cap).")
+    args = parser.parse_args()
+    for count in args.episodes:
+        bench(count, args.max_items or None)
@@ -0,0 +1,86 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from hn_fetch import Fetcher
+from script_generator2 import HackerNewsPodcastGenerator
+
+
+# A stand-in for the HN API: /topstories.json lists ids, /item/<id>.json are stories and
+# comments. Every response carries an ETag and honours If-None-Match, after latency seconds.
+def make_server(story_count, latency):
+    documents = {"/topstories.json": list(range(1, story_count + 1))}
+    for story_id in range(1, story_count + 1):
+        kids = [story_id * 1000 + n for n in range(10)]
+        documents[f"/item/{story_id}.json"] = {
+            "id": story_id, "type": "story", "title": f"Story {story_id}", "url": f"https://example.com/{story_id}",
+            "score": (story_id * 7919) % 500, "kids": kids,
+        }
+        for kid in kids:
+            documents[f"/item/{kid}.json"] = {"id": kid, "type": "comment", "text": f"<p>Comment {kid} &amp; more</p>"}
+    bodies = {path: json.dumps(document).encode("utf-8") for path, document in documents.items()}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            body = bodies.get(self.path)
+            if body is None:
+                self.send_response(404)
+                self.end_headers()
+                return
+            etag = '"' + hashlib.md5(body).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    Handler.protocol_version = "HTTP/1.1"
+    return ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+
+
+def run(label, base_url, cache_dir, concurrency, num_stories):
+    fetcher = Fetcher(cache_dir=cache_dir, concurrency=concurrency)
+    generator = HackerNewsPodcastGenerator(f"{base_url}/topstories.json", num_stories, fetcher=fetcher,
+                                           item_url=base_url + "/item/{id}.json")
+    start = time.perf_counter()
+    stories = generator.fetch_top_stories()
+    elapsed = time.perf_counter() - start
+    stats = fetcher.stats
+    print(f"{label:<30} {elapsed * 1000:8.1f} ms  {stats['requests']:>4} requests  "
+          f"{stats['not_modified']:>4} not modified  {stats['downloaded_bytes'] / 1e3:7.1f} kB  "
+          f"top: {', '.join(str(story['id']) for story in stories)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark story fetching against a local stand-in for the HN API.")
+    parser.add_argument("--stories", type=int, default=500, help="Ids listed in topstories.json.")
+    parser.add_argument("--num-stories", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=30, help="Simulated per-request server latency.")
+    args = parser.parse_args()
+
+    server = make_server(args.stories, args.latency_ms / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    with tempfile.TemporaryDirectory() as work_dir:
+        run("sequential, no cache", base_url, None, 1, args.num_stories)
+        run("concurrent, cold cache", base_url, os.path.join(work_dir, "cache"), 8, args.num_stories)
+        run("concurrent, warm cache", base_url, os.path.join(work_dir, "cache"), 8, args.num_stories)
+    server.shutdown()
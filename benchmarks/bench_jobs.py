@@ -0,0 +1,78 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import dsp
+from mixer import EPISODE_FRAME_RATE
+from parallel import process_lines
+from segment_cache import ProcessedCache
+
+SOURCE_FRAME_RATE = 44100
+
+
+# Write synthetic mono "TTS" clips to WAV so workers decode them like real segment files
+def write_corpus(directory, lines, seed=0):
+    rng = np.random.default_rng(seed)
+    paths = []
+    for index in range(lines):
+        seconds = rng.uniform(3, 12)
+        t = np.arange(int(seconds * SOURCE_FRAME_RATE)) / SOURCE_FRAME_RATE
+        signal = np.sin(2 * np.pi * rng.uniform(100, 250) * t) * np.clip(np.sin(2 * np.pi * 4 * t), 0, None)
+        path = os.path.join(directory, f"{index}.wav")
+        with wave.open(path, "wb") as file:
+            file.setnchannels(1)
+            file.setsampwidth(2)
+            file.setframerate(SOURCE_FRAME_RATE)
+            file.writeframes((signal * 12000).astype(np.int16).tobytes())
+        paths.append(path)
+    return paths
+
+
+def line_params(index, seed):
+    return {
+        "version": dsp.PROCESSING_VERSION,
+        "frame_rate": EPISODE_FRAME_RATE,
+        "speed": 1.1,
+        "stretch_backend": "wsola",
+        "echo_db": -3,
+        "volume_range": [-3, 3],
+        "pan": -0.25 if index % 2 else 0.25,
+        "seed": [seed, index],
+    }
+
+
+def run(paths, jobs, work_dir):
+    cache = ProcessedCache(os.path.join(work_dir, f"jobs{jobs}"), max_bytes=None)
+    lines = [(path, f"line{index}", line_params(index, 0)) for index, path in enumerate(paths)]
+    start = time.perf_counter()
+    process_lines(lines, cache, jobs)
+    elapsed = time.perf_counter() - start
+    outputs = [np.array(cache.get(source_key, params)) for _, source_key, params in lines]
+    cache.close()
+    return elapsed, outputs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure per-line processing speedup with --jobs.")
+    parser.add_argument("--lines", type=int, default=48, help="Number of synthetic lines to process.")
+    parser.add_argument("--max-jobs", type=int, default=os.cpu_count(), help="Largest job count to try.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="podgen-bench-jobs-") as work_dir:
+        paths = write_corpus(work_dir, args.lines)
+        baseline, reference = run(paths, 1, work_dir)
+        print(f"jobs  1  {baseline:6.2f} s  speedup 1.00x")
+        jobs = 2
+        while jobs <= args.max_jobs:
+            elapsed, outputs = run(paths, jobs, work_dir)
+            identical = all(np.array_equal(a, b) for a, b in zip(reference, outputs))
+            print(f"jobs {jobs:>2}  {elapsed:6.2f} s  speedup {baseline / elapsed:4.2f}x  "
+                  f"{'bit-identical' if identical else 'OUTPUT DIFFERS'}")
+            jobs *= 2
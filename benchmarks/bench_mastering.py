@@ -0,0 +1,58 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import mastering
+from mixer import EPISODE_FRAME_RATE
+
+
+# Speech-like test signal: noise bursts of 2-15 s at varying levels with short gaps, and
+# the odd click well above the rest so the limiter has work to do
+def synthetic_mix(minutes, seed=0):
+    rng = np.random.default_rng(seed)
+    frames = minutes * 60 * EPISODE_FRAME_RATE
+    samples = np.zeros((frames, 2), dtype=np.int16)
+    position = 0
+    while position < frames:
+        length = min(int(rng.uniform(2, 15) * EPISODE_FRAME_RATE), frames - position)
+        level = rng.uniform(1000, 6000)
+        samples[position:position + length] = np.clip(rng.standard_normal((length, 2)) * level, -32768, 32767)
+        position += length + int(0.4 * EPISODE_FRAME_RATE)
+    samples[::EPISODE_FRAME_RATE * 7] = 32000
+    return samples
+
+
+def bench(minutes, backend):
+    samples = synthetic_mix(minutes)
+    start = time.perf_counter()
+    meter = mastering.LoudnessMeter()
+    for block in range(0, len(samples), mastering.BLOCK_FRAMES):
+        meter.add(samples[block:block + mastering.BLOCK_FRAMES])
+    loudness = meter.integrated()
+    measured = time.perf_counter() - start
+
+    gain_db = mastering.mastering_gain_db(loudness)
+    start = time.perf_counter()
+    output_loudness, true_peak_db = mastering.master(samples, gain_db, lambda block: None)
+    mastered = time.perf_counter() - start
+    seconds = minutes * 60
+    print(f"{minutes:>4} min  {backend:<6}  measure {seconds / measured:6.0f}x realtime  "
+          f"master {seconds / mastered:5.0f}x realtime  {loudness:6.1f} -> {output_loudness:6.1f} LUFS  "
+          f"true peak {true_peak_db:5.1f} dBTP")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark loudness measurement and mastering on synthetic mixes.")
+    parser.add_argument("--minutes", type=int, nargs="+", default=[5, 30])
+    args = parser.parse_args()
+    # The K-weighting runs on scipy when it is installed; also time the numpy fallback
+    backends = ([("scipy", mastering.sosfilt)] if mastering.sosfilt is not None else []) + [("numpy", None)]
+    for minutes in args.minutes:
+        for backend, sosfilt in backends:
+            mastering.sosfilt = sosfilt
+            bench(minutes, backend)
@@ -0,0 +1,99 @@
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mixer import EPISODE_CHANNELS, EPISODE_FRAME_RATE, Timeline
+
+
+# Build a synthetic episode: intro, alternating breaths and 2-15 s utterances with a break
+# every few minutes, outro. Clips are fresh arrays so the mixer really frees them as it goes.
+# ambiance is "none", "per-line" (the old way: a copy of every utterance with the bed mixed
+# in from its start) or "track" (one looped bed on its own track with gain automation).
+def synthetic_episode(minutes, ambiance="none", seed=0):
+    rng = np.random.default_rng(seed)
+    frame_rate = EPISODE_FRAME_RATE
+
+    def clip(seconds, channels=EPISODE_CHANNELS):
+        frames = int(seconds * frame_rate)
+        tone = np.sin(np.arange(frames) * (2 * np.pi * rng.uniform(100, 300) / frame_rate)) * 8000
+        return np.repeat(tone.astype(np.int16)[:, None], channels, axis=1)
+
+    bed = clip(20)
+    overlay_seconds = 0.0
+
+    def per_line_overlay(samples):
+        nonlocal overlay_seconds
+        start = time.perf_counter()
+        looped = np.resize(bed, (len(samples), EPISODE_CHANNELS))
+        mixed = np.clip(samples.astype(np.int32) + looped, -32768, 32767).astype(np.int16)
+        overlay_seconds += time.perf_counter() - start
+        return mixed
+
+    body = Timeline()
+    remaining = minutes * 60
+    since_break = 0
+    clips = 0
+    while remaining > 0:
+        body.append(clip(0.4, channels=1))
+        seconds = rng.uniform(2, 15)
+        speech = clip(seconds)
+        body.append(per_line_overlay(speech) if ambiance == "per-line" else speech)
+        remaining -= seconds + 0.4
+        since_break += seconds
+        clips += 2
+        if since_break > 180:
+            body.append(clip(3))
+            since_break = 0
+            clips += 1
+
+    episode = Timeline()
+    episode.append(clip(10))
+    episode.append_silence(500)
+    body_start = episode.end_frame()
+    episode.append_timeline(body, crossfade_ms=100)
+    episode.append_silence(500)
+    if ambiance == "track":
+        body_end = episode.end_frame()
+        looped = episode.place(bed, body_start, "ambiance", clip_id="bed", loop=True)
+        for frame, gain in ((body_start, 0.0), (body_start + frame_rate // 2, 1.0), (body_end - frame_rate, 1.0),
+                            (body_end, 0.0)):
+            episode.automate("ambiance", "gain", frame, gain)
+        episode.end_loop(looped, body_end)
+    episode.append(clip(15), crossfade_ms=1000)
+    return episode, clips + 2, overlay_seconds
+
+
+def bench(minutes, ambiance):
+    episode, clips, overlay_seconds = synthetic_episode(minutes, ambiance)
+    frames = episode.manifest()["frames"]
+    episode_bytes = frames * episode.channels * 2
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    buffer = episode.render()
+    # Per-line overlays were mixed while building the episode; count them as mixing time
+    elapsed = time.perf_counter() - start + overlay_seconds
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(buffer) == frames
+    realtime = minutes * 60 / elapsed
+    print(f"{minutes:>4} min  {ambiance:<8}  {clips:>5} clips  {elapsed:7.2f} s  {realtime:8.0f}x realtime  "
+          f"peak alloc {peak / 1e6:8.1f} MB ({peak / episode_bytes:.2f}x episode PCM)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Timeline.render on synthetic episodes.")
+    parser.add_argument("--minutes", type=int, nargs="+", default=[5, 30, 120], help="Episode lengths to mix.")
+    parser.add_argument("--ambiance", nargs="+", choices=["none", "per-line", "track"],
+                        default=["none", "per-line", "track"], help="How the ambiance bed is mixed in.")
+    args = parser.parse_args()
+    for minutes in args.minutes:
+        for ambiance in args.ambiance:
+            bench(minutes, ambiance)
@@ -0,0 +1,92 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from script_parser import ScriptParser
+from segment_cache import DEFAULT_MODEL, segment_key
+
+VOICES = {"Dave": "Ybqj6CIlqb6M85s9Bl4n", "Julie": "AcGHtn5NK8C0VkbCsIjm"}
+PANS = {"Dave": 0.25, "Julie": -0.25}
+WORDS = "well I mean the chip is fast but on the other hand nobody asked for another JavaScript framework".split()
+
+
+def write_script(path, megabytes, seed=0):
+    rng = random.Random(seed)
+    with open(path, "w") as file:
+        written = 0
+        while written < megabytes * 1e6:
+            roll = rng.random()
+            if roll < 0.02:
+                line = "[break]"
+            elif roll < 0.04:
+                line = f"[pause {rng.choice(['500ms', '1s', '1.5s'])}]"
+            elif roll < 0.05:
+                line = f"https://example.com/{rng.randrange(10 ** 6)} at 12:{rng.randrange(60):02d}"
+            else:
+                speaker = rng.choice(list(VOICES))
+                line = f"{speaker}: " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40)))
+            file.write(line + "\n")
+            written += len(line) + 1
+
+
+# The previous parse_script: the whole file in memory, a dict per line
+def legacy_parse(path):
+    with open(path, "r") as file:
+        script = file.read()
+    segments = []
+    for line in script.split("\n"):
+        if line.strip() == "[break]":
+            segments.append({"type": "break"})
+        elif ":" in line:
+            speaker, text = line.split(":", 1)
+            segments.append({"type": "utterance", "speaker": speaker.strip(), "text": text.strip()})
+    return segments
+
+
+# The legacy parse plus the cache key for every line, which the pipeline used to derive
+# downstream (once per stage) and the typed records now carry
+def legacy_parse_with_keys(path):
+    segments = legacy_parse(path)
+    for segment in segments:
+        if segment["type"] == "utterance" and segment["speaker"] in VOICES:
+            segment["key"] = segment_key(VOICES[segment["speaker"]], DEFAULT_MODEL, segment["text"])
+    return segments
+
+
+# Time without tracing, then a second run under tracemalloc for the peak memory
+def measure(label, parse, size):
+    start = time.perf_counter()
+    count = parse()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    parse()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<42} {elapsed * 1000:8.1f} ms  {size / 1e6 / elapsed:7.1f} MB/s  "
+          f"{count:>8} records  peak {peak / 1e6:7.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark script parsing on large synthetic scripts.")
+    parser.add_argument("--megabytes", type=float, nargs="+", default=[1, 8])
+    args = parser.parse_args()
+
+    def parse_file(path):
+        return ScriptParser(VOICES, PANS).parse_file(path)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for megabytes in args.megabytes:
+            path = os.path.join(work_dir, "script.txt")
+            write_script(path, megabytes)
+            size = os.path.getsize(path)
+            print(f"--- {size / 1e6:.1f} MB script ---")
+            measure("legacy: read all, dict per line", lambda: len(legacy_parse(path)), size)
+            measure("legacy + cache keys", lambda: len(legacy_parse_with_keys(path)), size)
+            measure("typed records with cache keys, list", lambda: len(list(parse_file(path))), size)
+            measure("typed records, streamed (nothing kept)", lambda: sum(1 for _ in parse_file(path)), size)
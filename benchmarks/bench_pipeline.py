@@ -0,0 +1,228 @@
+import argparse
+import io
+import os
+import queue
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import wave
+import zlib
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import podgen
+from assets import AssetPool
+from instrumentation import Recorder
+from podcast_manager import PodcastManager
+from script_generator2 import HackerNewsPodcastGenerator
+from segment_cache import ProcessedCache, SegmentCache
+from storage import FilesystemStorage
+from tts_pool import SynthesisPool
+
+# The whole pipeline offline: canned stories and LLM output, a TTS that returns tones
+# after a fixed latency, and a directory standing in for the S3 bucket. Only ffmpeg is
+# real. Each script size runs in a fresh process so peak memory is per run.
+
+TTS_FRAME_RATE = 44100
+WORDS = ("well I mean the new chip is fast but on the other hand nobody asked for another JavaScript "
+         "framework and honestly the database was fine until someone rewrote it in Rust").split()
+LINE_STAGES = {"script", "parse", "synthesize", "process", "stream"}
+
+
+def wav_bytes(samples, frame_rate=TTS_FRAME_RATE):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as file:
+        file.setnchannels(1 if samples.ndim == 1 else samples.shape[1])
+        file.setsampwidth(2)
+        file.setframerate(frame_rate)
+        file.writeframes(samples.astype(np.int16).tobytes())
+    return buffer.getvalue()
+
+
+def tone(seconds, frequency, level=6000, frame_rate=TTS_FRAME_RATE):
+    t = np.arange(int(seconds * frame_rate)) / frame_rate
+    # A little tremolo so the time stretcher and the loudness meter see something speech-like
+    return np.sin(2 * np.pi * frequency * t) * (0.6 + 0.4 * np.sin(2 * np.pi * 3 * t)) * level
+
+
+# Stands in for ElevenLabs: a tone per voice, as long as the text would take to say,
+# after latency_s. The WAV bytes are stored like the MP3s the real API returns.
+class FakeTTS:
+    def __init__(self, latency_s=0.2, seconds_per_word=0.3):
+        self.latency_s = latency_s
+        self.seconds_per_word = seconds_per_word
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def generate(self, text, voice, model):
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency_s)
+        frequency = 120 + zlib.crc32(voice.encode("utf-8")) % 120
+        return wav_bytes(tone(max(1, len(text.split())) * self.seconds_per_word, frequency))
+
+
+# Stands in for OpenAI chat completions: a fixed script of lines lines, streamed in
+# chunks of a few tokens at tokens_per_second when asked to stream
+class CannedLLM:
+    def __init__(self, lines, tokens_per_second=None, seed=0):
+        rng = random.Random(seed)
+        script = []
+        for index in range(lines):
+            if index and index % 40 == 0:
+                script.append("[break]")
+            speaker = "Dave" if index % 2 == 0 else "Julie"
+            script.append(f"{speaker}: " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 20))))
+        self.script = "\n".join(script)
+        self.tokens_per_second = tokens_per_second
+        self.chat = types.SimpleNamespace(completions=self)
+
+    def _usage(self, messages):
+        return types.SimpleNamespace(prompt_tokens=sum(len(message["content"]) // 4 for message in messages),
+                                     completion_tokens=len(self.script) // 4)
+
+    def create(self, model, messages, stream=False, **kwargs):
+        if not stream:
+            message = types.SimpleNamespace(content=self.script)
+            return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=self._usage(messages))
+        return self._stream(messages)
+
+    def _stream(self, messages):
+        chunk_chars = 16
+        for start in range(0, len(self.script), chunk_chars):
+            if self.tokens_per_second:
+                time.sleep(chunk_chars / 4 / self.tokens_per_second)
+            delta = types.SimpleNamespace(content=self.script[start:start + chunk_chars])
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)], usage=None)
+        yield types.SimpleNamespace(choices=[], usage=self._usage(messages))
+
+
+# Stands in for hn_fetch.Fetcher with a fixed front page
+class CannedFetcher:
+    def __init__(self, stories=30):
+        self.stats = {"requests": 0, "not_modified": 0, "downloaded_bytes": 0}
+        self.stories = [{
+            "title": f"Show HN: story {index}",
+            "first_paragraph": " ".join(WORDS) * 2,
+            "comments": [" ".join(WORDS[comment:]) for comment in range(5)],
+            "points": (index * 37) % 500,
+        } for index in range(stories)]
+
+    def get_json(self, url):
+        self.stats["requests"] += 1
+        return self.stories
+
+
+# intro/outro/ambiance in the working directory and breathing/break sounds under sounds/
+def write_assets(work_dir):
+    for name, seconds, frequency in (("intro.mp3", 8, 440), ("outro.mp3", 10, 330),
+                                     ("global_ambiance.mp3", 12, 60)):
+        stereo = np.repeat(tone(seconds, frequency, level=3000)[:, None], 2, axis=1)
+        with open(os.path.join(work_dir, name), "wb") as file:
+            file.write(wav_bytes(stereo))
+    for category, count, seconds in (("breathing", 3, 0.4), ("break", 2, 3)):
+        os.makedirs(os.path.join(work_dir, "sounds", category), exist_ok=True)
+        for index in range(count):
+            with open(os.path.join(work_dir, "sounds", category, f"{category}{index}.wav"), "wb") as file:
+                file.write(wav_bytes(tone(seconds, 500 + 100 * index, level=1500)))
+
+
+# Script, synthesis, mixing and mastering, then publishing to the stand-in bucket, all in the
+# current directory; returns the MP3's size
+def run_pipeline(lines, args, recorder):
+    write_assets(os.getcwd())
+    generator = HackerNewsPodcastGenerator("https://example.invalid/stories.json", 5, fetcher=CannedFetcher(),
+                                           client=CannedLLM(lines, args.llm_tokens_per_second))
+    script_lines = None
+    if args.stream:
+        line_queue = queue.Queue()
+        threading.Thread(target=generator.stream_script, args=(line_queue,), daemon=True).start()
+        script_lines = podgen.iter_queue(line_queue)
+    else:
+        with recorder.stage("script"):
+            generator.save_script()
+
+    tts = FakeTTS(args.tts_latency_ms / 1000, args.seconds_per_word)
+    podgen.generate_podcast(SegmentCache("segments"), ProcessedCache("segments/processed"),
+                            SynthesisPool(tts, concurrency=args.tts_concurrency), AssetPool("sounds"),
+                            jobs=args.jobs, recorder=recorder, script_lines=script_lines)
+
+    with recorder.stage("publish"):
+        manager = PodcastManager("bench", storage=FilesystemStorage("bucket"), cache_dir="podcast_cache")
+        manager.add_episode(f"Benchmark episode ({lines} lines)", "Offline benchmark run", "output.mp3")
+        manager.publish_site()
+    return os.path.getsize("output.mp3")
+
+
+# Run the pipeline in a scratch directory
+def run(lines, args):
+    recorder = Recorder()
+    previous_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            mp3_bytes = run_pipeline(lines, args, recorder)
+        finally:
+            os.chdir(previous_dir)
+    return recorder, mp3_bytes
+
+
+def print_report(lines, recorder, mp3_bytes):
+    counters = recorder.counters
+    episode_seconds = counters.get("episode_seconds", 0)
+    print(f"--- {lines} lines, {episode_seconds / 60:.1f} min episode ---")
+    print(f"{'stage':<14} {'wall s':>8} {'cpu s':>8} {'peak RSS MB':>12}  throughput")
+    for stage in recorder.stages:
+        wall = max(stage["wall_s"], 1e-9)
+        if stage["name"] in LINE_STAGES:
+            throughput = f"{counters.get('script_lines', lines) / wall:8.1f} lines/s"
+        elif stage["name"] == "publish":
+            throughput = f"{mp3_bytes / 1e6 / wall:8.1f} MB/s of MP3"
+        else:
+            throughput = f"{episode_seconds / wall:8.1f}x realtime"
+        print(f"{stage['name']:<14} {stage['wall_s']:8.2f} {stage['cpu_s']:8.2f} {stage['peak_rss_mb']:12.1f}  {throughput}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark script generation, synthesis, mixing and publishing "
+                                                 "end to end against local fakes.")
+    parser.add_argument("--lines", type=int, nargs="+", default=[10, 200, 2000], help="Script sizes to run.")
+    parser.add_argument("--tts-latency-ms", type=float, default=200, help="Latency of each fake TTS request.")
+    parser.add_argument("--tts-concurrency", type=int, default=8)
+    parser.add_argument("--seconds-per-word", type=float, default=0.3, help="Length of the fake speech.")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=None,
+                        help="Pace the canned LLM stream (default: as fast as it is read).")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream the script into synthesis as it is generated, like podgen --generate-script.")
+    parser.add_argument("--jobs", type=int, default=1, help="Processes for per-line audio processing.")
+    parser.add_argument("--report-dir", help="Also write each run's JSON report and Chrome trace here.")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if not args.single:
+        # One process per size, so peak RSS isn't carried over from a bigger run
+        for lines in args.lines:
+            subprocess.run([sys.executable, os.path.abspath(__file__)] + sys.argv[1:]
+                           + ["--single", "--lines", str(lines)], check=True)
+        sys.exit(0)
+
+    lines = args.lines[0]
+    report_dir = os.path.abspath(args.report_dir) if args.report_dir else None
+    # Keep the per-line progress prints out of the report
+    with open(os.devnull, "w") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            recorder, mp3_bytes = run(lines, args)
+        finally:
+            sys.stdout = stdout
+    print_report(lines, recorder, mp3_bytes)
+    if report_dir:
+        os.makedirs(report_dir, exist_ok=True)
+        recorder.write_report(os.path.join(report_dir, f"pipeline_{lines}.json"))
+        recorder.write_trace(os.path.join(report_dir, f"pipeline_{lines}_trace.json"))
@@ -0,0 +1,47 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_feed import CountingStorage, add_episode, synthetic_episode
+from episode_index import EpisodeIndex
+from podcast_manager import channel_settings
+from site_builder import SiteBuilder
+
+
+def run(label, storage, cache_dir, front_page_size):
+    storage.puts = storage.bytes_put = 0
+    start = time.perf_counter()
+    # Fresh objects each time, as a new upload_podcast.py run would have
+    builder = SiteBuilder(EpisodeIndex(storage, cache_dir=cache_dir), channel_settings(), cache_dir, front_page_size)
+    written = builder.publish()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed * 1000:9.1f} ms  {builder.pages_rendered:>6} pages rendered  "
+          f"{storage.puts:>5} uploads  {storage.bytes_put / 1e3:9.1f} kB  "
+          f"{', '.join(written) or '-' if len(written) <= 4 else f'{len(written)} pages'}")
+
+
+def bench(count, front_page_size):
+    with tempfile.TemporaryDirectory() as work_dir:
+        storage = CountingStorage(os.path.join(work_dir, "bucket"))
+        cache_dir = os.path.join(work_dir, "cache")
+        storage.put("index.json", json.dumps({"episodes": [synthetic_episode(i) for i in range(1, count + 1)]}))
+        print(f"--- {count} episodes ---")
+        add_episode(storage, cache_dir, count + 1)
+        run("cold (empty cache)", storage, cache_dir, front_page_size)
+        run("warm, nothing changed", storage, cache_dir, front_page_size)
+        add_episode(storage, cache_dir, count + 2)
+        run("warm, one new episode", storage, cache_dir, front_page_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark incremental web site generation on a synthetic catalog.")
+    parser.add_argument("--episodes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--front-page-size", type=int, default=10)
+    args = parser.parse_args()
+    for count in args.episodes:
+        bench(count, args.front_page_size)
@@ -0,0 +1,71 @@
+import argparse
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from timestretch import BACKENDS, time_stretch
+
+FRAME_RATE = 44100
+
+
+# A fixed, speech-like corpus: voiced harmonics with a wandering pitch and syllable envelope,
+# separated by short noise bursts. Seeded so every run stretches exactly the same audio.
+def corpus(clips=20, seed=0):
+    rng = np.random.default_rng(seed)
+    result = []
+    for _ in range(clips):
+        seconds = rng.uniform(3, 12)
+        t = np.arange(int(seconds * FRAME_RATE)) / FRAME_RATE
+        f0 = rng.uniform(90, 220) * (1 + 0.08 * np.sin(2 * np.pi * rng.uniform(0.2, 1.0) * t))
+        phase = 2 * np.pi * np.cumsum(f0) / FRAME_RATE
+        voiced = sum(np.sin(h * phase) / h for h in range(1, 12))
+        syllables = np.clip(np.sin(2 * np.pi * rng.uniform(3, 5) * t), 0, None)
+        noise = rng.standard_normal(len(t)) * (syllables < 0.05) * 0.1
+        signal = (voiced * syllables + noise) * 6000
+        result.append(np.clip(signal, -32768, 32767).astype(np.int16)[:, None])
+    return result
+
+
+def average_spectrum(samples, size=4096):
+    mono = samples.astype(np.float32).mean(axis=1)
+    frames = len(mono) // size
+    blocks = mono[:frames * size].reshape(frames, size) * np.hanning(size)
+    return np.abs(np.fft.rfft(blocks, axis=1)).mean(axis=0) + 1e-3
+
+
+# Stretching should change duration but not timbre or pitch, so compare the long-term spectra
+def log_spectral_distance(reference, stretched):
+    difference = 20 * np.log10(average_spectrum(reference) / average_spectrum(stretched))
+    return float(np.sqrt(np.mean(difference ** 2)))
+
+
+def bench(backend, clips, speed):
+    seconds = sum(len(clip) for clip in clips) / FRAME_RATE
+    start = time.perf_counter()
+    outputs = [time_stretch(clip, FRAME_RATE, speed, backend=backend) for clip in clips]
+    elapsed = time.perf_counter() - start
+
+    length_error = max(abs(len(out) - len(clip) / speed) / (len(clip) / speed) for clip, out in zip(clips, outputs))
+    distance = np.mean([log_spectral_distance(clip, out) for clip, out in zip(clips, outputs)])
+    print(f"{backend:>10}  {elapsed:6.2f} s  {seconds / elapsed:7.1f}x realtime  "
+          f"length error {length_error * 100:5.2f}%  log-spectral distance {distance:5.2f} dB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare time-stretch backends on a fixed synthetic corpus.")
+    parser.add_argument("--backends", nargs="+", default=sorted(BACKENDS), help="Backends to compare.")
+    parser.add_argument("--speed", type=float, default=1.1, help="Tempo factor, as used by podgen.")
+    parser.add_argument("--clips", type=int, default=20, help="Number of clips in the corpus.")
+    args = parser.parse_args()
+
+    clips = corpus(args.clips)
+    for backend in args.backends:
+        if backend == "rubberband" and shutil.which("rubberband") is None:
+            print(f"{backend:>10}  skipped (rubberband CLI not installed)")
+            continue
+        bench(backend, clips, args.speed)
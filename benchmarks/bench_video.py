@@ -0,0 +1,74 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from encoder import encode_samples
+from mixer import EPISODE_CHANNELS, EPISODE_FRAME_RATE
+import video
+
+
+# Speech-like test signal: tones with a syllable-rate envelope and short pauses
+def synthetic_mix(minutes, seed=0):
+    rng = np.random.default_rng(seed)
+    frames = int(minutes * 60 * EPISODE_FRAME_RATE)
+    t = np.arange(frames) / EPISODE_FRAME_RATE
+    envelope = np.abs(np.sin(2 * np.pi * 3 * t)) * (rng.random(frames // 44100 + 1) > 0.1).repeat(44100)[:frames]
+    tone = np.sin(2 * np.pi * 180 * t) * envelope * 12000
+    return np.repeat(tone.astype(np.int16)[:, None], EPISODE_CHANNELS, axis=1)
+
+
+def report(label, minutes, elapsed, path):
+    size = os.path.getsize(path) / 1e6 if os.path.exists(path) else float("nan")
+    print(f"{label:<22} {elapsed:7.2f} s  {minutes * 60 / elapsed:7.1f}x realtime  {size:7.1f} MB")
+
+
+# Time just the NumPy side: waveform masks and compositing, no encoder
+def bench_drawing(samples, background, fps=25, seconds=60):
+    window = EPISODE_FRAME_RATE // fps
+    mono = samples[:seconds * EPISODE_FRAME_RATE].astype(np.float32).mean(axis=1) / 32768
+    frames = len(mono) // window
+    painter = video.WaveformPainter(background)
+    start = time.perf_counter()
+    for first in range(0, frames, 10):
+        painter.paint(mono[first * window:min(first + 10, frames) * window].reshape(-1, window)).tobytes()
+    elapsed = time.perf_counter() - start
+    print(f"{'draw frames only':<22} {elapsed:7.2f} s  {frames / elapsed:7.0f} frames/s")
+
+
+def bench(minutes, presets):
+    samples = synthetic_mix(minutes)
+    background = video.load_background(os.path.join(ROOT, "background.png"))
+    print(f"--- {minutes} min episode ---")
+    bench_drawing(samples, background)
+    with tempfile.TemporaryDirectory() as work_dir:
+        # What podgen.py leaves behind for the shell script: output.mp3 next to background.png
+        encode_samples(samples, [os.path.join(work_dir, "output.mp3")], EPISODE_FRAME_RATE)
+        shutil.copy(os.path.join(ROOT, "background.png"), work_dir)
+        start = time.perf_counter()
+        subprocess.run(["bash", os.path.join(ROOT, "mp3tomp4.sh")], cwd=work_dir, check=True,
+                       stdin=subprocess.DEVNULL)
+        report("mp3tomp4.sh", minutes, time.perf_counter() - start, os.path.join(work_dir, "output.mp4"))
+
+        for preset in presets:
+            output = os.path.join(work_dir, f"{preset}.mp4")
+            start = time.perf_counter()
+            video.encode_video(samples, output, background, preset=preset)
+            report(f"video.py --preset {preset}", minutes, time.perf_counter() - start, output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the in-process waveform video render against mp3tomp4.sh.")
+    parser.add_argument("--minutes", type=float, nargs="+", default=[2, 10], help="Episode lengths to render.")
+    parser.add_argument("--presets", nargs="+", choices=list(video.PRESETS), default=list(video.PRESETS))
+    args = parser.parse_args()
+    for minutes in args.minutes:
+        bench(minutes, args.presets)
@@ -0,0 +1,70 @@
+import numpy as np
+
+from timestretch import time_stretch
+
+
+# Per-sample gain in dB: one random level per chunk (uniform in [min_db, max_db], like the
+# old chunked version), linearly interpolated between chunk centres so there are no steps
+def volume_envelope(frames, frame_rate, min_db, max_db, chunk_ms=100, rng=None):
+    rng = rng if rng is not None else np.random.default_rng()
+    chunk_frames = max(1, int(frame_rate * chunk_ms / 1000))
+    chunks = -(-frames // chunk_frames)
+    levels = rng.uniform(min_db, max_db, chunks)
+    centres = np.arange(chunks) * chunk_frames + chunk_frames / 2
+    return np.interp(np.arange(frames), centres, levels).astype(np.float32)
+
+
+# Multiply an int16 (frames, channels) array by a per-sample linear gain, saturating like audioop
+def apply_gain(samples, gain):
+    scaled = samples * gain[:, None]
+    return np.clip(scaled, -32768, 32767).astype(np.int16)
+
+
+# Vary the volume randomly and subtly in one multiply; pass a seed for reproducible output
+def vary_volume(samples, frame_rate, min_db, max_db, seed=None, chunk_ms=100):
+    if len(samples) == 0:
+        return samples
+    envelope_db = volume_envelope(len(samples), frame_rate, min_db, max_db, chunk_ms, np.random.default_rng(seed))
+    return apply_gain(samples, np.power(10.0, envelope_db / 20.0, dtype=np.float32))
+
+
+# Left/right gains for a pan position, using the same pan law as AudioSegment.pan()
+def pan_gains(pan_amount):
+    if not -1.0 <= pan_amount <= 1.0:
+        raise ValueError("pan_amount should be between -1.0 (100% left) and +1.0 (100% right)")
+    boost_factor = 2.0 ** abs(pan_amount)
+    reduce_factor = 2.0 - boost_factor
+    boost_factor = np.sqrt(boost_factor)
+    if pan_amount < 0:
+        return boost_factor, reduce_factor
+    return reduce_factor, boost_factor
+
+
+# Pan mono or stereo audio, returning stereo
+def pan(samples, pan_amount):
+    left, right = pan_gains(pan_amount)
+    if samples.shape[1] == 1:
+        samples = np.repeat(samples, 2, axis=1)
+    scaled = samples * np.array([left, right], dtype=np.float32)
+    return np.clip(scaled, -32768, 32767).astype(np.int16)
+
+
+# Function to add echo to an audio segment
+def add_echo(samples, frame_rate, gain_db):
+    # this needs more thought
+    return samples
+
+
+# Bump whenever process_utterance changes so previously processed audio is not reused
+PROCESSING_VERSION = 2
+
+
+# The per-line chain: time stretch -> echo -> volume variation -> pan. Levels are left to
+# the mastering pass over the whole episode (see mastering.py).
+# params is a plain dict so it can be fingerprinted for the processed-audio cache.
+def process_utterance(samples, frame_rate, params):
+    samples = time_stretch(samples, frame_rate, params["speed"], backend=params["stretch_backend"])
+    samples = add_echo(samples, frame_rate, params["echo_db"])
+    min_db, max_db = params["volume_range"]
+    samples = vary_volume(samples, frame_rate, min_db, max_db, seed=params["seed"])
+    return pan(samples, params["pan"])
@@ -0,0 +1,96 @@
+import os
+import queue
+import subprocess
+import threading
+
+import numpy as np
+
+CODECS = {
+    ".mp3": ["-c:a", "libmp3lame", "-f", "mp3"],
+    ".m4a": ["-c:a", "aac", "-movflags", "+faststart", "-f", "ipod"],
+    ".aac": ["-c:a", "aac", "-f", "adts"],
+}
+
+
+# "output.mp3" or "output_64k.mp3:64k" -> (path, bitrate or None)
+def parse_output(spec):
+    path, _, bitrate = spec.partition(":")
+    if os.path.splitext(path)[1].lower() not in CODECS:
+        raise ValueError(f"Don't know how to encode {path}; use one of {', '.join(CODECS)}")
+    return path, bitrate or None
+
+
+# Writes byte blocks to a pipe from a background thread, so whoever produces them (the
+# mixer) carries on while the reader (ffmpeg) drains the pipe. At most max_pending_blocks
+# wait in memory; after that write() blocks.
+class PipeWriter:
+    def __init__(self, pipe, max_pending_blocks=16):
+        self.pipe = pipe
+        self.error = None
+        self._blocks = queue.Queue(max_pending_blocks)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            block = self._blocks.get()
+            if block is None:
+                break
+            if self.error is None:
+                try:
+                    self.pipe.write(block)
+                except OSError as e:
+                    self.error = e
+        try:
+            self.pipe.close()
+        except OSError:
+            pass
+
+    def write(self, block):
+        if self.error is not None:
+            raise RuntimeError(f"Encoder stopped accepting data: {self.error}")
+        self._blocks.put(block)
+
+    # Write out everything queued and close the pipe
+    def close(self):
+        self._blocks.put(None)
+        self._thread.join()
+
+
+# One ffmpeg process encoding a stream of int16 PCM into any number of outputs at once
+# (e.g. MP3 at two bitrates plus an M4A for the video).
+class StreamingEncoder:
+    def __init__(self, outputs, frame_rate, channels, max_pending_blocks=16):
+        self.outputs = [parse_output(spec) if isinstance(spec, str) else spec for spec in outputs]
+        self.bytes_written = 0
+        command = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "s16le", "-ar", str(frame_rate), "-ac", str(channels), "-i", "pipe:0",
+        ]
+        for path, bitrate in self.outputs:
+            command += ["-map", "0:a"] + CODECS[os.path.splitext(path)[1].lower()]
+            if bitrate:
+                command += ["-b:a", bitrate]
+            command.append(path)
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        self._writer = PipeWriter(self.process.stdin, max_pending_blocks)
+
+    def write(self, samples):
+        block = np.ascontiguousarray(samples, dtype=np.int16).tobytes()
+        self.bytes_written += len(block)
+        self._writer.write(block)
+
+    # Flush, wait for ffmpeg and return the output paths
+    def close(self):
+        self._writer.close()
+        if self.process.wait() != 0 or self._writer.error is not None:
+            raise RuntimeError(f"ffmpeg failed writing {', '.join(path for path, _ in self.outputs)}")
+        return [path for path, _ in self.outputs]
+
+
+# Encode a finished buffer (in blocks, so memory-mapped masters aren't pulled in at once)
+def encode_samples(samples, outputs, frame_rate, block_frames=1 << 16):
+    encoder = StreamingEncoder(outputs, frame_rate, samples.shape[1])
+    for start in range(0, len(samples), block_frames):
+        encoder.write(samples[start:start + block_frames])
+    return encoder.close()
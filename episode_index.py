@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import NotFound, PreconditionFailed
+
+MANIFEST_KEY = 'index/manifest.json'
+PAGE_SIZE = 500
+
+
+def record_key(episode_id):
+    return f'episodes/{episode_id:06d}.json'
+
+
+def _dump(data):
+    return json.dumps(data, sort_keys=True, indent=1).encode('utf-8')
+
+
+def _hash(body):
+    return hashlib.sha256(body).hexdigest()[:16]
+
+
+# Episodes stored as one JSON record each (episodes/000123.json) plus a compact
+# manifest listing (id, pub_date, is_test, record hash) for every episode. The manifest
+# keeps the newest entries inline and seals older ones into content-addressed pages of
+# PAGE_SIZE, so adding an episode rewrites one small object however long the show runs.
+#
+# Episode ids are claimed by creating the record with If-None-Match: *, and the manifest
+# is updated with If-Match on its ETag, so concurrent uploads retry instead of clobbering
+# each other. The manifest, its sealed pages and the records are cached under cache_dir;
+# a cached manifest is revalidated with If-None-Match, and pages and records never change
+# for a given key and hash, so a warm cache costs one conditional GET. Records are only
+# rewritten by update_many, which gives them new hashes in the manifest.
+class EpisodeIndex:
+    def __init__(self, storage, cache_dir='.podcast_cache', legacy_index='index.json', page_size=PAGE_SIZE,
+                 max_attempts=20):
+        self.storage = storage
+        self.cache_dir = os.path.join(cache_dir, storage.cache_id)
+        self.legacy_index = legacy_index
+        self.page_size = page_size
+        self.max_attempts = max_attempts
+        self._manifest = None
+        self._imported = None
+
+    def _cache_path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _read_cache(self, name):
+        try:
+            with open(self._cache_path(name), 'rb') as file:
+                return json.loads(file.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_cache(self, name, data):
+        path = self._cache_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as file:
+            file.write(_dump(data))
+        os.replace(temp_path, path)
+
+    # The current manifest and its ETag (None if there is no manifest yet)
+    def manifest(self, refresh=False):
+        if self._manifest is not None and not refresh:
+            return self._manifest
+        cached = self._read_cache('manifest.json')
+        try:
+            body, etag = self.storage.get(MANIFEST_KEY, if_none_match=cached and cached['etag'])
+        except NotFound:
+            self._manifest = (self._import_legacy(), None)
+            return self._manifest
+        if body is None:
+            manifest = cached['manifest']
+        else:
+            manifest = json.loads(body)
+            self._write_cache('manifest.json', {'etag': etag, 'manifest': manifest})
+        self._manifest = (manifest, etag)
+        return self._manifest
+
+    # Build a manifest from the old single index.json, writing a record per episode.
+    # Nothing is published until the first add; until then this is only read from.
+    def _import_legacy(self):
+        if self._imported is not None:
+            return self._imported
+        manifest = {'version': 1, 'next_id': 1, 'pages': [], 'tail': []}
+        try:
+            body, _ = self.storage.get(self.legacy_index)
+        except NotFound:
+            return manifest
+        episodes = json.loads(body)['episodes']
+        print(f'Importing {len(episodes)} episodes from {self.legacy_index}')
+        for episode in episodes:
+            record_body = _dump(episode)
+            self.storage.put(record_key(episode['id']), record_body, content_type='application/json')
+            manifest = self._with_entry(manifest, episode, record_body)
+        self._imported = manifest
+        return manifest
+
+    @staticmethod
+    def _entry(record, body):
+        return {'id': record['id'], 'pub_date': record['pub_date'], 'is_test': record['is_test'], 'hash': _hash(body)}
+
+    def _with_entry(self, manifest, record, body):
+        entry = self._entry(record, body)
+        tail = [existing for existing in manifest['tail'] if existing['id'] != record['id']] + [entry]
+        pages = list(manifest['pages'])
+        if len(tail) > self.page_size:
+            page, tail = tail[:self.page_size], tail[self.page_size:]
+            page_body = _dump(page)
+            key = f'index/pages/{_hash(page_body)}.json'
+            # Content-addressed, so a page written by a writer that then lost the race is harmless
+            self.storage.put(key, page_body, content_type='application/json')
+            pages.append({'key': key, 'count': len(page), 'first_id': page[0]['id'], 'last_id': page[-1]['id']})
+        return {**manifest, 'next_id': max(manifest['next_id'], record['id'] + 1), 'pages': pages, 'tail': tail}
+
+    # Replace the entries of already listed records; sealed pages holding any of them are
+    # written again under their new content hash. Pages are matched by the ids they hold:
+    # entries are in publish order, which concurrent creates can make differ from id order,
+    # so first_id..last_id isn't a range of the page's ids.
+    def _with_updates(self, manifest, updated):
+        def replace(entries):
+            return [updated.get(entry['id'], entry) for entry in entries]
+
+        pages = []
+        for page in manifest['pages']:
+            entries = self._page(page)
+            if not any(entry['id'] in updated for entry in entries):
+                pages.append(page)
+                continue
+            page_body = _dump(replace(entries))
+            key = f'index/pages/{_hash(page_body)}.json'
+            self.storage.put(key, page_body, content_type='application/json')
+            pages.append({**page, 'key': key})
+        return {**manifest, 'pages': pages, 'tail': replace(manifest['tail'])}
+
+    def _page(self, page):
+        name = page['key'].replace('/', '_')
+        entries = self._read_cache(name)
+        if entries is None:
+            body, _ = self.storage.get(page['key'])
+            entries = json.loads(body)
+            self._write_cache(name, entries)
+        return entries
+
+    # Every manifest entry, oldest first
+    def entries(self):
+        manifest, _ = self.manifest()
+        entries = []
+        for page in manifest['pages']:
+            entries.extend(self._page(page))
+        return entries + manifest['tail']
+
+    def record(self, entry):
+        name = f"episodes/{entry['id']:06d}-{entry['hash']}.json"
+        record = self._read_cache(name)
+        if record is None:
+            body, _ = self.storage.get(record_key(entry['id']))
+            record = json.loads(body)
+            if _hash(body) == entry['hash']:
+                self._write_cache(name, record)
+        return record
+
+    def records(self, entries, concurrency=8):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(self.record, entries))
+
+    # Full records for every episode, oldest first
+    def episodes(self):
+        return self.records(self.entries())
+
+    # Full records for the newest count episodes, newest first
+    def recent(self, count, include_test=True):
+        entries = [entry for entry in self.entries() if include_test or not entry['is_test']]
+        entries.sort(key=lambda entry: entry['pub_date'], reverse=True)
+        return self.records(entries[:count])
+
+    # Claim the next free episode id by creating its record; build(episode_id) returns the
+    # record. The episode isn't listed until publish(), so a failed upload in between only
+    # leaves an unlisted record (and a gap in the ids).
+    def create(self, build):
+        manifest, _ = self.manifest(refresh=True)
+        episode_id = manifest['next_id']
+        for _ in range(self.max_attempts):
+            record = build(episode_id)
+            try:
+                self.storage.put(record_key(episode_id), _dump(record), if_none_match='*',
+                                 content_type='application/json')
+                return record
+            except PreconditionFailed:
+                episode_id += 1
+        raise RuntimeError(f'Could not claim an episode id after {self.max_attempts} attempts')
+
+    # Write the manifest made by change(manifest), retrying from a fresh manifest if another
+    # writer got there first
+    def _update_manifest(self, change):
+        for _ in range(self.max_attempts):
+            manifest, etag = self.manifest(refresh=True)
+            updated = change(manifest)
+            try:
+                if etag is None:
+                    etag = self.storage.put(MANIFEST_KEY, _dump(updated), if_none_match='*',
+                                            content_type='application/json', cache_control='no-cache')
+                else:
+                    etag = self.storage.put(MANIFEST_KEY, _dump(updated), if_match=etag,
+                                            content_type='application/json', cache_control='no-cache')
+            except PreconditionFailed:
+                continue
+            self._manifest = (updated, etag)
+            self._write_cache('manifest.json', {'etag': etag, 'manifest': updated})
+            return
+        raise RuntimeError(f'Could not update {MANIFEST_KEY} after {self.max_attempts} attempts')
+
+    # Add a created record to the manifest
+    def publish(self, record):
+        body = _dump(record)
+        self._update_manifest(lambda manifest: self._with_entry(manifest, record, body))
+
+    # Rewrite listed records in place (e.g. to add metadata to old episodes) and point the
+    # manifest at their new hashes in a single manifest update
+    def update_many(self, records, concurrency=8):
+        bodies = [(record, _dump(record)) for record in records]
+        if not bodies:
+            return
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(lambda item: self.storage.put(record_key(item[0]['id']), item[1],
+                                                            content_type='application/json'), bodies))
+        updated = {record['id']: self._entry(record, body) for record, body in bodies}
+        self._update_manifest(lambda manifest: self._with_updates(manifest, updated))
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from xml.sax.saxutils import escape, quoteattr
+
+from publisher import Publisher
+
+# Bump when the item markup changes, so cached fragments are re-rendered
+ITEM_FORMAT_VERSION = 1
+
+FEED_KEYS = {'main': 'podcast.rss', 'test': 'test.rss'}
+ARCHIVE_PAGE_SIZE = 100
+
+
+def archive_key(page):
+    return f'archive/podcast-{page:05d}.rss'
+
+
+def _text(tag, value):
+    return f'<{tag}>{escape(str(value))}</{tag}>'
+
+
+# Builds the RSS feeds straight from the episode index. Each <item> is rendered once and
+# cached (in memory and under cache_dir) by the hash of the episode's record, so a warm run
+# renders only new or changed episodes and never fetches the records of the others. Main,
+# test and archive feeds are assembled in one pass over the manifest.
+#
+# With max_items the main feed holds just the newest episodes and older ones go to an
+# RFC 5005 paged archive: fixed-size pages, oldest first, linked by prev-archive. Full
+# pages never change, so each upload writes the capped feeds and at most one archive page
+# however long the show runs.
+class FeedBuilder:
+    def __init__(self, index, channel, cache_dir='.podcast_cache', max_items=None, archive_page_size=ARCHIVE_PAGE_SIZE):
+        self.index = index
+        self.channel = channel
+        self.max_items = max_items
+        self.archive_page_size = archive_page_size
+        self.cache_root = cache_dir
+        self.cache_dir = os.path.join(cache_dir, index.storage.cache_id, 'feed_items')
+        self.items_rendered = 0
+        self._fragments = {}
+        # Fragments also depend on the channel settings they embed
+        settings = json.dumps([ITEM_FORMAT_VERSION, channel['url'], channel['author'], channel['explicit']])
+        self._salt = hashlib.sha256(settings.encode('utf-8')).hexdigest()[:8]
+
+    def render_item(self, episode):
+        url = f"{self.channel['url']}/{episode['mp3_key']}"
+        # Stored as naive UTC in older records; the original feed treated them all as UTC
+        pub_date = datetime.fromisoformat(episode['pub_date']).replace(tzinfo=timezone.utc)
+        return ''.join([
+            '<item>',
+            _text('title', episode['title']),
+            _text('description', episode['summary']),
+            f'<guid isPermaLink="false">{escape(url)}</guid>',
+            f"<enclosure url={quoteattr(url)} length=\"{int(episode.get('length') or 0)}\" type=\"audio/mpeg\"/>",
+            _text('pubDate', format_datetime(pub_date)),
+            _text('itunes:author', self.channel['author']),
+            _text('itunes:explicit', self.channel['explicit']),
+            _text('itunes:duration', episode.get('duration', '')),
+            '</item>',
+        ])
+
+    def _fragment_path(self, entry):
+        return os.path.join(self.cache_dir, f"{entry['hash']}-{self._salt}.xml")
+
+    def _cached_fragment(self, entry):
+        key = (entry['hash'], self._salt)
+        if key not in self._fragments:
+            try:
+                with open(self._fragment_path(entry), 'r', encoding='utf-8') as file:
+                    self._fragments[key] = file.read()
+            except FileNotFoundError:
+                return None
+        return self._fragments[key]
+
+    def _store_fragment(self, entry, fragment):
+        self._fragments[(entry['hash'], self._salt)] = fragment
+        self.items_rendered += 1
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._fragment_path(entry)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(fragment)
+        os.replace(temp_path, path)
+
+    # Rendered <item>s for manifest entries. Only entries without a cached fragment have
+    # their records fetched (concurrently) and rendered.
+    def fragments(self, entries):
+        missing = [entry for entry in entries if self._cached_fragment(entry) is None]
+        for entry, record in zip(missing, self.index.records(missing)):
+            self._store_fragment(entry, self.render_item(record))
+        return [self._cached_fragment(entry) for entry in entries]
+
+    def _channel_xml(self, title, items, prev_archive=None, archive=False):
+        channel = self.channel
+        links = f"<atom:link rel=\"current\" href={quoteattr(channel['url'] + '/' + FEED_KEYS['main'])}/>"
+        if prev_archive:
+            links += f"<atom:link rel=\"prev-archive\" href={quoteattr(channel['url'] + '/' + prev_archive)}/>"
+        if archive:
+            links += '<fh:archive/>'
+        return ''.join([
+            '<?xml version="1.0" encoding="UTF-8"?>\n',
+            '<rss version="2.0" xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd" '
+            'xmlns:atom="http://www.w3.org/2005/Atom" xmlns:fh="http://purl.org/syndication/history/1.0"><channel>',
+            _text('title', title),
+            links,
+            _text('link', channel['url']),
+            _text('description', channel['subtitle']),
+            _text('language', channel['language']),
+            f"<image><url>{escape(channel['logo'])}</url>{_text('title', title)}{_text('link', channel['url'])}</image>",
+            _text('itunes:author', channel['author']),
+            f"<itunes:category text={quoteattr(channel['category'])}>"
+            f"<itunes:category text={quoteattr(channel['subcategory'])}/></itunes:category>",
+            _text('itunes:explicit', channel['explicit']),
+            f"<itunes:owner>{_text('itunes:name', channel['author'])}{_text('itunes:email', channel['email'])}</itunes:owner>",
+            f"<itunes:image href={quoteattr(channel['logo'])}/>",
+        ] + items + ['</channel></rss>\n'])
+
+    # [(feed type, key, RSS document)] for the main and test feeds and, when capped, each
+    # archive page; items newest first within a feed
+    def build(self):
+        main, test = [], []
+        # pub_dates are ISO strings, so they sort chronologically without parsing
+        for entry in sorted(self.index.entries(), key=lambda entry: entry['pub_date'], reverse=True):
+            (test if entry['is_test'] else main).append(entry)
+
+        title = self.channel['title']
+        cap = self.max_items
+        archived = list(reversed(main[cap:])) if cap is not None else []
+        pages = [archived[start:start + self.archive_page_size]
+                 for start in range(0, len(archived), self.archive_page_size)]
+        feeds = [
+            ('main', FEED_KEYS['main'], self._channel_xml(title, self.fragments(main[:cap]),
+                                                          archive_key(len(pages) - 1) if pages else None)),
+            ('test', FEED_KEYS['test'], self._channel_xml(title, self.fragments(test[:cap]))),
+        ]
+        for number, page in enumerate(pages):
+            feeds.append(('archive', archive_key(number), self._channel_xml(
+                f'{title} (archive {number + 1})', self.fragments(page[::-1]),
+                archive_key(number - 1) if number else None, archive=True)))
+        return feeds
+
+    def _marker_path(self, key):
+        return os.path.join(self.cache_dir, 'published', key.replace('/', '_') + '.sha256')
+
+    # [(key, body)] for the feeds (or just the given types) whose content changed since the
+    # last publish from this cache
+    def changed(self, feed_types=None):
+        documents = []
+        for feed_type, key, document in self.build():
+            if feed_types is not None and feed_type not in feed_types:
+                continue
+            body = document.encode('utf-8')
+            try:
+                with open(self._marker_path(key), 'r') as file:
+                    if file.read() == hashlib.sha256(body).hexdigest():
+                        continue
+            except FileNotFoundError:
+                pass
+            documents.append((key, body))
+        return documents
+
+    def mark_published(self, documents):
+        for key, body in documents:
+            os.makedirs(os.path.dirname(self._marker_path(key)), exist_ok=True)
+            with open(self._marker_path(key), 'w') as file:
+                file.write(hashlib.sha256(body).hexdigest())
+
+    # Build the feeds and upload the ones that changed in one concurrent batch. Returns the keys written.
+    def publish(self, feed_types=None, publisher=None):
+        publisher = publisher or Publisher(self.index.storage, self.cache_root)
+        documents = self.changed(feed_types)
+        written = publisher.put_many(documents)
+        self.mark_published(documents)
+        return written
@@ -0,0 +1,128 @@
+import hashlib
+import heapq
+import html
+import json
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HN_ITEM_URL = "https://hacker-news.firebaseio.com/v0/item/{id}.json"
+
+
+# Conditional-GET cache on disk: one JSON file per URL holding the validators
+# (ETag, Last-Modified) and the body they belong to
+class HttpCache:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode("utf-8")).hexdigest()[:32] + ".json")
+
+    def load(self, url):
+        try:
+            with open(self._path(url), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def store(self, url, etag, last_modified, body):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump({"url": url, "etag": etag, "last_modified": last_modified, "body": body}, file)
+        os.replace(temp_path, self._path(url))
+
+
+# Fetches JSON over one pooled, retrying session. Every response with an ETag or
+# Last-Modified is kept in an HttpCache and revalidated next time, so an unchanged
+# document costs a 304 with no body. get_many fans out over a thread pool sized to
+# the connection pool.
+class Fetcher:
+    def __init__(self, cache_dir=".hn_cache", timeout=10, concurrency=8, session=None):
+        self.cache = HttpCache(cache_dir) if cache_dir else None
+        self.timeout = timeout
+        self.concurrency = concurrency
+        if session is None:
+            session = requests.Session()
+            retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                          allowed_methods=("GET",))
+            adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency, max_retries=retry)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+        self.stats = {"requests": 0, "not_modified": 0, "downloaded_bytes": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self.stats[name] += value
+
+    def get_json(self, url):
+        cached = self.cache.load(url) if self.cache else None
+        headers = {}
+        if cached:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and cached:
+            self._count(requests=1, not_modified=1)
+            return json.loads(cached["body"])
+        response.raise_for_status()
+        self._count(requests=1, downloaded_bytes=len(response.content))
+        body = response.text
+        etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+        if self.cache and (etag or last_modified):
+            self.cache.store(url, etag, last_modified, body)
+        return json.loads(body)
+
+    # Results in the order of urls
+    def get_many(self, urls):
+        urls = list(urls)
+        if len(urls) <= 1:
+            return [self.get_json(url) for url in urls]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(self.get_json, urls))
+
+
+# The k highest-scoring stories in O(n log k), best first
+def top_stories(stories, k, key="points"):
+    return heapq.nlargest(k, stories, key=lambda story: story.get(key) or 0)
+
+
+def _plain_text(markup):
+    return html.unescape(re.sub(r"<[^>]+>", " ", markup or "")).strip()
+
+
+# Expand a feed that only lists ids (like the HN API's topstories.json) into stories
+# shaped like the quackernews feed: title, points, first_paragraph and comments.
+# The first candidates ids are fetched concurrently (feeds are ranked, so the best
+# scoring stories are among them), then the top k of those get their first
+# comments_per_story comments fetched concurrently too.
+def expand_story_ids(fetcher, ids, k, candidates=30, comments_per_story=3, item_url=HN_ITEM_URL):
+    items = [item for item in fetcher.get_many(item_url.format(id=story_id) for story_id in ids[:candidates])
+             if item and not item.get("deleted") and not item.get("dead")]
+    best = top_stories(items, k, key="score")
+    kids = [item.get("kids", [])[:comments_per_story] for item in best]
+    comments = iter(fetcher.get_many(item_url.format(id=comment_id) for ids in kids for comment_id in ids))
+    stories = []
+    for item, comment_ids in zip(best, kids):
+        texts = [_plain_text(comment.get("text")) for comment in [next(comments) for _ in comment_ids]
+                 if comment and not comment.get("deleted") and not comment.get("dead")]
+        stories.append({
+            "id": item["id"],
+            "title": item.get("title", ""),
+            "url": item.get("url", ""),
+            "points": item.get("score", 0),
+            "first_paragraph": _plain_text(item.get("text")) or item.get("url", ""),
+            "comments": texts,
+        })
+    return stories
@@ -0,0 +1,172 @@
+import json
+import os
+
+import numpy as np
+
+from instrumentation import NULL_RECORDER
+from segment_cache import atomic_write
+
+
+def manifest_path(output_file):
+    return f"{output_file}.manifest.json"
+
+
+def master_path(output_file):
+    return f"{output_file}.master.npy"
+
+
+# The first frame at which two automation curves can differ, or None if they are the same.
+# Up to the first differing point they agree, and further if both hold the same value
+# flat into it.
+def _automation_divergence(old, new):
+    if old == new:
+        return None
+    index = 0
+    while index < min(len(old), len(new)) and old[index] == new[index]:
+        index += 1
+    if index == 0:
+        return 0
+    frame, value = old[index - 1]
+    ends = [points[index][0] for points in (old, new) if index < len(points)]
+    if all(points[index][1] == value for points in (old, new) if index < len(points)):
+        return min(ends)
+    return frame
+
+
+# The first frame at which two manifests' placed clips and automation can differ, or None
+def _tracks_divergence(old_tracks, new_tracks):
+    frames = []
+    for name in set(old_tracks) | set(new_tracks):
+        old, new = old_tracks.get(name, {}), new_tracks.get(name, {})
+        old_clips, new_clips = old.get("clips", []), new.get("clips", [])
+        for old_clip, new_clip in zip(old_clips, new_clips):
+            if old_clip != new_clip:
+                if old_clip[:2] == new_clip[:2] and old_clip[3] == new_clip[3]:
+                    # Only the end moved (a loop running longer or shorter)
+                    frames.append(min(end for end in (old_clip[2], new_clip[2]) if end is not None))
+                else:
+                    frames.append(min(old_clip[1], new_clip[1]))
+        frames.extend(clip[1] for clip in old_clips[len(new_clips):] + new_clips[len(old_clips):])
+        for parameter in ("gain", "pan"):
+            frame = _automation_divergence(old.get(parameter, [[0, 1.0 if parameter == "gain" else 0.0]]),
+                                           new.get(parameter, [[0, 1.0 if parameter == "gain" else 0.0]]))
+            if frame is not None:
+                frames.append(frame)
+    return min(frames) if frames else None
+
+
+# Compare two timeline manifests and return the frames that need re-rendering as
+# (start, new_end, old_end): frames before start are identical in both, and new frames
+# from new_end on equal old frames from old_end on. Returns None if nothing changed.
+#
+# Placed clips (e.g. the ambiance bed) sit at absolute frames, so when the sequence gets
+# longer or shorter under them the old tail no longer lines up and everything from the
+# first change on is rendered again.
+def changed_span(old, new):
+    if old.get("version") != new.get("version"):
+        return 0, new["frames"], old["frames"]
+    span = _sequence_span(old, new)
+    old_tracks, new_tracks = old.get("tracks", {}), new.get("tracks", {})
+    if not (old_tracks or new_tracks):
+        return span
+    divergence = _tracks_divergence(old_tracks, new_tracks)
+    if divergence is None and (span is None or old["frames"] == new["frames"]):
+        return span
+    start = min(frame for frame in (divergence, span and span[0]) if frame is not None)
+    return start, new["frames"], old["frames"]
+
+
+def _sequence_span(old, new):
+    old_clips, new_clips = old["clips"], new["clips"]
+    if any(clip[0] is None for clip in old_clips + new_clips):
+        return 0, new["frames"], old["frames"]
+    if old_clips == new_clips and old["frames"] == new["frames"]:
+        return None
+
+    # Clips identical at the same position from the start...
+    prefix = 0
+    while prefix < min(len(old_clips), len(new_clips)) and old_clips[prefix] == new_clips[prefix]:
+        prefix += 1
+    # ...and identical at the same distance from the end
+    suffix = 0
+    while suffix < min(len(old_clips), len(new_clips)) - prefix:
+        old_clip, new_clip = old_clips[-1 - suffix], new_clips[-1 - suffix]
+        if old_clip[0] != new_clip[0] or old_clip[2:] != new_clip[2:] \
+                or old["frames"] - old_clip[1] != new["frames"] - new_clip[1]:
+            break
+        suffix += 1
+
+    delta = old["frames"] - new["frames"]
+    start = min(clip[1] for clip in old_clips[prefix:] + new_clips[prefix:])
+    new_end = max(
+        [clip[1] + clip[2] for clip in new_clips[:len(new_clips) - suffix]]
+        + [clip[1] + clip[2] - delta for clip in old_clips[:len(old_clips) - suffix]]
+        + [start, start - delta]
+    )
+    return start, new_end, new_end + delta
+
+
+def _load_previous(output_file, frame_rate, channels):
+    if not (os.path.exists(manifest_path(output_file)) and os.path.exists(master_path(output_file))):
+        return None, None
+    with open(manifest_path(output_file), "r") as file:
+        manifest = json.load(file)
+    master = np.load(master_path(output_file), mmap_mode="r")
+    if manifest["frame_rate"] != frame_rate or manifest["channels"] != channels or len(master) != manifest["frames"]:
+        return None, None
+    return manifest, master
+
+
+def _save(output_file, manifest, fill):
+    def write_master(temp_path):
+        master = np.lib.format.open_memmap(temp_path, mode="w+", dtype=np.int16,
+                                           shape=(manifest["frames"], manifest["channels"]))
+        fill(master)
+        master.flush()
+        del master
+
+    def write_manifest(temp_path):
+        with open(temp_path, "w") as file:
+            json.dump(manifest, file)
+
+    atomic_write(os.path.abspath(master_path(output_file)), write_master)
+    atomic_write(os.path.abspath(manifest_path(output_file)), write_manifest)
+
+
+# Render the timeline, reusing the master PCM persisted by the previous render of
+# output_file: only the span between the first and last changed clip is mixed again and
+# spliced between the unchanged head and tail. Returns the episode samples.
+def render_incremental(timeline, output_file, recorder=NULL_RECORDER):
+    manifest = timeline.manifest()
+    previous, old_master = _load_previous(output_file, timeline.frame_rate, timeline.channels)
+
+    if previous is None:
+        print("No previous render to reuse; rendering the whole episode")
+        samples = timeline.render()
+        recorder.set("rerendered_frames", len(samples))
+
+        def fill(master):
+            master[:] = samples
+
+        _save(output_file, manifest, fill)
+        return samples
+
+    span = changed_span(previous, manifest)
+    if span is None:
+        print("Episode unchanged since the last render")
+        recorder.set("rerendered_frames", 0)
+        return old_master
+
+    start, new_end, old_end = span
+    middle = timeline.render(start, new_end)
+    print(f"Re-rendered {(new_end - start) / timeline.frame_rate:.1f} s of "
+          f"{manifest['frames'] / timeline.frame_rate:.1f} s")
+    recorder.set("rerendered_frames", new_end - start)
+
+    def fill(master):
+        master[:start] = old_master[:start]
+        master[start:new_end] = middle
+        master[new_end:] = old_master[old_end:]
+
+    _save(output_file, manifest, fill)
+    return np.load(master_path(output_file), mmap_mode="r")
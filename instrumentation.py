@@ -0,0 +1,123 @@
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF):
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# Records per-stage wall/CPU time and peak RSS, counters (bytes, cache hits) and
+# per-item observations (TTS latency), and writes them as a JSON run report and
+# optionally a Chrome trace (load it in chrome://tracing or ui.perfetto.dev).
+class Recorder:
+    enabled = True
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = []
+        self.counters = {}
+        self.observations = {}
+        self.events = []
+        self._lock = threading.Lock()
+
+    def _event(self, name, start, duration, args=None):
+        self.events.append({
+            "name": name,
+            "ph": "X",
+            "ts": round((start - self.started) * 1e6),
+            "dur": round(duration * 1e6),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": args or {},
+        })
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - wall
+            record = {
+                "name": name,
+                "start_s": round(wall - self.started, 4),
+                "wall_s": round(duration, 4),
+                "cpu_s": round(time.process_time() - cpu, 4),
+                "peak_rss_mb": round(_peak_rss_mb(), 1),
+                "children_peak_rss_mb": round(_peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+            }
+            with self._lock:
+                self.stages.append(record)
+                self._event(name, wall, duration, {"cpu_s": record["cpu_s"]})
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    # Record one measurement (e.g. a TTS request's latency); started, if given, also adds a trace span
+    def observe(self, name, value, started=None):
+        with self._lock:
+            self.observations.setdefault(name, []).append(value)
+            if started is not None:
+                self._event(name, started, value)
+
+    def set(self, name, value):
+        with self._lock:
+            self.counters[name] = value
+
+    def report(self):
+        summaries = {}
+        for name, values in self.observations.items():
+            ordered = sorted(values)
+            summaries[name] = {
+                "count": len(ordered),
+                "total": round(sum(ordered), 4),
+                "mean": round(sum(ordered) / len(ordered), 4),
+                "p50": round(ordered[len(ordered) // 2], 4),
+                "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4),
+                "max": round(ordered[-1], 4),
+            }
+        return {
+            "total_wall_s": round(time.perf_counter() - self.started, 4),
+            "peak_rss_mb": round(_peak_rss_mb(), 1),
+            "stages": self.stages,
+            "counters": self.counters,
+            "observations": summaries,
+        }
+
+    def write_report(self, path):
+        with open(path, "w") as file:
+            json.dump(self.report(), file, indent=2)
+
+    def write_trace(self, path):
+        with open(path, "w") as file:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, file)
+
+
+# Stand-in used when instrumentation is off: every call is a no-op
+class NullRecorder:
+    enabled = False
+    _stage = contextlib.nullcontext()
+
+    def stage(self, name):
+        return self._stage
+
+    def count(self, name, amount=1):
+        pass
+
+    def observe(self, name, value, started=None):
+        pass
+
+    def set(self, name, value):
+        pass
+
+
+NULL_RECORDER = NullRecorder()
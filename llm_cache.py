@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+# Same model and messages -> same request, so the same (cached) conversation
+def request_key(model, messages):
+    digest = hashlib.sha256()
+    digest.update(json.dumps([model, messages], sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Cache of chat completions by request, in sqlite under cache_dir, so rerunning the script
+# generator on the same stories doesn't pay for the same prompt again. Entries older than
+# ttl_seconds are treated as missing (the stories of the day have moved on); evict() drops
+# those and then the least recently used entries beyond max_entries.
+class ResponseCache:
+    def __init__(self, cache_dir=".llm_cache", ttl_seconds=24 * 3600, max_entries=500):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(cache_dir, "responses.db"), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, content TEXT NOT NULL, prompt_tokens INTEGER, "
+            "completion_tokens INTEGER, created REAL, last_used REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.db.commit()
+
+    def _expired(self, created):
+        return self.ttl_seconds is not None and created < time.time() - self.ttl_seconds
+
+    # The cached response content for this request, or None if it has to be sent
+    def lookup(self, model, messages):
+        key = request_key(model, messages)
+        with self._lock:
+            row = self.db.execute(
+                "SELECT content, prompt_tokens, completion_tokens, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row and not self._expired(row[3]):
+                self.db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+                self.db.commit()
+                self.hits += 1
+                self.tokens_saved += (row[1] or 0) + (row[2] or 0)
+                return row[0]
+            self.misses += 1
+            return None
+
+    def store(self, model, messages, content, prompt_tokens=None, completion_tokens=None):
+        now = time.time()
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, content, prompt_tokens, completion_tokens, created, "
+                "last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (request_key(model, messages), model, content, prompt_tokens, completion_tokens, now, now),
+            )
+            self.db.commit()
+
+    def evict(self):
+        with self._lock:
+            evicted = 0
+            if self.ttl_seconds is not None:
+                evicted += self.db.execute("DELETE FROM responses WHERE created < ?",
+                                           (time.time() - self.ttl_seconds,)).rowcount
+            if self.max_entries is not None:
+                evicted += self.db.execute(
+                    "DELETE FROM responses WHERE key NOT IN "
+                    "(SELECT key FROM responses ORDER BY last_used DESC LIMIT ?)", (self.max_entries,)
+                ).rowcount
+            self.db.commit()
+        return evicted
+
+    def print_stats(self):
+        print(f"LLM cache: {self.hits} hits, {self.misses} misses, {self.tokens_saved} tokens saved this run")
+
+    def close(self):
+        self.db.close()
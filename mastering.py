@@ -0,0 +1,288 @@
+import math
+import tempfile
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from mixer import EPISODE_CHANNELS, EPISODE_FRAME_RATE, ms_to_frames
+
+try:
+    from scipy.signal import sosfilt
+except ImportError:
+    sosfilt = None
+
+# What podcast platforms normalize to, and the true-peak ceiling that leaves room for
+# their lossy encoders
+TARGET_LUFS = -16.0
+TRUE_PEAK_CEILING_DB = -1.0
+
+# BS.1770 gating: 400 ms blocks every 100 ms, absolute gate at -70 LUFS, relative gate
+# 10 LU below the absolutely-gated loudness
+HOP_MS = 100
+HOPS_PER_BLOCK = 4
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+
+# The meter filters a fixed number of hops at a time, so its result doesn't depend on
+# how the audio was chunked when it was handed over
+HOPS_PER_GROUP = 16
+
+# Limiter: gain comes down over LOOKAHEAD_MS before a peak and stays down HOLD_MS after it
+LOOKAHEAD_MS = 5
+HOLD_MS = 50
+BLOCK_FRAMES = 1 << 16
+
+# True peak: 4x oversampling with a 48-tap windowed-sinc interpolator, as in BS.1770 annex 2
+OVERSAMPLE = 4
+PHASE_TAPS = 12
+
+# Length of the K-weighting impulse response used when scipy isn't installed
+K_WEIGHTING_TAPS = 1 << 14
+
+
+# The two K-weighting biquads (high shelf, then RLB high-pass) for any frame rate, as
+# second-order sections
+def k_weighting(frame_rate):
+    gain_db, q, centre = 3.99984385397, 0.7071752369554193, 1681.974450955533
+    k = math.tan(math.pi * centre / frame_rate)
+    vh = 10 ** (gain_db / 20)
+    vb = vh ** 0.499666774155
+    a0 = 1 + k / q + k * k
+    shelf = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0,
+             1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    q, centre = 0.5003270373238773, 38.13547087602444
+    k = math.tan(math.pi * centre / frame_rate)
+    a0 = 1 + k / q + k * k
+    high_pass = [1.0, -2.0, 1.0, 1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return np.array([shelf, high_pass])
+
+
+# K-weighting as a stateful filter over consecutive chunks: scipy's sosfilt if it is
+# installed, else FFT convolution with the filter's (truncated) impulse response
+class KWeighting:
+    def __init__(self, frame_rate, channels):
+        self.sos = k_weighting(frame_rate)
+        if sosfilt is not None:
+            self.state = np.zeros((len(self.sos), 2, channels))
+            return
+        impulse = np.zeros(K_WEIGHTING_TAPS)
+        impulse[0] = 1.0
+        for b0, b1, b2, _, a1, a2 in self.sos:
+            impulse = self._biquad(impulse, b0, b1, b2, a1, a2)
+        self.impulse = impulse
+        self.tail = np.zeros((K_WEIGHTING_TAPS - 1, channels))
+
+    @staticmethod
+    def _biquad(x, b0, b1, b2, a1, a2):
+        y = np.zeros_like(x)
+        x1 = x2 = y1 = y2 = 0.0
+        for n, value in enumerate(x.tolist()):
+            y[n] = out = b0 * value + b1 * x1 + b2 * x2 - a1 * y1 - a2 * y2
+            x2, x1, y2, y1 = x1, value, y1, out
+        return y
+
+    def __call__(self, x):
+        if sosfilt is not None:
+            y, self.state = sosfilt(self.sos, x, axis=0, zi=self.state)
+            return y
+        size = len(x) + K_WEIGHTING_TAPS - 1
+        fft_size = 1 << (size - 1).bit_length()
+        y = np.fft.irfft(np.fft.rfft(x, fft_size, axis=0) * np.fft.rfft(self.impulse, fft_size)[:, None],
+                         fft_size, axis=0)[:size]
+        y[:K_WEIGHTING_TAPS - 1] += self.tail
+        self.tail = y[len(x):].copy()
+        return y[:len(x)]
+
+
+# Integrated loudness (BS.1770-4, LUFS) of int16 audio handed over in chunks of any size
+class LoudnessMeter:
+    def __init__(self, frame_rate=EPISODE_FRAME_RATE, channels=EPISODE_CHANNELS):
+        self.hop = ms_to_frames(HOP_MS, frame_rate)
+        self.group = self.hop * HOPS_PER_GROUP
+        self.filter = KWeighting(frame_rate, channels)
+        self.pending = []
+        self.pending_frames = 0
+        # Mean square per hop, summed over channels (all weighted 1 for mono and stereo)
+        self.hop_powers = []
+
+    def add(self, samples):
+        if not len(samples):
+            return
+        self.pending.append(samples)
+        self.pending_frames += len(samples)
+        if self.pending_frames < self.group:
+            return
+        data = np.concatenate(self.pending)
+        whole = len(data) - len(data) % self.group
+        for start in range(0, whole, self.group):
+            self._measure(data[start:start + self.group])
+        self.pending = [data[whole:]]
+        self.pending_frames = len(data) - whole
+
+    # samples must be a whole number of hops, so the filter state carries over exactly
+    def _measure(self, samples):
+        hops = len(samples) // self.hop
+        if hops == 0:
+            return
+        filtered = self.filter(samples.astype(np.float64) / 32768)
+        squares = np.square(filtered).reshape(hops, self.hop, -1)
+        self.hop_powers.append(squares.mean(axis=1).sum(axis=1))
+
+    # Loudness of everything added so far (a partial last hop isn't counted yet; it stays
+    # pending for later add()s); -inf for silence
+    def integrated(self):
+        if self.pending_frames >= self.hop:
+            data = np.concatenate(self.pending)
+            whole = len(data) - len(data) % self.hop
+            self._measure(data[:whole])
+            self.pending = [data[whole:]]
+            self.pending_frames = len(data) - whole
+        powers = np.concatenate(self.hop_powers) if self.hop_powers else np.zeros(0)
+        if len(powers) < HOPS_PER_BLOCK:
+            return -math.inf
+        blocks = sliding_window_view(powers, HOPS_PER_BLOCK).mean(axis=1)
+        with np.errstate(divide="ignore"):
+            loudness = -0.691 + 10 * np.log10(blocks)
+        gated = blocks[loudness > ABSOLUTE_GATE_LUFS]
+        if not len(gated):
+            return -math.inf
+        relative_gate = -0.691 + 10 * math.log10(gated.mean()) + RELATIVE_GATE_LU
+        gated = blocks[(loudness > ABSOLUTE_GATE_LUFS) & (loudness > relative_gate)]
+        return -0.691 + 10 * math.log10(gated.mean())
+
+
+def _oversampling_phases():
+    taps = np.arange(OVERSAMPLE * PHASE_TAPS) - (OVERSAMPLE * PHASE_TAPS - 1) / 2
+    kernel = np.sinc(taps / OVERSAMPLE) * np.kaiser(len(taps), 8.0)
+    # phases[k, p] weights sample n - k for output 4n + p; each phase passes DC at unity
+    phases = kernel.reshape(PHASE_TAPS, OVERSAMPLE)
+    return (phases / phases.sum(axis=0))[::-1].astype(np.float32)
+
+
+_PHASES = _oversampling_phases()
+
+
+# Per-frame true peak (linear, across channels) of x, which carries PHASE_TAPS // 2 frames
+# of context before and PHASE_TAPS // 2 - 1 after the frames measured
+def _true_peaks(x):
+    frames = len(x) - PHASE_TAPS + 1
+    # Shifted copies of x stacked so all four phases are one matrix product
+    shifted = np.stack([x[tap:tap + frames] for tap in range(PHASE_TAPS)]).reshape(PHASE_TAPS, -1)
+    oversampled = _PHASES.T @ shifted
+    peaks = np.maximum(oversampled.max(axis=0), -oversampled.min(axis=0)).reshape(frames, -1)
+    peaks = np.maximum(peaks, np.abs(x[PHASE_TAPS // 2:PHASE_TAPS // 2 + frames]))
+    # Linked across channels; a loop over the (few) channels beats reducing a short axis
+    linked = peaks[:, 0].copy()
+    for channel in range(1, peaks.shape[1]):
+        np.maximum(linked, peaks[:, channel], out=linked)
+    return linked
+
+
+# Highest true peak of int16 audio handed over in consecutive chunks
+class TruePeakMeter:
+    def __init__(self, channels=EPISODE_CHANNELS):
+        self.context = np.zeros((PHASE_TAPS // 2, channels), dtype=np.float32)
+        self.peak = 0.0
+
+    def add(self, samples):
+        x = np.concatenate([self.context, samples.astype(np.float32) / 32768])
+        if len(x) >= PHASE_TAPS:
+            self.peak = max(self.peak, float(_true_peaks(x).max()))
+        self.context = x[-(PHASE_TAPS - 1):]
+
+    def finish(self):
+        self.add(np.zeros((PHASE_TAPS // 2, self.context.shape[1]), dtype=np.int16))
+        return self.peak
+
+    def peak_db(self):
+        return 20 * math.log10(self.peak) if self.peak > 0 else -math.inf
+
+
+# out[n] = min(x[n - before], ..., x[n + after]) in O(len(x)) (van Herk / Gil-Werman);
+# beyond the ends x counts as 1 (no gain reduction)
+def _sliding_min(x, before, after):
+    width = before + after + 1
+    padded = np.pad(x, (before, after + (-(len(x) + width - 1) % width)), constant_values=1.0)
+    blocks = padded.reshape(-1, width)
+    prefix = np.minimum.accumulate(blocks, axis=1).ravel()
+    suffix = np.minimum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    return np.minimum(suffix[:len(x)], prefix[width - 1:width - 1 + len(x)])
+
+
+def mastering_gain_db(loudness, target_lufs=TARGET_LUFS):
+    return target_lufs - loudness if math.isfinite(loudness) else 0.0
+
+
+# Apply gain_db to samples and limit true peaks to ceiling_db, handing the result to sink
+# block by block; samples can be a memory-mapped file. Each block is computed from its
+# own frames plus a little context on either side, so the output doesn't depend on how
+# it is blocked. Returns the output's (integrated loudness, true peak in dBTP).
+def master(samples, gain_db, sink, frame_rate=EPISODE_FRAME_RATE, ceiling_db=TRUE_PEAK_CEILING_DB,
+           block_frames=BLOCK_FRAMES):
+    frames, channels = samples.shape
+    gain = np.float32(10 ** (gain_db / 20) / 32768)
+    ceiling = 10 ** (ceiling_db / 20)
+    lookahead = ms_to_frames(LOOKAHEAD_MS, frame_rate)
+    hold = ms_to_frames(HOLD_MS, frame_rate)
+    half = PHASE_TAPS // 2
+    loudness = LoudnessMeter(frame_rate, channels)
+    true_peak = TruePeakMeter(channels)
+
+    for start in range(0, frames, block_frames):
+        end = min(start + block_frames, frames)
+        # Enough context for the true peaks behind the gain curve around [start, end)
+        low, high = start - lookahead - hold - half, end + lookahead + half
+        x = np.zeros((high - low, channels), dtype=np.float32)
+        x[max(low, 0) - low:min(high, frames) - low] = samples[max(low, 0):min(high, frames)]
+        x *= gain
+
+        # Gain each frame needs, held for the lookahead and hold around every peak...
+        required = np.minimum(1.0, ceiling / np.maximum(_true_peaks(x), 1e-9))
+        held = _sliding_min(required, hold, lookahead)[hold:hold + end - start + lookahead]
+        # ...then ramped over the lookahead, so it is fully down by each peak
+        sums = np.concatenate([[0.0], np.cumsum(held, dtype=np.float64)])
+        curve = ((sums[lookahead + 1:] - sums[:-(lookahead + 1)]) / (lookahead + 1)).astype(np.float32)
+
+        offset = start - low
+        out = x[offset:offset + end - start] * curve[:, None] * np.float32(32768)
+        out = np.clip(out, -32768, 32767, out=out).astype(np.int16)
+        loudness.add(out)
+        true_peak.add(out)
+        sink(out)
+    true_peak.finish()
+    return loudness.integrated(), true_peak.peak_db()
+
+
+# Int16 PCM parked in a temporary file, for audio that is mixed before its loudness is
+# known; samples() maps it back without reading it into memory
+class PcmSpool:
+    def __init__(self, channels=EPISODE_CHANNELS, directory=None):
+        self.channels = channels
+        self.frames = 0
+        self.file = tempfile.TemporaryFile(dir=directory)
+
+    def write(self, samples):
+        self.file.write(np.ascontiguousarray(samples, dtype=np.int16).tobytes())
+        self.frames += len(samples)
+
+    def samples(self):
+        self.file.flush()
+        if not self.frames:
+            return np.zeros((0, self.channels), dtype=np.int16)
+        return np.memmap(self.file, dtype=np.int16, mode="r", shape=(self.frames, self.channels))
+
+    def close(self):
+        self.file.close()
+
+
+def _format_db(value, unit):
+    return f"{value:.1f} {unit}" if math.isfinite(value) else f"-inf {unit}"
+
+
+# Print and record what mastering did
+def report(recorder, loudness, gain_db, output_loudness, true_peak_db):
+    print(f"Loudness {_format_db(loudness, 'LUFS')}, gain {gain_db:+.1f} dB -> {_format_db(output_loudness, 'LUFS')}, "
+          f"true peak {_format_db(true_peak_db, 'dBTP')}")
+    for name, value in (("loudness_lufs", loudness), ("mastering_gain_db", gain_db),
+                        ("output_loudness_lufs", output_loudness), ("true_peak_dbtp", true_peak_db)):
+        recorder.set(name, round(value, 2) if math.isfinite(value) else None)
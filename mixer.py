@@ -0,0 +1,332 @@
+from dataclasses import dataclass
+
+import numpy as np
+from pydub import AudioSegment
+
+EPISODE_FRAME_RATE = 44100
+EPISODE_CHANNELS = 2
+
+
+def ms_to_frames(ms, frame_rate):
+    return int(round(ms * frame_rate / 1000))
+
+
+# Convert a pydub segment into an int16 (frames, channels) array at the episode frame rate
+def to_array(audio, frame_rate=EPISODE_FRAME_RATE):
+    audio = audio.set_frame_rate(frame_rate).set_sample_width(2)
+    return np.frombuffer(audio.raw_data, dtype=np.int16).reshape(-1, audio.channels)
+
+
+def to_audio(samples, frame_rate=EPISODE_FRAME_RATE):
+    return AudioSegment(data=samples.tobytes(), sample_width=2, frame_rate=frame_rate, channels=samples.shape[1])
+
+
+# Bumped whenever mixing changes what a layout renders to, so an incremental render never
+# splices new audio into a master rendered the old way
+MIX_VERSION = 2
+
+# Frames mixed at a time when tracks are summed, so the float working set stays small
+BLOCK_FRAMES = 1 << 16
+
+MAIN_TRACK = "main"
+
+
+# A clip placed at an absolute frame on a track, outside the sequence. A looped clip
+# repeats from offset until end (None while it is still open).
+@dataclass(slots=True)
+class PlacedClip:
+    samples: np.ndarray
+    offset: int
+    track: str
+    clip_id: str
+    loop: bool = False
+    end: int = None
+
+
+# Piecewise-linear automation: (frame, value) points, constant before the first and after
+# the last. A scalar for blocks where it doesn't change, else one value per frame.
+def _automation(points, start, end):
+    frames, values = zip(*points)
+    first, last = np.interp([start, end - 1], frames, values)
+    if first == last and not any(start < frame < end - 1 for frame in frames):
+        return np.float32(first)
+    return np.interp(np.arange(start, end, dtype=np.float64), frames, values).astype(np.float32)[:, None]
+
+
+# Left/right gains for a pan position (balance: -1 is left only, 1 right only)
+def _balance(pan):
+    return np.concatenate([1.0 - np.maximum(pan, 0.0), 1.0 + np.minimum(pan, 0.0)], axis=-1)
+
+
+# An episode laid out as a sequence of clips. Nothing is concatenated while building it;
+# render() computes every offset up front and writes each clip once into a single buffer.
+# Clips can carry a stable clip_id (e.g. a cache key) so layouts can be diffed between renders.
+# A timeline can also be streamed: flush() hands finished frames to a sink as clips arrive.
+#
+# The sequence plays on the "main" track. place() puts further clips (e.g. a looped
+# ambiance bed) at absolute frames on other tracks, and automate() schedules gain and pan
+# changes per track; tracks are summed over the sequence in blocks of BLOCK_FRAMES, each
+# block touching only the clips that overlap it.
+class Timeline:
+    def __init__(self, frame_rate=EPISODE_FRAME_RATE, channels=EPISODE_CHANNELS):
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.items = []
+        self.placed = []
+        # Per track, {"gain": points, "pan": points}
+        self.automation = {}
+        # Frames already handed out by flush(), and where the first remaining clip's cursor starts
+        self.flushed = 0
+        self.origin = 0
+
+    # Add a clip after everything so far. With crossfade_ms the clip starts that much early,
+    # fading the existing tail out and the new clip in (same result as AudioSegment.append).
+    # With overlap_ms it starts that much early and plays over the tail (two speakers at once).
+    def append(self, samples, crossfade_ms=0, clip_id=None, overlap_ms=0):
+        crossfade = ms_to_frames(crossfade_ms, self.frame_rate)
+        overlap = ms_to_frames(overlap_ms, self.frame_rate)
+        if self.flushed and self.layout()[1] - crossfade - overlap < self.flushed:
+            raise ValueError("Crossfade reaches back into audio that was already flushed")
+        self.items.append((samples, crossfade, clip_id, overlap))
+
+    def append_silence(self, duration_ms):
+        frames = ms_to_frames(duration_ms, self.frame_rate)
+        self.items.append((frames, 0, f"silence:{frames}", 0))
+
+    # Append all of another timeline's clips, crossfading into its first one
+    def append_timeline(self, other, crossfade_ms=0):
+        if other.items:
+            samples, _, clip_id, overlap = other.items[0]
+            self.items.append((samples, ms_to_frames(crossfade_ms, self.frame_rate), clip_id, overlap))
+            self.items.extend(other.items[1:])
+
+    # (offset, cursor after it) for each clip of the sequence
+    def _positions(self):
+        cursor = self.origin
+        for samples, crossfade, _, overlap in self.items:
+            length = samples if isinstance(samples, int) else len(samples)
+            if crossfade > cursor or crossfade > length:
+                raise ValueError("Crossfade is longer than the clips it joins")
+            start = cursor - crossfade - overlap
+            if start < 0:
+                raise ValueError("Overlap reaches back before the start of the episode")
+            cursor = max(cursor, start + length)
+            yield start, cursor
+
+    def layout(self):
+        offsets = []
+        cursor = self.origin
+        for offset, cursor in self._positions():
+            offsets.append(offset)
+        return offsets, cursor
+
+    # The end of the sequence so far, where the next appended clip starts
+    def end_frame(self):
+        return self.layout()[1]
+
+    def _total(self, cursor):
+        return max([cursor] + [clip.end for clip in self.placed if clip.end is not None])
+
+    def duration_ms(self):
+        return self._total(self.layout()[1]) * 1000 / self.frame_rate
+
+    # Put a clip at an absolute frame on a track. A looped clip repeats until end_loop().
+    def place(self, samples, offset, track, clip_id=None, loop=False):
+        if offset < self.flushed:
+            raise ValueError("Clip starts in audio that was already flushed")
+        if loop and not len(samples):
+            raise ValueError("Looped clip is empty")
+        clip = PlacedClip(samples, offset, track, clip_id, loop, None if loop else offset + len(samples))
+        self.placed.append(clip)
+        return clip
+
+    def end_loop(self, clip, end):
+        if end < max(clip.offset, self.flushed):
+            raise ValueError("Loop would end in audio that was already flushed")
+        clip.end = end
+
+    # Add an automation point: track's gain (linear) or pan (-1 to 1) ramps linearly from
+    # the previous point to value at frame, and stays there. Tracks start at gain 1, pan 0.
+    def automate(self, track, parameter, frame, value):
+        points = self.automation.setdefault(track, {"gain": [(0, 1.0)], "pan": [(0, 0.0)]})[parameter]
+        last_frame, last_value = points[-1]
+        if frame < last_frame:
+            raise ValueError("Automation points must be added in order")
+        if frame < self.flushed or (value != last_value and last_frame < self.flushed):
+            raise ValueError("Automation changes audio that was already flushed")
+        points.append((frame, float(value)))
+
+    # Where every clip landed, for comparing this render with a later one
+    def manifest(self):
+        offsets, cursor = self.layout()
+        clips = []
+        for (samples, crossfade, clip_id, _), offset in zip(self.items, offsets):
+            length = samples if isinstance(samples, int) else len(samples)
+            clips.append([clip_id, offset, length, crossfade])
+        tracks = {}
+        for clip in self.placed:
+            track = tracks.setdefault(clip.track, {"clips": []})
+            track["clips"].append([clip.clip_id, clip.offset, clip.end, clip.loop])
+        for name, parameters in self.automation.items():
+            tracks.setdefault(name, {"clips": []}).update(
+                {parameter: [list(point) for point in points] for parameter, points in parameters.items()})
+        return {"version": MIX_VERSION, "frame_rate": self.frame_rate, "channels": self.channels,
+                "frames": self._total(cursor), "clips": clips, "tracks": tracks}
+
+    # Write every clip into one preallocated int16 buffer. Clips are released as they are
+    # written, so peak memory stays around one episode of PCM. start/end render just that
+    # window of frames; every mixing step is per-frame, so a window is exact. release=False
+    # keeps the clips, for rendering further windows later.
+    def render(self, start=0, end=None, release=True):
+        offsets, cursor = self.layout()
+        end = self._total(cursor) if end is None else end
+        buffer = self._render_sequence(offsets, start, end, release)
+        if self.placed or self.automation:
+            self._mix_tracks(buffer, start)
+        if release:
+            self.placed = []
+        return buffer
+
+    def _render_sequence(self, offsets, start, end, release):
+        # np.zeros only commits pages as they are written, so the buffer grows as clips are freed
+        buffer = np.zeros((end - start, self.channels), dtype=np.int16)
+        written_end = 0
+        items = self.items
+        if release:
+            items = list(items)
+            self.items = []
+        for index, offset in enumerate(offsets):
+            samples, crossfade, _, _ = items[index]
+            if release:
+                items[index] = None
+            length = samples if isinstance(samples, int) else len(samples)
+            clip_end = offset + length
+            if isinstance(samples, int) or clip_end <= start or offset >= end:
+                written_end = max(written_end, clip_end)
+                continue
+            self._check_channels(samples)
+            if crossfade:
+                a, b = max(offset, start), min(offset + crossfade, end)
+                if a < b:
+                    ramp = np.linspace(1.0, 0.0, crossfade, endpoint=False, dtype=np.float32)[a - offset:b - offset, None]
+                    tail = buffer[a - start:b - start]
+                    mixed = (tail * ramp).astype(np.int16) + samples[a - offset:b - offset] * (1.0 - ramp)
+                    tail[:] = np.clip(mixed, -32768, 32767).astype(np.int16)
+            a, b = max(offset + crossfade, start), min(clip_end, end)
+            if a < b:
+                overlap_end = min(max(written_end, a), b)
+                if overlap_end > a:
+                    # Only sum where earlier clips already wrote; everywhere else is a plain copy
+                    mixed = buffer[a - start:overlap_end - start].astype(np.int32) + samples[a - offset:overlap_end - offset]
+                    buffer[a - start:overlap_end - start] = np.clip(mixed, -32768, 32767)
+                buffer[overlap_end - start:b - start] = samples[overlap_end - offset:b - offset]
+            written_end = max(written_end, clip_end)
+        return buffer
+
+    def _check_channels(self, samples):
+        if samples.shape[1] not in (1, self.channels):
+            raise ValueError(f"Clip has {samples.shape[1]} channels, episode has {self.channels}")
+
+    # Sum the placed clips into the rendered sequence, applying each track's automation,
+    # one block at a time. Clips are swept in offset order, so each block only looks at
+    # the clips that overlap it.
+    def _mix_tracks(self, buffer, start):
+        end = start + len(buffer)
+        pending = sorted((clip for clip in self.placed if clip.offset < end and (clip.end is None or clip.end > start)),
+                         key=lambda clip: clip.offset)
+        active = {MAIN_TRACK: []}
+        for clip in pending:
+            self._check_channels(clip.samples)
+            active.setdefault(clip.track, [])
+        next_clip = 0
+        for block_start in range(start, end, BLOCK_FRAMES):
+            block_end = min(block_start + BLOCK_FRAMES, end)
+            while next_clip < len(pending) and pending[next_clip].offset < block_end:
+                active[pending[next_clip].track].append(pending[next_clip])
+                next_clip += 1
+            for clips in active.values():
+                clips[:] = [clip for clip in clips if clip.end is None or clip.end > block_start]
+            automation = {name: self._track_automation(name, block_start, block_end) for name in active}
+            if not any(active.values()) and automation[MAIN_TRACK] is None:
+                continue
+
+            block = buffer[block_start - start:block_end - start]
+            mixed = block.astype(np.float32)
+            for name, clips in active.items():
+                if name == MAIN_TRACK:
+                    track = mixed
+                elif not clips:
+                    continue
+                elif automation[name] is None:
+                    # Nothing to scale, so the clips go straight into the mix
+                    track = mixed
+                else:
+                    track = np.zeros((block_end - block_start, self.channels), dtype=np.float32)
+                for clip in clips:
+                    self._add_clip(track, clip, block_start, block_end)
+                if automation[name] is not None:
+                    gain, pan = automation[name]
+                    track *= gain
+                    if pan is not None:
+                        track *= pan
+                if track is not mixed:
+                    mixed += track
+            block[:] = np.clip(mixed, -32768, 32767, out=mixed)
+
+    # Add the part of clip inside [block_start, block_end) to a track's block
+    def _add_clip(self, track, clip, block_start, block_end):
+        a = max(clip.offset, block_start)
+        b = block_end if clip.end is None else min(clip.end, block_end)
+        if a >= b:
+            return
+        if not clip.loop:
+            track[a - block_start:b - block_start] += clip.samples[a - clip.offset:b - clip.offset]
+            return
+        # A loop is read from its single copy, wrapping around as often as the block needs
+        length = len(clip.samples)
+        frame = a
+        while frame < b:
+            position = (frame - clip.offset) % length
+            take = min(length - position, b - frame)
+            track[frame - block_start:frame - block_start + take] += clip.samples[position:position + take]
+            frame += take
+
+    # (gain, per-channel pan gains or None) for a track over a block, or None when the
+    # track plays as is
+    def _track_automation(self, name, block_start, block_end):
+        parameters = self.automation.get(name)
+        if parameters is None:
+            return None
+        gain = _automation(parameters["gain"], block_start, block_end)
+        pan = _automation(parameters["pan"], block_start, block_end)
+        flat_pan = np.isscalar(pan) and pan == 0.0
+        if np.isscalar(gain) and gain == 1.0 and flat_pan:
+            return None
+        return gain, None if flat_pan or self.channels != 2 else _balance(np.reshape(pan, (-1, 1)))
+
+    # Hand every frame that no later append can change to sink (e.g. an encoder's write)
+    # and drop the clips that end before it. A later clip reaches back at most its
+    # crossfade or overlap, so hold_ms must cover the longest one still to come.
+    def flush(self, sink, hold_ms=0):
+        _, cursor = self.layout()
+        ready = self._total(cursor) - ms_to_frames(hold_ms, self.frame_rate)
+        if ready <= self.flushed:
+            return self.flushed
+        sink(self.render(self.flushed, ready, release=False))
+        self.flushed = ready
+        done = 0
+        for (offset, cursor), (samples, _, _, _) in zip(self._positions(), self.items):
+            if offset + (samples if isinstance(samples, int) else len(samples)) > ready:
+                break
+            self.origin = cursor
+            done += 1
+        del self.items[:done]
+        self.placed = [clip for clip in self.placed if clip.end is None or clip.end > ready]
+        return ready
+
+    # Flush everything that is left; returns the total number of frames
+    def finish(self, sink):
+        self.flush(sink)
+        self.items = []
+        self.placed = []
+        return self.flushed
@@ -0,0 +1,147 @@
+import argparse
+import collections
+import os
+import struct
+
+# Bitrates in kbps by [MPEG-1?][layer][index]
+BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+# Enough to cover an ID3 tag of typical size plus the first frame and its Xing/VBRI tag
+HEAD_BYTES = 64 * 1024
+# The longest frame (MPEG-2 layer II, 160 kbps at 8 kHz) and the header after it: what has to
+# follow the ID3 tag to confirm the first frame and read its Xing/VBRI tag
+MAX_FRAME_LENGTH = 2881
+MIN_AUDIO_BYTES = MAX_FRAME_LENGTH + 4
+
+Mp3Info = collections.namedtuple('Mp3Info', 'duration length bitrate sample_rate channels frames vbr')
+Frame = collections.namedtuple('Frame', 'mpeg1 layer bitrate sample_rate channels samples length')
+
+
+def parse_frame_header(header):
+    if len(header) < 4:
+        return None
+    word, = struct.unpack('>I', header[:4])
+    version = (word >> 19) & 3
+    layer = 4 - ((word >> 17) & 3)
+    bitrate_index = (word >> 12) & 15
+    rate_index = (word >> 10) & 3
+    if (word >> 21) != 0x7FF or version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][rate_index]
+    padding = (word >> 9) & 1
+    channels = 1 if (word >> 6) & 3 == 3 else 2
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if mpeg1 or layer == 2 else 576
+        length = samples // 8 * bitrate // sample_rate + padding
+    return Frame(mpeg1, layer, bitrate, sample_rate, channels, samples, length)
+
+
+def _id3v2_size(data):
+    if data[:3] != b'ID3' or len(data) < 10:
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    return size + 10 + (10 if data[5] & 0x10 else 0)
+
+
+# Frame count and audio byte count from a Xing/Info or VBRI tag in the first frame
+def _read_vbr_tag(frame_data, frame):
+    side_info = (32 if frame.channels == 2 else 17) if frame.mpeg1 else (17 if frame.channels == 2 else 9)
+    xing = frame_data[4 + side_info:4 + side_info + 16]
+    if xing[:4] in (b'Xing', b'Info'):
+        flags, = struct.unpack('>I', xing[4:8])
+        offset = 8
+        frames = audio_bytes = None
+        if flags & 1:
+            frames, = struct.unpack('>I', xing[offset:offset + 4])
+            offset += 4
+        if flags & 2:
+            audio_bytes, = struct.unpack('>I', xing[offset:offset + 4])
+        return frames, audio_bytes, xing[:4] == b'Xing'
+    vbri = frame_data[36:54]
+    if vbri[:4] == b'VBRI':
+        audio_bytes, frames = struct.unpack('>II', vbri[10:18])
+        return frames, audio_bytes, True
+    return None, None, False
+
+
+# Probe an MP3 through read(offset, length) without decoding it: skip the ID3v2 tag, find
+# the first frame header (confirmed by the one after it) and take the frame count from its
+# Xing/Info or VBRI tag. Files without one are CBR, so the duration follows from the
+# audio size and the bitrate. Takes one or two small reads however long the file is.
+def probe(read, size):
+    data = read(0, HEAD_BYTES)
+    start = _id3v2_size(data)
+    if len(data) - start < MIN_AUDIO_BYTES:
+        data = read(start, HEAD_BYTES)
+    else:
+        data = data[start:]
+
+    for offset in range(len(data) - 4):
+        if data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+            continue
+        frame = parse_frame_header(data[offset:offset + 4])
+        if frame is None:
+            continue
+        following = data[offset + frame.length:offset + frame.length + 4]
+        if len(following) == 4 and parse_frame_header(following) is None:
+            continue
+        audio_start = start + offset
+        break
+    else:
+        raise ValueError('No MPEG audio frames found')
+
+    frames, audio_bytes, vbr = _read_vbr_tag(data[offset:offset + 200], frame)
+    if frames is not None:
+        # The tag frame itself is silent and not counted
+        audio_start += frame.length
+    audio_end = size
+    if size >= 128 and read(size - 128, 3) == b'TAG':
+        audio_end -= 128
+    if audio_bytes is None:
+        audio_bytes = audio_end - audio_start
+    if frames is None:
+        # CBR: the first frame's length includes its padding byte, which only some frames
+        # have, so go by the bitrate rather than counting frames of that length
+        duration = audio_bytes * 8 / frame.bitrate
+        frames = round(duration * frame.sample_rate / frame.samples)
+        bitrate = frame.bitrate
+    else:
+        duration = frames * frame.samples / frame.sample_rate
+        bitrate = int(audio_bytes * 8 / duration) if duration else frame.bitrate
+    return Mp3Info(duration, size, bitrate, frame.sample_rate, frame.channels, frames, vbr)
+
+
+def probe_file(path):
+    with open(path, 'rb') as file:
+        def read(offset, length):
+            file.seek(offset)
+            return file.read(length)
+        return probe(read, os.path.getsize(path))
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    return f'{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the duration, size and bitrate of MP3 files without decoding them.')
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args()
+    for path in args.files:
+        info = probe_file(path)
+        print(f'{path}: {format_duration(info.duration)} ({info.duration:.2f} s), {info.length} bytes, '
+              f"{info.bitrate // 1000} kbps {'VBR' if info.vbr else 'CBR'}, {info.sample_rate} Hz, {info.channels} ch")
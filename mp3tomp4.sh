@@ -1,3 +1,5 @@
+# podgen.py --video output.mp4 renders this from the mix directly (see video.py);
+# this re-decodes output.mp3 and is kept for comparison in benchmarks/bench_video.py.
 ffmpeg -loop 1 -i background.png -i output.mp3 \
 -filter_complex "[1:a]showwaves=s=1280x200:mode=line:colors=white,format=yuva420p[wave];[0][wave]overlay=(W-w)/2:(H-200):shortest=1" \
 -c:v libx264 -c:a aac -b:a 192k -shortest output.mp4
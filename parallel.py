@@ -0,0 +1,110 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from pydub import AudioSegment
+
+import dsp
+from instrumentation import NULL_RECORDER
+from mixer import to_array
+from segment_cache import ProcessedCache, processed_key
+
+# Each worker process opens its own handle on the processed-audio cache
+_worker_cache = None
+
+
+def _init_worker(cache_dir):
+    global _worker_cache
+    _worker_cache = ProcessedCache(cache_dir, max_bytes=None)
+
+
+# Returns the (wall, CPU) seconds the line took, measured where it ran
+def _process_file(path, source_key, params, processed_cache):
+    wall, cpu = time.perf_counter(), time.thread_time()
+    samples = to_array(AudioSegment.from_file(path), params["frame_rate"])
+    samples = dsp.process_utterance(samples, params["frame_rate"], params)
+    processed_cache.store(source_key, params, samples)
+    return time.perf_counter() - wall, time.thread_time() - cpu
+
+
+def _process_in_worker(path, source_key, params):
+    return _process_file(path, source_key, params, _worker_cache)
+
+
+# A line being processed in the background; result() waits for it and returns its samples
+class PendingLine:
+    def __init__(self, future, processed_cache, source_key, params, recorder=NULL_RECORDER):
+        self.future = future
+        self.processed_cache = processed_cache
+        self.source_key = source_key
+        self.params = params
+        self.recorder = recorder
+
+    def result(self):
+        self.future.result()
+        samples = self.processed_cache.get(self.source_key, self.params)
+        self.recorder.count("processed_pcm_bytes", samples.nbytes)
+        return samples
+
+
+# Runs the per-line DSP chain in the background: on one thread for a single job, else on
+# a pool of jobs processes. Workers decode their own input and write results into the
+# processed cache; the parent reads them back as memory-mapped .npy files, so no PCM is
+# pickled between processes. Lines can be submitted as they become available (e.g. as
+# their speech is synthesized); work runs in submission order. Each line's wall time goes
+# to the recorder as a "process_line_s" observation and its CPU time to "process_cpu_s".
+class LineProcessor:
+    def __init__(self, processed_cache, jobs=1, recorder=NULL_RECORDER):
+        self.processed_cache = processed_cache
+        self.recorder = recorder
+        if jobs <= 1:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+            self._submit = lambda *line: self.executor.submit(_process_file, *line, processed_cache)
+        else:
+            self.executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                                initargs=(processed_cache.cache_dir,))
+            self._submit = lambda *line: self.executor.submit(_process_in_worker, *line)
+
+    def submit(self, path, source_key, params):
+        future = self._submit(path, source_key, params)
+        future.add_done_callback(self._record)
+        return future
+
+    def _record(self, future):
+        if future.exception() is None:
+            wall, cpu = future.result()
+            self.recorder.observe("process_line_s", wall)
+            self.recorder.count("process_cpu_s", cpu)
+
+    # Queued work still runs to completion; this just lets the workers exit once it has
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+# Start the per-line DSP chain for every (segment_file, source_key, params) in lines and
+# return {processed_key: future} without waiting. Work is queued in the order given, so
+# callers consuming lines in script order get the early ones first. A single job runs on
+# one background thread, so the caller can still mix while lines are processed.
+# The chain is deterministic for a given params (including seed), so the output is
+# bit-identical whatever the number of jobs.
+def submit_lines(lines, processed_cache, jobs=1, recorder=NULL_RECORDER):
+    unique = {}
+    for path, source_key, params in lines:
+        unique.setdefault(processed_key(source_key, params), (path, source_key, params))
+    if not unique:
+        return {}
+
+    processor = LineProcessor(processed_cache, jobs if len(unique) > 1 else 1, recorder)
+    futures = {key: processor.submit(*line) for key, line in unique.items()}
+    processor.close()
+    return futures
+
+
+# Process lines and wait for all of them. Worker processes don't evict (they would race
+# each other), so the cache is trimmed back to its cap once everything is stored.
+def process_lines(lines, processed_cache, jobs=1):
+    futures = submit_lines(lines, processed_cache, jobs)
+    for future in futures.values():
+        future.result()
+    if futures:
+        processed_cache.evict()
+    return len(futures)
@@ -1,198 +1,132 @@
-import os
-import json
-import boto3
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from feedgen.feed import FeedGenerator
+from episode_index import EpisodeIndex
+from feed_builder import FeedBuilder
+from mp3probe import format_duration, probe, probe_file
+from publisher import Publisher
+from site_builder import SiteBuilder
+from storage import NotFound, S3Storage
 
 class PodcastManager:
-    def __init__(self, bucket_name, index_file='index.json', num_episodes=5):
-        self.s3 = boto3.client('s3')
+    # storage defaults to the S3 bucket; pass a FilesystemStorage to run against a local directory.
+    # index_file is the old single-object index, imported on first use.
+    # max_feed_items caps podcast.rss to the newest episodes, moving the rest to paged archive feeds.
+    def __init__(self, bucket_name, index_file='index.json', num_episodes=5, storage=None, cache_dir='.podcast_cache',
+                 max_feed_items=None):
+        self.storage = storage or S3Storage(bucket_name)
         self.bucket_name = bucket_name
         self.index_file = index_file
         self.num_episodes = num_episodes
-        self.podcast_data = self._load_podcast_data()
-
-    def _load_podcast_data(self):
-        try:
-            response = self.s3.get_object(Bucket=self.bucket_name, Key=self.index_file)
-            return json.loads(response['Body'].read().decode('utf-8'))
-        except self.s3.exceptions.NoSuchKey:
-            return {'episodes': []}
-
-    def _save_podcast_data(self):
-        self.s3.put_object(
-            Bucket=self.bucket_name,
-            Key=self.index_file,
-            Body=json.dumps(self.podcast_data, indent=2)
-        )
-
-    def add_episode(self, title, summary, mp3_file, is_test=False, duration=''):
-        episode_id = len(self.podcast_data['episodes']) + 1
+        self.cache_dir = cache_dir
+        self.max_feed_items = max_feed_items
+        self.index = EpisodeIndex(self.storage, cache_dir=cache_dir, legacy_index=index_file)
+        self.publisher = Publisher(self.storage, cache_dir)
+
+    # Every episode record, oldest first (fetched once, then served from the local cache)
+    @property
+    def podcast_data(self):
+        return {'episodes': self.index.episodes()}
+
+    # duration (HH:MM:SS) defaults to the one read from the MP3's frame headers
+    def add_episode(self, title, summary, mp3_file, is_test=False, duration=None):
         timestamp = datetime.now(timezone.utc).strftime('%Y%m%d')
-        mp3_key = f"{timestamp}_{episode_id}.mp3"
+        info = probe_file(mp3_file)
+
+        # Claiming the id creates the episode's record, so concurrent uploads get distinct ids
+        def build(episode_id):
+            return {
+                'id': episode_id,
+                'title': title,
+                'summary': summary,
+                'mp3_key': f"{timestamp}_{episode_id}.mp3",
+                'pub_date': datetime.now(timezone.utc).isoformat(), # use utc time
+                'is_test': is_test,
+                'duration': duration or format_duration(info.duration),
+                'length': info.length,
+                'bitrate': info.bitrate,
+            }
+
+        episode_data = self.index.create(build)
+        # Multipart and resumable for large files; skipped if an identical copy is already there
+        self.publisher.upload_file(mp3_file, episode_data['mp3_key'])
+        self.index.publish(episode_data)
+        return episode_data
+
+    # Fill in duration, length and bitrate for episodes uploaded before they were probed;
+    # their durations came from the old hard-coded --duration default, so those are replaced
+    # too. Each MP3 is probed in place with two ranged reads (its head and the ID3v1 tag at
+    # the end), a few kB per episode however long it is. Returns the updated records;
+    # publish_site() afterwards puts the new values in the feeds.
+    def backfill_metadata(self, concurrency=8):
+        missing = [episode for episode in self.index.episodes() if not episode.get('length')]
 
-        self.s3.upload_file(mp3_file, self.bucket_name, mp3_key)
+        def backfill(episode):
+            key = episode['mp3_key']
+            try:
+                info = probe(lambda offset, length: self.storage.read_range(key, offset, length), self.storage.size(key))
+            except (NotFound, ValueError) as e:
+                print(f"Skipping episode {episode['id']}: could not probe {key} ({e!r})")
+                return None
+            return {**episode, 'duration': format_duration(info.duration), 'length': info.length,
+                    'bitrate': info.bitrate}
 
-        episode_data = {
-            'id': episode_id,
-            'title': title,
-            'summary': summary,
-            'mp3_key': mp3_key,
-            'pub_date': datetime.now(timezone.utc).isoformat(), # use utc time
-            'is_test': is_test,
-            'duration': duration
-        }
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            updated = [record for record in executor.map(backfill, missing) if record is not None]
+        self.index.update_many(updated, concurrency)
+        print(f'Backfilled metadata for {len(updated)} of {len(missing)} episodes')
+        return updated
 
-        self.podcast_data['episodes'].append(episode_data)
-        self._save_podcast_data()
+    def _feed_builder(self):
+        return FeedBuilder(self.index, channel_settings(), self.cache_dir, self.max_feed_items)
+
+    # Build the main, test and (when capped by max_feed_items) archive feeds in one pass and
+    # upload the ones that changed. Items are rendered once and cached by episode hash.
+    def generate_rss_feeds(self, feed_types=None):
+        builder = self._feed_builder()
+        written = builder.publish(feed_types, self.publisher)
+        print(f"Rendered {builder.items_rendered} feed items, uploaded {', '.join(written) or 'nothing'}")
+        return written
 
     def generate_rss_feed(self, feed_type='main'):
-        fg = FeedGenerator()
-        fg.load_extension('podcast')
-
-        fg.id(PODCAST_URL)
-        fg.title(PODCAST_TITLE)
-        fg.author({'name': PODCAST_AUTHOR, 'email': PODCAST_EMAIL})
-        fg.link(href=PODCAST_URL, rel='alternate')
-        fg.logo(PODCAST_LOGO)
-        fg.subtitle(PODCAST_SUBTITLE)
-        fg.language(PODCAST_LANGUAGE)
-
-        fg.podcast.itunes_author(PODCAST_AUTHOR)
-        fg.podcast.itunes_category(ITUNES_CATEGORY, ITUNES_SUBCATEGORY)
-        fg.podcast.itunes_explicit(ITUNES_EXPLICIT)
-        fg.podcast.itunes_owner(name=PODCAST_AUTHOR, email=PODCAST_EMAIL)
-        fg.podcast.itunes_image(PODCAST_LOGO)
-        print("COMPUTE EPISODES")
-        for episode in self.podcast_data['episodes']:
-            if (feed_type == 'main' and not episode['is_test']) or (feed_type == 'test' and episode['is_test']):
-                print("EPISODE", episode['title'])
-                fe = fg.add_entry()
-                fe.id(f"{PODCAST_URL}/{episode['mp3_key']}")
-                fe.title(episode['title'])
-                fe.description(episode['summary'])
-                fe.enclosure(f"{PODCAST_URL}/{episode['mp3_key']}", 0, 'audio/mpeg')
-                print("ADD DATE")
-                # This is a little weird. We parse a DateTime from a string, and then switch it back to a DateTime.
-                pub_date = datetime.fromisoformat(episode['pub_date'])
-                pub_date = pub_date.replace(tzinfo=timezone.utc)
-                fe.pubDate(pub_date)
-                print("DONE ADDING DATE")
-                fe.podcast.itunes_author(PODCAST_AUTHOR)
-                fe.podcast.itunes_explicit(ITUNES_EXPLICIT)
-                fe.podcast.itunes_duration(episode['duration'])
-        print("ABOUT TO UPLOAD")
-        if feed_type == 'main':
-            fg.rss_str(pretty=True)
-            self.s3.put_object(Bucket=self.bucket_name, Key='podcast.rss', Body=fg.rss_str())
-        else:
-            fg.rss_str(pretty=True)
-            self.s3.put_object(Bucket=self.bucket_name, Key='test.rss', Body=fg.rss_str())
+        return self.generate_rss_feeds([feed_type])
+
+    def _site_builder(self):
+        return SiteBuilder(self.index, channel_settings(), self.cache_dir, self.num_episodes)
 
+    # Upload the changed feeds and web pages together in one concurrent batch
+    def publish_site(self):
+        builder = self._feed_builder()
+        site = self._site_builder()
+        feeds = builder.changed()
+        pages = site.changed()
+        written = self.publisher.put_many(feeds + pages)
+        builder.mark_published(feeds)
+        site.mark_published(pages)
+        print(f"Rendered {builder.items_rendered} feed items and {site.pages_rendered} pages, "
+              f"uploaded {', '.join(written) or 'nothing'}")
+        return written
+
+    # Render and upload just the web pages whose inputs changed
     def generate_web_page(self):
-        sorted_episodes = sorted(self.podcast_data['episodes'], key=lambda x: x['pub_date'], reverse=True)
-        recent_episodes = sorted_episodes[:self.num_episodes]
-        print("Got recent episodes", recent_episodes)
-        html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>{PODCAST_TITLE}</title>
-            <link href="https://fonts.googleapis.com/css2?family=Montserrat:wght@400;700&display=swap" rel="stylesheet">
-            <style>
-                body {{
-                    font-family: 'Montserrat', sans-serif;
-                    background-color: #F5F5DC;
-                    color: #4B0082;
-                    margin: 0;
-                    padding: 0;
-                }}
-                header {{
-                    background-color: #4B0082;
-                    color: #FFFFFF;
-                    padding: 20px;
-                    text-align: center;
-                }}
-                h1 {{
-                    font-size: 36px;
-                    margin: 0;
-                }}
-                main {{
-                    max-width: 800px;
-                    margin: 0 auto;
-                    padding: 20px;
-                }}
-                .episode {{
-                    background-color: #FFFFFF;
-                    border-radius: 5px;
-                    padding: 20px;
-                    margin-bottom: 20px;
-                    box-shadow: 0 2px 5px rgba(0, 0, 0, 0.1);
-                }}
-                .episode-title {{
-                    font-size: 24px;
-                    font-weight: bold;
-                    margin-bottom: 10px;
-                }}
-                .episode-description {{
-                    font-size: 16px;
-                    color: #333333;
-                    margin-bottom: 10px;
-                }}
-                audio {{
-                    width: 100%;
-                }}
-                .subscribe-section {{
-                    text-align: center;
-                    margin-top: 40px;
-                }}
-                .subscribe-link {{
-                    display: inline-block;
-                    background-color: #4B0082;
-                    color: #FFFFFF;
-                    font-size: 20px;
-                    padding: 10px 20px;
-                    text-decoration: none;
-                    border-radius: 5px;
-                }}
-                .subscribe-link:hover {{
-                    background-color: #6A5ACD;
-                }}
-            </style>
-        </head>
-        <body>
-            <header>
-                <h1>{PODCAST_TITLE}</h1>
-            </header>
-            <main>
-                {''.join(self._generate_episode_html(episode) for episode in recent_episodes)}
-                <div class="subscribe-section">
-                    <a class="subscribe-link" href="{PODCAST_URL}/podcast.rss">Subscribe to {PODCAST_TITLE}</a>
-                </div>
-            </main>
-        </body>
-        </html>
-        """
-
-        self.s3.put_object(
-            Bucket=self.bucket_name,
-            Key='index.html',
-            Body=html,
-            ContentType='text/html',
-            CacheControl='no-cache'
-        )
-
-    def _generate_episode_html(self, episode):
-        return f"""
-        <div class="episode">
-            <div class="episode-title">{episode['title']}</div>
-            <div class="episode-description">{episode['summary']}</div>
-            <audio controls>
-                <source src="{PODCAST_URL}/{episode['mp3_key']}" type="audio/mpeg">
-                Your browser does not support the audio element.
-            </audio>
-        </div>
-        """
+        site = self._site_builder()
+        written = site.publish(self.publisher)
+        print(f"Rendered {site.pages_rendered} pages, uploaded {', '.join(written) or 'nothing'}")
+        return written
+
+# Channel-level feed settings, from the constants below
+def channel_settings():
+    return {
+        'title': PODCAST_TITLE,
+        'subtitle': PODCAST_SUBTITLE,
+        'author': PODCAST_AUTHOR,
+        'email': PODCAST_EMAIL,
+        'language': PODCAST_LANGUAGE,
+        'url': PODCAST_URL,
+        'logo': PODCAST_LOGO,
+        'category': ITUNES_CATEGORY,
+        'subcategory': ITUNES_SUBCATEGORY,
+        'explicit': ITUNES_EXPLICIT,
+    }
 
 # Constants for podcast information
 PODCAST_TITLE = 'Quacker News'
@@ -1,10 +1,22 @@
-import json
+import argparse
 import os
+import queue
 import random
-import subprocess
-from pydub import AudioSegment
-from elevenlabs import save
-from elevenlabs.client import ElevenLabs
+import threading
+from concurrent.futures import Future, wait
+from assets import shared_pool
+import dsp
+import mastering
+from encoder import StreamingEncoder, encode_samples, parse_output
+from incremental import render_incremental
+from instrumentation import NULL_RECORDER, Recorder
+from mixer import EPISODE_FRAME_RATE, Timeline, ms_to_frames
+from parallel import LineProcessor, PendingLine, submit_lines
+from segment_cache import ProcessedCache, SegmentCache, processed_key
+from script_parser import MAX_OVERLAP_MS, Break, Overlap, Pause, ScriptParser, Utterance
+import timestretch
+from tts_pool import SynthesisPool
+import video
 #from pyrubberband import time_stretch
 # Define the list of voices, ambiance MP3s, and global ambiance MP3 (provided by you)
 voices = {
@@ -18,259 +30,464 @@ pans = {
     "Dave": 0.25,
 }
 
+# Per-line processing: tempo, echo level and random volume variation
+speed_factor = 1.1
+echo_gain_db = -3
+volume_range = (-3, 3)
+
 ambiance_mp3s = ["ambiance1.mp3", "ambiance2.mp3", "ambiance3.mp3"]
 global_ambiance_mp3 = "global_ambiance.mp3"
 
-# Initialize the ElevenLabs client with your API key
-client = ElevenLabs(api_key=os.environ["ELEVENLABS_API_KEY"])
-
-
-def find_segment_by_utterance(utterance, voice, segments_cache):
-    # Iterate over the segments cache and find the segment with the matching utterance
-    for segment_file, segment_data in segments_cache.items():
-        if segment_data["utterance"] == utterance and segment_data["voice"] == voice:
-            return segment_file
-
-    # If no matching segment is found, return None
-    return None
-
-def find_largest_segment_number(segments_dir):
-    # Get a list of all files in the segments directory
-    files = os.listdir(segments_dir)
-
-    # Filter the list to include only MP3 files
-    mp3_files = [f for f in files if f.endswith(".mp3")]
-
-    # Extract the numbers from the MP3 filenames
-    numbers = [int(f.split(".")[0]) for f in mp3_files if f.split(".")[0].isdigit()]
-
-    # Return the largest number, or None if no MP3 files are found
-    return max(numbers) if numbers else None
-
-
-def rubberband(audio_segment, speed_factor):
-    # Save the input audio segment to a temporary file
-    input_file = "temp_input.wav"
-    audio_segment.export(input_file, format="wav")
-
-    # Generate a temporary output file path
-    output_file = "temp_output.wav"
-
-    try:
-        subprocess.run([
-            "rubberband",
-            "--tempo",
-            str(speed_factor),
-            "-3",
-            input_file,
-            output_file
-        ], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error running Rubber Band: {e}")
-        return None
-
-    # Load the stretched audio file into a Pydub audio segment
-    stretched_audio = AudioSegment.from_wav(output_file)
-
-    # Clean up the temporary files
-    os.remove(input_file)
-    os.remove(output_file)
-
-    return stretched_audio
-
-# Function to call the ElevenLabs API for text-to-speech
-def call_text_to_speech(text, voice, output_file):
-    print("Generating audio for:", text)
-    audio = client.generate(
-        text=text,
-        voice=voice,
-        model="eleven_multilingual_v2"
-    )
-    save(audio, output_file)
-
-# Function to add echo to an audio segment
-def add_echo(audio, gain_db):
-    # this needs more thought
-    #echo = audio + AudioSegment.silent(duration=100)
-    #echo = echo.overlay(audio, position=100, gain_db=gain_db)
-    #echo = audio.overlay(audio, position=100, gain_db=gain_db)
-    return audio
-# Function to vary the volume randomly and subtly
-def vary_volume(audio, min_db, max_db):
-    volume_changes = []
-    chunk_size = 100  # Adjust the chunk size as needed
-    for i in range(0, len(audio), chunk_size):
-        volume_change = random.uniform(min_db, max_db)
-        volume_changes.append(volume_change)
-    
-    new_audio = AudioSegment.empty()
-    for i, chunk in enumerate(audio[::chunk_size]):
-        new_audio += chunk + volume_changes[i]
-    
-    return new_audio
-
-# Function to handle breathing sounds
-def breathing():
-    breathing_sounds = os.listdir("sounds/breathing")
-    if breathing_sounds:
-        return os.path.join("sounds/breathing", random.choice(breathing_sounds))
-    return None
-
-# Function to handle break sounds
-def handle_break(n):
-    break_sounds = os.listdir("sounds/break")
-    if break_sounds:
-        return os.path.join("sounds/break", random.choice(break_sounds))
-    return None
-
-# Function to parse the script into segments
-def parse_script(script):
-    segments = []
-    for line in script.split("\n"):
-        if line.strip() == "[break]":
-            segments.append({"type": "break"})
-        elif ":" in line:
-            speaker, text = line.split(":", 1)
-            segments.append({"type": "utterance", "speaker": speaker.strip(), "text": text.strip()})
-    return segments
-
-# Function to generate speech segments and update the cache
-def generate_speech_segments(segments, segments_cache):
-    largest_current_segment = find_largest_segment_number("segments")
-    print("Largest current segment:", largest_current_segment)
-    for i, segment in enumerate(segments):
-        n = i + largest_current_segment + 1 if largest_current_segment else i
-        if segment["type"] == "utterance":
-            speaker = segment["speaker"]
-            text = segment["text"]
-            if speaker not in voices:
-                print("Error: Speaker not found in voices dictionary", speaker)
-                continue
-            voice = voices[segment["speaker"]]
-            output_file = f"segments/{n}.mp3"
-            # This is broken. The cache should persist from run to run. 
-            # It should look up already-spoken segments and not re-generate them.
-            if find_segment_by_utterance(text, voice, segments_cache) is None:
-                call_text_to_speech(text, voice, output_file)
-                segments_cache[output_file] = {"voice": voice, "utterance": text}
-
-                with open("segments/segments.json", "w") as file:
-                    json.dump(segments_cache, file)
-
-# Function to mix the audio segments
-def mix_audio_segments(segments, segments_cache):
-    mixed_audio = AudioSegment.empty()
+# Intro/outro joins. The outro's crossfade or a line's [overlap] is the furthest any clip
+# reaches back, so a streamed episode holds back that much audio until the next clip arrives.
+intro_gap_ms = 500
+body_crossfade_ms = 100
+outro_crossfade_ms = 1000
+
+# The global ambiance fades in over this after the intro and out under the outro's crossfade
+ambiance_fade_ms = 500
+
+_client = None
+
+# Function to get the ElevenLabs client, created on first use so that importing podgen
+# (e.g. to run it against a fake TTS) doesn't need an API key or the SDK
+def tts_client():
+    global _client
+    if _client is None:
+        from elevenlabs.client import ElevenLabs
+        _client = ElevenLabs(api_key=os.environ["ELEVENLABS_API_KEY"])
+    return _client
+
+
+# Function to pick a breathing sound
+def breathing(asset_pool, rng):
+    return asset_pool.choose_path("breathing", rng)
+
+# Function to pick a break sound
+def handle_break(asset_pool, rng, n):
+    return asset_pool.choose_path("break", rng)
+
+# Function to parse the script into segments (Utterance, Break, Pause and Overlap records). Bad
+# directives (and with check_speakers, unknown speakers) raise ScriptError here, before anything
+# is synthesized.
+def parse_script(script, speaker_voices=voices, speaker_pans=pans, check_speakers=False):
+    return list(ScriptParser(speaker_voices, speaker_pans, check_speakers=check_speakers).parse(script.split("\n")))
+
+# Function to read items off a queue until None. An exception put on the queue (by a
+# producer thread that failed) is raised here instead.
+def iter_queue(items):
+    while True:
+        item = items.get()
+        if item is None:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+# Function to generate speech segments for every line not already in the cache
+def generate_speech_segments(segments, segment_cache, synthesis_pool, recorder=NULL_RECORDER):
+    lines = [(segment.voice, segment.text) for segment in segments if isinstance(segment, Utterance)]
+    generated = synthesis_pool.synthesize_missing(lines, segment_cache, recorder)
+    print(f"Generated {generated} new segments")
+
+# Function to build the processing parameters for one line. The seed is derived from the
+# line's audio so volume variation is reproducible and cacheable.
+def utterance_params(pan, source_key, stretch_backend, seed):
+    return {
+        "version": dsp.PROCESSING_VERSION,
+        "frame_rate": EPISODE_FRAME_RATE,
+        "speed": speed_factor,
+        "stretch_backend": stretch_backend,
+        "echo_db": echo_gain_db,
+        "volume_range": list(volume_range),
+        "pan": pan,
+        "seed": [seed, int(source_key[:15], 16)],
+    }
+
+# Function to start the per-line processing chain, in parallel across jobs processes, for every
+# line not already in the processed cache. Returns (processed key, pending samples) by segment
+# index without waiting: calling result() on the second item blocks until that line is done,
+# so mixing can start on the first lines while later ones are still being processed.
+def process_utterances(segments, segment_cache, processed_cache, stretch_backend="wsola", seed=0, jobs=1,
+                       recorder=NULL_RECORDER):
+    processed = {}
+    pending = []
+    for index, segment in enumerate(segments):
+        if isinstance(segment, Utterance):
+            params = utterance_params(segment.pan, segment.source_key, stretch_backend, seed)
+            speech_samples = processed_cache.lookup(segment.source_key, params)
+            if speech_samples is None:
+                pending.append((index, segment_cache.get(segment.voice, segment.text), segment.source_key, params))
+            else:
+                ready = Future()
+                ready.set_result(speech_samples)
+                processed[index] = (processed_key(segment.source_key, params), ready)
+
+    recorder.count("processed_cache_hits", len(processed))
+    recorder.count("processed_cache_misses", len(pending))
+    print(f"Processing {len(pending)} lines with {jobs} jobs")
+    futures = submit_lines([(path, source_key, params) for _, path, source_key, params in pending], processed_cache, jobs,
+                           recorder)
+    for index, path, source_key, params in pending:
+        key = processed_key(source_key, params)
+        processed[index] = (key, PendingLine(futures[key], processed_cache, source_key, params, recorder))
+        recorder.count("segment_bytes_decoded", os.path.getsize(path))
+    return processed
+
+# Function to chain a line's processing onto its synthesis: returns a future that is done
+# when the processed samples are in the cache
+def _process_when_synthesized(synthesized, processor, source_key, params, recorder):
+    done = Future()
+
+    def copy_result(future):
+        if future.exception() is not None:
+            done.set_exception(future.exception())
+        else:
+            done.set_result(future.result())
+
+    def process(future):
+        if future.exception() is not None:
+            done.set_exception(future.exception())
+            return
+        path = future.result()
+        recorder.count("segment_bytes_decoded", os.path.getsize(path))
+        try:
+            processor.submit(path, source_key, params).add_done_callback(copy_result)
+        except Exception as e:
+            done.set_exception(e)
+
+    synthesized.add_done_callback(process)
+    return done
+
+# Function to synthesize and process script lines as they arrive (e.g. from an LLM that is
+# still writing the script), rather than after the whole script is known. A background
+# thread parses each line (skipping unknown speakers, since the script can't be fixed
+# halfway), starts its TTS request and chains its processing onto it; the
+# returned generator yields (segment, (processed key, pending samples) or None) in script
+# order, like the batch stages, as soon as each line has been read.
+def stream_utterances(lines, segment_cache, processed_cache, synthesis_pool, stretch_backend="wsola", seed=0, jobs=1,
+                      speaker_voices=voices, speaker_pans=pans, recorder=NULL_RECORDER, check_speakers=False):
+    prepared = queue.Queue()
+
+    def produce():
+        # The "stream" stage covers parsing, synthesizing and processing every line, which
+        # runs here alongside the mix rather than before it
+        with recorder.stage("stream"):
+            synthesis = synthesis_pool.stream(segment_cache, recorder)
+            processor = LineProcessor(processed_cache, jobs, recorder)
+            futures = {}
+            try:
+                for segment in ScriptParser(speaker_voices, speaker_pans, strict=False,
+                                            check_speakers=check_speakers).parse(lines):
+                    line = None
+                    if isinstance(segment, Utterance):
+                        recorder.count("script_lines")
+                        params = utterance_params(segment.pan, segment.source_key, stretch_backend, seed)
+                        key = processed_key(segment.source_key, params)
+                        speech_samples = None if key in futures else processed_cache.lookup(segment.source_key, params)
+                        if speech_samples is not None:
+                            recorder.count("processed_cache_hits")
+                            ready = Future()
+                            ready.set_result(speech_samples)
+                            line = (key, ready)
+                        else:
+                            if key not in futures:
+                                recorder.count("processed_cache_misses")
+                                futures[key] = _process_when_synthesized(synthesis.submit(segment.voice, segment.text),
+                                                                         processor, segment.source_key, params, recorder)
+                            line = (key, PendingLine(futures[key], processed_cache, segment.source_key, params,
+                                                     recorder))
+                    prepared.put((segment, line))
+            except BaseException as e:
+                prepared.put(e)
+                return
+            finally:
+                # Processing is submitted as each synthesis finishes, so wait for those first;
+                # then for the processing itself, so the stage covers all of it
+                synthesis.close()
+                processor.close()
+                wait(futures.values())
+        # Only once the stage is recorded, so it is in the report by the time the mix ends
+        prepared.put(None)
+
+    threading.Thread(target=produce, name="stream-utterances", daemon=True).start()
+    return iter_queue(prepared)
+
+# Function to mix the audio segments. prepared yields (segment, (processed key, pending
+# samples) or None) in script order. Yields (samples, clip_id, overlap_ms) for each clip of
+# the episode body in order, waiting for each line's processing only when it is reached.
+def mix_audio_segments(prepared, asset_pool, seed=0):
     break_count = 0
+    overlap_ms = 0
 
-    # Load the global ambiance audio
-    global_ambiance_audio = AudioSegment.from_mp3(global_ambiance_mp3)
-
-    for segment in segments:
-        if segment["type"] == "utterance":
-            print("Mixing audio for:", segment["text"])
-            output_file = find_segment_by_utterance(segment["text"], voices[segment["speaker"]], segments_cache)
-            print("Output file:", output_file)
-            speech_audio = AudioSegment.from_mp3(output_file)
-            #speech_audio = speech_audio.speedup(playback_speed=1.2)  # Adjust the speed here
-            # Speedup using pydub with adjustments to minimize clipping
-            speed_factor = 1.2  # Adjust the speed factor as needed
-            #speech_audio = speech_audio.speedup(playback_speed=speed_factor, chunk_size=50, crossfade=25)
-
-            # Normalize the audio to reduce clipping
-            speech_audio = speech_audio.normalize()
-            # High-quality speedup using pyrubberband
-            # speed_factor = 1.2  # Adjust the speed factor as needed
-            # speech_samples = speech_audio.get_array_of_samples()
-            # stretched_samples = time_stretch(speech_samples, speech_audio.frame_rate, speed_factor)
-            # speech_audio = AudioSegment(
-            #     data=stretched_samples.tobytes(),
-            #     sample_width=speech_audio.sample_width,
-            #     frame_rate=speech_audio.frame_rate,
-            #     channels=speech_audio.channels
-            # )
-            speech_audio = rubberband(speech_audio, 1.1)
-            speech_audio = add_echo(speech_audio, gain_db=-3)  # Adjust the echo level here
-            speech_audio = vary_volume(speech_audio, min_db=-3, max_db=3)  # Adjust the volume variation here
-            speech_audio = speech_audio.pan(pans[segment["speaker"]])
+    for segment, line in prepared:
+        if isinstance(segment, Utterance) and line is not None:
+            print("Mixing audio for:", segment.text)
+            line_key, pending = line
+            speech_samples = pending.result()
             # per speaker ambiance 
             #ambiance_audio = AudioSegment.from_mp3(random.choice(ambiance_mp3s))
             #ambiance_audio = ambiance_audio[:len(speech_audio)]
             #ambiance_audio = ambiance_audio - 20  # Adjust the ambiance volume here
             #speech_audio = speech_audio.overlay(ambiance_audio)
 
-            # Mix the speech audio with the global ambiance audio
-            remaining_duration = len(speech_audio)
-            global_ambiance_chunk = AudioSegment.empty()
-            while remaining_duration > 0:
-                if len(global_ambiance_audio) >= remaining_duration:
-                    print("Adding global ambiance chunk1")
-                    global_ambiance_chunk += global_ambiance_audio[:remaining_duration]
-                    remaining_duration = 0
-                else:
-                    print("Adding global ambiance chunk2")
-                    global_ambiance_chunk += global_ambiance_audio
-                    remaining_duration -= len(global_ambiance_audio)
-                    global_ambiance_audio = AudioSegment.from_mp3(global_ambiance_mp3)
-
-            global_ambiance_chunk = global_ambiance_chunk  # Adjust the global ambiance volume here
-            speech_audio = speech_audio.overlay(global_ambiance_chunk)
-
-
-            breathing_audio_file = breathing()
-            if breathing_audio_file:
-                breathing_audio = AudioSegment.from_mp3(breathing_audio_file)
-                mixed_audio += breathing_audio
-
-            mixed_audio += speech_audio
-        elif segment["type"] == "break":
-            break_audio_file = handle_break(break_count)
+            # Seeded per line, so editing one line doesn't change every later breath. A line
+            # cutting in over the previous one starts talking straight away.
+            breathing_audio_file = breathing(asset_pool, random.Random(f"{seed}:{line_key}"))
+            if breathing_audio_file and not overlap_ms:
+                yield asset_pool.load(breathing_audio_file), breathing_audio_file, 0
+
+            yield speech_samples, line_key, overlap_ms
+            overlap_ms = 0
+        elif isinstance(segment, Break):
+            break_audio_file = handle_break(asset_pool, random.Random(f"{seed}:break:{break_count}"), break_count)
             if break_audio_file:
-                break_audio = AudioSegment.from_mp3(break_audio_file)
-                mixed_audio += break_audio
+                yield asset_pool.load(break_audio_file), break_audio_file, 0
             break_count += 1
-
-    return mixed_audio
-
-# Function to add intro and outro music
-def add_intro_outro(mixed_audio):
-    intro_audio = AudioSegment.from_mp3("intro.mp3")
-    outro_audio = AudioSegment.from_mp3("outro.mp3")
-
-    intro_audio = intro_audio + AudioSegment.silent(duration=500)
-    mixed_audio = intro_audio.append(mixed_audio, crossfade=100)
-    mixed_audio = mixed_audio + AudioSegment.silent(duration=500)
-    mixed_audio = mixed_audio.append(outro_audio, crossfade=1000)
-
-    return mixed_audio
-
-# Main function to generate the podcast
-def generate_podcast():
-    # Read the script file
-    with open("script.txt", "r") as file:
-        script = file.read()
-
-    # Parse the script into segments
-    segments = parse_script(script)
-
-    # Load the segments cache if it exists
-    if os.path.exists("segments/segments.json"):
-        with open("segments/segments.json", "r") as file:
-            segments_cache = json.load(file)
+        elif isinstance(segment, Pause):
+            # Silence is laid out as a frame count; nothing is allocated for it
+            frames = ms_to_frames(segment.ms, asset_pool.frame_rate)
+            yield frames, f"pause:{frames}", 0
+        elif isinstance(segment, Overlap):
+            overlap_ms = segment.ms
+
+# Function to add intro and outro music around the body clips, with the global ambiance
+# looped continuously underneath the body on its own track. With a sink (e.g. an
+# encoder's write), finished audio is handed over as each clip is added, so encoding
+# overlaps mixing and processing instead of waiting for the whole episode.
+def add_intro_outro(clips, asset_pool, sink=None):
+    episode = Timeline(asset_pool.frame_rate, asset_pool.channels)
+    episode.append(asset_pool.load("intro.mp3"), clip_id="intro.mp3")
+    episode.append_silence(intro_gap_ms)
+
+    body_start = episode.end_frame()
+    fade_in_end = body_start + ms_to_frames(ambiance_fade_ms, episode.frame_rate)
+    bed = episode.place(asset_pool.load(global_ambiance_mp3), body_start, "ambiance",
+                        clip_id=global_ambiance_mp3, loop=True)
+    episode.automate("ambiance", "gain", body_start, 0.0)
+    episode.automate("ambiance", "gain", fade_in_end, 1.0)
+
+    crossfade_ms = body_crossfade_ms
+    for samples, clip_id, overlap_ms in clips:
+        # A pause (a bare frame count) has nothing to fade into
+        episode.append(samples, crossfade_ms=0 if isinstance(samples, int) else crossfade_ms, clip_id=clip_id,
+                       overlap_ms=overlap_ms)
+        crossfade_ms = 0
+        if sink:
+            episode.flush(sink, hold_ms=max(outro_crossfade_ms, MAX_OVERLAP_MS))
+    episode.append_silence(intro_gap_ms)
+
+    # The bed fades out while the outro fades in
+    body_end = episode.end_frame()
+    fade_out_start = max(body_end - ms_to_frames(outro_crossfade_ms, episode.frame_rate), fade_in_end)
+    episode.automate("ambiance", "gain", fade_out_start, 1.0)
+    episode.automate("ambiance", "gain", max(body_end, fade_out_start), 0.0)
+    episode.end_loop(bed, max(body_end, fade_out_start))
+    episode.append(asset_pool.load("outro.mp3"), crossfade_ms=outro_crossfade_ms, clip_id="outro.mp3")
+    if sink:
+        episode.finish(sink)
+
+    return episode
+
+# Main function to generate the podcast. progress, if given, is called with the name of
+# each stage as it starts. extra_outputs are further "path[:bitrate]" encodings of the
+# same mix (e.g. a low-bitrate MP3 and an M4A), written by the same encoder pass.
+# video_output, if given, is an MP4 of the waveform over background_file rendered from the
+# same PCM, replacing a second pass with mp3tomp4.sh.
+# The mix is mastered to target_lufs with a true-peak limiter before it is encoded; that
+# needs the whole episode's loudness first, so the mix is spooled to disk and encoded after
+# it. With target_lufs=None the mix is encoded as it is produced, unmastered.
+def generate_podcast(segment_cache, processed_cache, synthesis_pool, asset_pool, stretch_backend="wsola", seed=0, jobs=1,
+                     script_file="script.txt", output_file="output.mp3", speaker_voices=voices, speaker_pans=pans,
+                     progress=None, recorder=NULL_RECORDER, incremental=False, extra_outputs=(),
+                     video_output=None, video_preset="fast", background_file="background.png", script_lines=None,
+                     target_lufs=mastering.TARGET_LUFS, check_speakers=False):
+    progress = progress or (lambda stage: None)
+    outputs = [parse_output(output_file)] + [parse_output(spec) for spec in extra_outputs]
+    background = video.load_background(background_file) if video_output else None
+
+    def stage(name):
+        progress(name)
+        return recorder.stage(name)
+
+    if script_lines is not None:
+        # Lines still being written: synthesize, process and mix each one as it arrives. The
+        # "stream" stage is recorded by the thread doing the work, overlapping "mix".
+        progress("stream")
+        prepared = stream_utterances(script_lines, segment_cache, processed_cache, synthesis_pool, stretch_backend,
+                                     seed, jobs, speaker_voices, speaker_pans, recorder, check_speakers)
     else:
-        segments_cache = {}
-
-    # Generate speech segments and update the cache
-    generate_speech_segments(segments, segments_cache)
-
-    # Mix the audio segments
-    mixed_audio = mix_audio_segments(segments, segments_cache)
-
-    # Add intro and outro music
-    final_audio = add_intro_outro(mixed_audio)
-
-    # Export the final audio
-    final_audio.export("output.mp3", format="mp3")
-
-# Run the podcast generation
-generate_podcast()
-
+        # Parse the script file into segments, checking every line before anything is synthesized
+        with stage("parse"):
+            segments = list(ScriptParser(speaker_voices, speaker_pans, check_speakers=check_speakers)
+                            .parse_file(script_file))
+        recorder.set("script_lines", sum(1 for segment in segments if isinstance(segment, Utterance)))
+
+        # Generate speech segments and update the cache
+        with stage("synthesize"):
+            generate_speech_segments(segments, segment_cache, synthesis_pool, recorder)
+
+        # Process each line (stretch, vary volume, pan...) across jobs processes. Waiting for all
+        # of them here keeps the DSP time in "process" rather than hidden in "mix".
+        with stage("process"):
+            processed = process_utterances(segments, segment_cache, processed_cache, stretch_backend, seed, jobs,
+                                           recorder)
+            wait([line.future for _, line in processed.values() if isinstance(line, PendingLine)])
+        prepared = ((segment, processed.get(index)) for index, segment in enumerate(segments))
+
+    def open_encoders():
+        encoders = [StreamingEncoder(outputs, asset_pool.frame_rate, asset_pool.channels)]
+        if video_output:
+            encoders.append(video.VideoRenderer(video_output, background, asset_pool.frame_rate,
+                                                asset_pool.channels, video_preset))
+        return encoders
+
+    def close_encoders(encoders):
+        for encoder in encoders:
+            encoder.close()
+
+    # Master the mixed episode (an array or memory map) into the encoders
+    def master_encode(mixed, loudness):
+        gain_db = mastering.mastering_gain_db(loudness, target_lufs)
+        encoders = open_encoders()
+        try:
+            def sink(samples):
+                for encoder in encoders:
+                    encoder.write(samples)
+
+            output_loudness, true_peak_db = mastering.master(mixed, gain_db, sink, asset_pool.frame_rate)
+        finally:
+            close_encoders(encoders)
+        mastering.report(recorder, loudness, gain_db, output_loudness, true_peak_db)
+        return encoders[0]
+
+    if incremental:
+        # Incremental mode needs the whole layout to diff against the previous render, then
+        # splices just the changed span into the previous render's unmastered master PCM
+        with stage("mix"):
+            final_audio = add_intro_outro(mix_audio_segments(prepared, asset_pool, seed), asset_pool)
+        with stage("render"):
+            samples = render_incremental(final_audio, output_file, recorder)
+        if target_lufs is not None:
+            with stage("measure"):
+                meter = mastering.LoudnessMeter(final_audio.frame_rate, final_audio.channels)
+                for start in range(0, len(samples), mastering.BLOCK_FRAMES):
+                    meter.add(samples[start:start + mastering.BLOCK_FRAMES])
+            with stage("master_encode"):
+                master_encode(samples, meter.integrated())
+        else:
+            with stage("encode"):
+                encode_samples(samples, outputs, final_audio.frame_rate)
+            if video_output:
+                with stage("video"):
+                    video.encode_video(samples, video_output, background, final_audio.frame_rate, video_preset)
+        frames = len(samples)
+        recorder.count("pcm_bytes_encoded", samples.nbytes)
+    elif target_lufs is not None:
+        # Mix lines in script order as they finish processing, measuring the loudness on the
+        # way to a spool file, then master and encode the whole episode in one pass
+        spool = mastering.PcmSpool(asset_pool.channels)
+        try:
+            with stage("mix"):
+                meter = mastering.LoudnessMeter(asset_pool.frame_rate, asset_pool.channels)
+
+                def sink(samples):
+                    spool.write(samples)
+                    meter.add(samples)
+
+                final_audio = add_intro_outro(mix_audio_segments(prepared, asset_pool, seed), asset_pool, sink=sink)
+            with stage("master_encode"):
+                encoder = master_encode(spool.samples(), meter.integrated())
+        finally:
+            spool.close()
+        frames = final_audio.flushed
+        recorder.count("pcm_bytes_encoded", encoder.bytes_written)
+    else:
+        # Mix lines in script order as they finish processing, streaming finished audio to the encoder
+        with stage("mix_encode"):
+            encoders = open_encoders()
+
+            def sink(samples):
+                for encoder in encoders:
+                    encoder.write(samples)
+
+            try:
+                final_audio = add_intro_outro(mix_audio_segments(prepared, asset_pool, seed), asset_pool, sink=sink)
+            finally:
+                close_encoders(encoders)
+        encoder = encoders[0]
+        frames = final_audio.flushed
+        recorder.count("pcm_bytes_encoded", encoder.bytes_written)
+    processed_cache.evict()
+    recorder.set("asset_bytes_decoded", asset_pool.decoded_bytes())
+    recorder.set("episode_seconds", round(frames / asset_pool.frame_rate, 2))
+    recorder.count("bytes_encoded", sum(os.path.getsize(path) for path, _ in outputs))
+    if video_output:
+        recorder.set("video_bytes", os.path.getsize(video_output))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate output.mp3 from script.txt.")
+    parser.add_argument("--cache-stats", action="store_true", help="Print segment cache statistics and exit.")
+    parser.add_argument("--cache-max-mb", type=int, default=None, help="Evict least recently used segments above this size.")
+    parser.add_argument("--cache-max-age-days", type=int, default=None, help="Evict segments unused for this many days.")
+    parser.add_argument("--tts-concurrency", type=int, default=4, help="Maximum number of TTS requests in flight.")
+    parser.add_argument("--tts-rps", type=float, default=None, help="Maximum TTS requests started per second.")
+    parser.add_argument("--stretch-backend", choices=sorted(timestretch.BACKENDS), default="wsola",
+                        help="Time-stretch implementation: in-process wsola or the rubberband CLI.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the random per-line volume variation.")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of processes for per-line audio processing.")
+    parser.add_argument("--processed-cache-max-mb", type=int, default=2048,
+                        help="Size cap for the cache of processed (stretched, panned) line audio.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Reuse the previous render of the output and only re-mix the lines that changed.")
+    parser.add_argument("--extra-output", action="append", default=[], metavar="PATH[:BITRATE]",
+                        help="Also encode the episode to this file (.mp3, .m4a or .aac) in the same pass, "
+                             "e.g. output_64k.mp3:64k or output.m4a:160k. Repeatable.")
+    parser.add_argument("--video", help="Also render a waveform video (MP4) of the episode from the same mix.")
+    parser.add_argument("--video-preset", choices=list(video.PRESETS), default="fast",
+                        help="x264 speed/quality trade-off for --video (software encoding only).")
+    parser.add_argument("--generate-script", action="store_true",
+                        help="Generate script.txt with the LLM first, synthesizing each line as soon as it is written.")
+    parser.add_argument("--target-lufs", type=float, default=mastering.TARGET_LUFS,
+                        help="Integrated loudness to master the episode to (with a -1 dBTP true-peak limiter).")
+    parser.add_argument("--no-mastering", action="store_true",
+                        help="Encode the mix as it is produced, without loudness normalization or limiting.")
+    parser.add_argument("--check-speakers", action="store_true",
+                        help="Fail on \"Name: text\" lines whose name isn't a known speaker (usually a typo) "
+                             "instead of ignoring them as prose (with --generate-script, report and skip them).")
+    parser.add_argument("--report", help="Write a JSON run report with per-stage timings and counters here.")
+    parser.add_argument("--trace", help="Write a Chrome trace of the run here.")
+    args = parser.parse_args()
+
+    max_bytes = args.cache_max_mb * 1024 * 1024 if args.cache_max_mb is not None else None
+    segment_cache = SegmentCache("segments", max_bytes=max_bytes, max_age_days=args.cache_max_age_days)
+    processed_cache = ProcessedCache("segments/processed", max_bytes=args.processed_cache_max_mb * 1024 * 1024)
+    if args.cache_stats:
+        segment_cache.print_stats()
+        processed_cache.print_stats()
+    else:
+        synthesis_pool = SynthesisPool(tts_client(), concurrency=args.tts_concurrency, requests_per_second=args.tts_rps)
+        # Run the podcast generation
+        asset_pool = shared_pool("sounds")
+        recorder = Recorder() if args.report or args.trace else NULL_RECORDER
+        script_lines = None
+        if args.generate_script:
+            import script_generator2
+            line_queue = queue.Queue()
+            threading.Thread(target=script_generator2.default_generator().stream_script, args=(line_queue,),
+                             daemon=True).start()
+            script_lines = iter_queue(line_queue)
+        generate_podcast(segment_cache, processed_cache, synthesis_pool, asset_pool, args.stretch_backend, args.seed,
+                         args.jobs, recorder=recorder, incremental=args.incremental, extra_outputs=args.extra_output,
+                         video_output=args.video, video_preset=args.video_preset, script_lines=script_lines,
+                         target_lufs=None if args.no_mastering else args.target_lufs,
+                         check_speakers=args.check_speakers)
+        if args.report:
+            recorder.write_report(args.report)
+        if args.trace:
+            recorder.write_trace(args.trace)
+        evicted = segment_cache.evict()
+        if evicted:
+            print(f"Evicted {evicted} cached segments")
+        segment_cache.print_stats()
+        processed_cache.print_stats()
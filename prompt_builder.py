@@ -0,0 +1,104 @@
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Rough size of a token in English text, used when tiktoken isn't installed
+CHARS_PER_TOKEN = 4
+
+# Comments cut shorter than this are dropped rather than sent as fragments
+MIN_COMMENT_TOKENS = 16
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+
+def count_tokens(text):
+    if tiktoken is not None:
+        return len(_get_encoding().encode(text))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+# The start of text, at most max_tokens long, cut at a word boundary when estimating
+def truncate_tokens(text, max_tokens):
+    if count_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    if tiktoken is not None:
+        return _get_encoding().decode(_get_encoding().encode(text)[:max_tokens - 1]).rstrip() + "…"
+    cut = text[:(max_tokens - 1) * CHARS_PER_TOKEN]
+    if " " in cut:
+        cut = cut[:cut.rindex(" ")]
+    return cut.rstrip() + "…"
+
+
+# Share budget between items wanting needs tokens: each gets what it needs if it fits,
+# otherwise an equal split of what the smaller items leave over
+def _allocate(needs, budget):
+    shares = [0] * len(needs)
+    remaining = budget
+    order = sorted(range(len(needs)), key=lambda index: needs[index])
+    for position, index in enumerate(order):
+        shares[index] = min(needs[index], remaining // (len(needs) - position))
+        remaining -= shares[index]
+    return shares
+
+
+def _story_header(story):
+    return f"Title: {story['title']}\nFirst Paragraph: {story['first_paragraph']}\n\nComments:\n"
+
+
+# Render the stories for the prompt, in at most max_tokens if given. When they don't fit,
+# stories whose title and comment headings alone don't fit in what is left are dropped
+# (the later, lower-ranked ones first), and the budget beyond those headings is shared
+# fairly between the rest (short stories keep all of theirs); within a story the first
+# paragraph gets up to half and the comments the rest, in order, each truncated to fit
+# and the ones left with too little room dropped.
+def build_story_text(stories, max_tokens=None, comments_per_story=3):
+    parts = []
+    stories = [(story, [str(comment) for comment in story["comments"][:comments_per_story]]) for story in stories]
+    needs = [count_tokens(_story_header(story)) + sum(count_tokens(f"- {comment}\n") for comment in comments) + 1
+             for story, comments in stories]
+    if max_tokens is None or sum(needs) <= max_tokens:
+        shares = needs
+    else:
+        kept, fixed, remaining = [], [], max_tokens
+        for (story, comments), need in zip(stories, needs):
+            story_fixed = count_tokens(_story_header({**story, "first_paragraph": ""})) + 1
+            if story_fixed <= remaining:
+                kept.append(((story, comments), need))
+                fixed.append(story_fixed)
+                remaining -= story_fixed
+        stories = [story for story, _ in kept]
+        needs = [need for _, need in kept]
+        extra = _allocate([need - story_fixed for need, story_fixed in zip(needs, fixed)], remaining)
+        shares = [story_fixed + share for story_fixed, share in zip(fixed, extra)]
+
+    for (story, comments), need, share in zip(stories, needs, shares):
+        if share >= need:
+            parts.append(_story_header(story))
+            parts.extend(f"- {comment}\n" for comment in comments)
+            parts.append("\n")
+            continue
+        fixed = count_tokens(_story_header({**story, "first_paragraph": ""})) + 1
+        comment_needs = sum(count_tokens(f"- {comment}\n") for comment in comments)
+        paragraph_budget = max(share // 2, share - fixed - comment_needs)
+        paragraph = truncate_tokens(story["first_paragraph"], paragraph_budget - fixed)
+        parts.append(_story_header({**story, "first_paragraph": paragraph}))
+        remaining = share - count_tokens(parts[-1]) - 1
+        for comment in comments:
+            room = remaining - 2
+            if room < min(MIN_COMMENT_TOKENS, count_tokens(comment)):
+                break
+            line = f"- {truncate_tokens(comment, room)}\n"
+            parts.append(line)
+            remaining -= count_tokens(line)
+        parts.append("\n")
+    return "".join(parts)
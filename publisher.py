@@ -0,0 +1,167 @@
+import hashlib
+import json
+import mimetypes
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import multipart_etag
+
+MIB = 1024 * 1024
+
+CONTENT_TYPES = {
+    '.mp3': 'audio/mpeg',
+    '.m4a': 'audio/mp4',
+    '.mp4': 'video/mp4',
+    '.rss': 'application/rss+xml; charset=utf-8',
+    '.html': 'text/html; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.json': 'application/json',
+}
+
+# Media keys are unique per episode and never rewritten, and static/ assets are named by
+# their content, so caches may keep them forever; feeds change with every episode and must
+# be revalidated (cheap, with ETags). Site pages set their own (see site_builder).
+STATIC_PREFIX = 'static/'
+MEDIA_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+DOCUMENT_CACHE_CONTROL = 'no-cache'
+
+
+def content_type_for(key):
+    extension = os.path.splitext(key)[1].lower()
+    return CONTENT_TYPES.get(extension) or mimetypes.guess_type(key)[0] or 'application/octet-stream'
+
+
+def cache_control_for(key):
+    if key.startswith(STATIC_PREFIX) or content_type_for(key).startswith(('audio/', 'video/', 'image/')):
+        return MEDIA_CACHE_CONTROL
+    return DOCUMENT_CACHE_CONTROL
+
+
+def _quoted_md5(body):
+    return '"' + hashlib.md5(body).hexdigest() + '"'
+
+
+# Uploads to a storage backend (S3Storage or FilesystemStorage) with the right headers,
+# skipping anything whose ETag already matches.
+#
+# Large files go up as multipart uploads with concurrency parts in flight, each retried
+# with backoff. Progress is kept under cache_dir/uploads, so a run that dies halfway
+# resumes from the parts the server already has instead of starting over. Small
+# documents (feeds, pages) are put concurrently in one batch over the storage's shared client.
+class Publisher:
+    def __init__(self, storage, cache_dir='.podcast_cache', concurrency=8, part_size=8 * MIB,
+                 multipart_threshold=16 * MIB, max_retries=4, base_delay=0.5, sleep=time.sleep):
+        if part_size < 5 * MIB:
+            raise ValueError('S3 parts must be at least 5 MiB')
+        self.storage = storage
+        self.state_dir = os.path.join(cache_dir, storage.cache_id, 'uploads')
+        self.concurrency = concurrency
+        self.part_size = part_size
+        self.multipart_threshold = multipart_threshold
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.sleep = sleep
+        self.skipped = 0
+        self.uploaded = 0
+        self.bytes_uploaded = 0
+
+    def _retry(self, call, *args):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return call(*args)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = random.uniform(0, self.base_delay * 2 ** attempt)
+                print(f'Upload call failed ({e}); retrying in {delay:.1f}s')
+                self.sleep(delay)
+
+    def _parts(self, size):
+        return [(number, offset, min(self.part_size, size - offset))
+                for number, offset in enumerate(range(0, size, self.part_size), start=1)]
+
+    # The ETag the file will have once uploaded the way upload_file would upload it
+    def expected_etag(self, path):
+        size = os.path.getsize(path)
+        with open(path, 'rb') as file:
+            if size < self.multipart_threshold:
+                return _quoted_md5(file.read())
+            return multipart_etag([hashlib.md5(file.read(length)).digest() for _, _, length in self._parts(size)])
+
+    # Upload a file (multipart above multipart_threshold) unless the remote copy already
+    # matches. Returns True if anything was uploaded.
+    def upload_file(self, path, key, content_type=None, cache_control=None):
+        content_type = content_type or content_type_for(key)
+        cache_control = cache_control or cache_control_for(key)
+        if self.storage.head(key) == self.expected_etag(path):
+            self.skipped += 1
+            return False
+        size = os.path.getsize(path)
+        if size < self.multipart_threshold:
+            self._retry(self.storage.upload_file, path, key, content_type, cache_control)
+        else:
+            self._upload_multipart(path, key, size, content_type, cache_control)
+        self.uploaded += 1
+        self.bytes_uploaded += size
+        return True
+
+    def _state_path(self, path, key):
+        stat = os.stat(path)
+        identity = json.dumps([key, os.path.abspath(path), stat.st_size, stat.st_mtime_ns, self.part_size])
+        return os.path.join(self.state_dir, hashlib.sha256(identity.encode('utf-8')).hexdigest()[:24] + '.json')
+
+    def _upload_multipart(self, path, key, size, content_type, cache_control):
+        state_path = self._state_path(path, key)
+        parts = None
+        try:
+            with open(state_path, 'r') as file:
+                upload_id = json.load(file)['upload_id']
+            parts = self.storage.list_parts(key, upload_id)
+        except FileNotFoundError:
+            pass
+        if parts is None:
+            upload_id = self.storage.create_multipart(key, content_type, cache_control)
+            parts = {}
+            os.makedirs(self.state_dir, exist_ok=True)
+            with open(state_path, 'w') as file:
+                json.dump({'key': key, 'upload_id': upload_id}, file)
+        else:
+            print(f'Resuming upload of {key}: {len(parts)} parts already uploaded')
+
+        # A part the server has is kept only if it matches the local file
+        def upload_part(number, offset, length):
+            with open(path, 'rb') as file:
+                file.seek(offset)
+                body = file.read(length)
+            if parts.get(number) == _quoted_md5(body):
+                return number, parts[number]
+            return number, self._retry(self.storage.upload_part, key, upload_id, number, body)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            done = dict(executor.map(lambda part: upload_part(*part), self._parts(size)))
+        self._retry(self.storage.complete_multipart, key, upload_id, done)
+        os.remove(state_path)
+
+    # Put several small documents concurrently: items are (key, body) or (key, body,
+    # content_type, cache_control). Documents whose MD5 already matches are skipped.
+    # Returns the keys written.
+    def put_many(self, items):
+        def put(item):
+            key, body = item[0], item[1]
+            body = body.encode('utf-8') if isinstance(body, str) else body
+            content_type = (item[2] if len(item) > 2 else None) or content_type_for(key)
+            cache_control = (item[3] if len(item) > 3 else None) or cache_control_for(key)
+            if self.storage.head(key) == _quoted_md5(body):
+                return None
+            self._retry(lambda: self.storage.put(key, body, content_type=content_type, cache_control=cache_control))
+            return key, len(body)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = list(executor.map(put, items))
+        written = [result for result in results if result is not None]
+        self.skipped += len(results) - len(written)
+        self.uploaded += len(written)
+        self.bytes_uploaded += sum(length for _, length in written)
+        return [key for key, _ in written]
@@ -0,0 +1,301 @@
+import argparse
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import podgen
+from instrumentation import Recorder
+from assets import shared_pool
+from encoder import parse_output
+from segment_cache import ProcessedCache, SegmentCache
+import timestretch
+from tts_pool import SynthesisPool
+
+
+# path resolved inside work_dir; ValueError if it points elsewhere (absolute, or climbing out with ..)
+def job_path(work_dir, path):
+    resolved = os.path.realpath(os.path.join(work_dir, path))
+    if os.path.commonpath([resolved, work_dir]) != work_dir or resolved == work_dir:
+        raise ValueError(f"Output path {path!r} must be a file inside the job directory")
+    return resolved
+
+
+class RenderJob:
+    def __init__(self, job_id, work_dir, script_file, output_file, speaker_voices, speaker_pans, seed, extra_outputs=()):
+        self.id = job_id
+        self.work_dir = work_dir
+        self.script_file = script_file
+        self.output_file = output_file
+        self.extra_outputs = list(extra_outputs)
+        self.speaker_voices = speaker_voices
+        self.speaker_pans = speaker_pans
+        self.seed = seed
+        self.status = "queued"
+        self.stage = None
+        self.error = None
+        self.timings = {}
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self._stage_started = None
+
+    # Called by generate_podcast at the start of each stage
+    def progress(self, stage):
+        now = time.time()
+        if self.stage is not None:
+            self.timings[self.stage] = round(now - self._stage_started, 3)
+        self.stage = stage
+        self._stage_started = now
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "output": self.output_file,
+            "extra_outputs": self.extra_outputs,
+            "work_dir": self.work_dir,
+            "error": self.error,
+            "timings": self.timings,
+            "queued_seconds": round((self.started or time.time()) - self.submitted, 3),
+            "total_seconds": round(self.finished - self.started, 3) if self.finished and self.started else None,
+        }
+
+
+# Long-running renderer: caches, decoded sounds and the TTS client are created once and
+# shared by every job; each job gets its own working directory under jobs_dir.
+# client defaults to ElevenLabs; anything with generate(text=..., voice=..., model=...) works.
+# After each job both caches are trimmed to their caps, keeping whatever a job still
+# running has used.
+class RenderService:
+    def __init__(self, jobs_dir="jobs", workers=2, stretch_backend="wsola", jobs=1,
+                 tts_concurrency=4, tts_rps=None, processed_cache_max_mb=2048, client=None,
+                 cache_max_mb=None, cache_max_age_days=None):
+        self.jobs_dir = jobs_dir
+        self.stretch_backend = stretch_backend
+        self.jobs = jobs
+        max_bytes = cache_max_mb * 1024 * 1024 if cache_max_mb is not None else None
+        self.segment_cache = SegmentCache("segments", max_bytes=max_bytes, max_age_days=cache_max_age_days)
+        self.processed_cache = ProcessedCache("segments/processed", max_bytes=processed_cache_max_mb * 1024 * 1024)
+        self.synthesis_pool = SynthesisPool(client or podgen.tts_client(), concurrency=tts_concurrency, requests_per_second=tts_rps)
+        self.asset_pool = shared_pool("sounds")
+        self.render_jobs = {}
+        self._queue = queue.Queue()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # Start times of the jobs running now; registering a job and evicting share a lock, so
+        # eviction never sees a job that has started but isn't listed
+        self._running = {}
+        self._evict_lock = threading.Lock()
+        os.makedirs(jobs_dir, exist_ok=True)
+        for _ in range(workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    # Queue a render. script is the script text (or script_file a path to one, for callers in
+    # this process; HTTP takes only script); output paths (and "path[:bitrate]" extra outputs)
+    # are resolved inside the job's working directory, and any that would land outside it
+    # raise ValueError. Without pans, custom voices are centred.
+    def submit(self, script=None, script_file=None, output="output.mp3", voices=None, pans=None, seed=0,
+               extra_outputs=()):
+        with self._lock:
+            job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{next(self._ids)}"
+        work_dir = os.path.realpath(os.path.join(self.jobs_dir, job_id))
+        output_file = job_path(work_dir, output)
+        extra_output_files = []
+        for spec in extra_outputs:
+            path, bitrate = parse_output(spec)
+            path = job_path(work_dir, path)
+            extra_output_files.append(f"{path}:{bitrate}" if bitrate else path)
+        if pans is None:
+            pans = {speaker: 0.0 for speaker in voices} if voices else podgen.pans
+        os.makedirs(work_dir)
+        if script is not None:
+            script_file = os.path.join(work_dir, "script.txt")
+            with open(script_file, "w") as file:
+                file.write(script)
+        elif script_file is None:
+            raise ValueError("A job needs a script or a script_file")
+        job = RenderJob(job_id, work_dir, os.path.abspath(script_file), output_file,
+                        voices or podgen.voices, pans, seed, extra_output_files)
+        with self._lock:
+            self.render_jobs[job_id] = job
+        self._queue.put(job)
+        return job
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.status = "running"
+            with self._evict_lock:
+                job.started = time.time()
+                self._running[job.id] = job.started
+            recorder = Recorder()
+            try:
+                podgen.generate_podcast(
+                    self.segment_cache, self.processed_cache, self.synthesis_pool, self.asset_pool,
+                    self.stretch_backend, job.seed, self.jobs,
+                    script_file=job.script_file, output_file=job.output_file,
+                    speaker_voices=job.speaker_voices, speaker_pans=job.speaker_pans,
+                    progress=job.progress, recorder=recorder, extra_outputs=job.extra_outputs,
+                )
+                job.progress(None)
+                job.status = "done"
+            except Exception as e:
+                job.error = str(e)
+                job.status = "failed"
+                with open(os.path.join(job.work_dir, "error.txt"), "w") as file:
+                    file.write(traceback.format_exc())
+            job.finished = time.time()
+            self._finish(job)
+            recorder.write_report(os.path.join(job.work_dir, "report.json"))
+            recorder.write_trace(os.path.join(job.work_dir, "trace.json"))
+            with open(os.path.join(job.work_dir, "job.json"), "w") as file:
+                json.dump(job.to_dict(), file, indent=2)
+
+    # Trim the caches, keeping anything used since the oldest job still running started
+    def _finish(self, job):
+        with self._evict_lock:
+            del self._running[job.id]
+            used_since = min(self._running.values(), default=time.time())
+            evicted = self.segment_cache.evict(used_since)
+            self.processed_cache.evict(used_since)
+        if evicted:
+            print(f"Evicted {evicted} cached segments")
+
+    def list_jobs(self):
+        with self._lock:
+            return [job.to_dict() for job in self.render_jobs.values()]
+
+
+def make_handler(service):
+    class RenderHandler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            data = json.dumps(body, indent=2).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/jobs":
+                self._send(200, service.list_jobs())
+            elif self.path.startswith("/jobs/"):
+                job = service.render_jobs.get(self.path[len("/jobs/"):])
+                if job is None:
+                    self._send(404, {"error": "no such job"})
+                else:
+                    self._send(200, job.to_dict())
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/jobs":
+                self._send(404, {"error": "not found"})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                # Scripts come inline; a path would let clients read any file the server can
+                if not isinstance(request.get("script"), str):
+                    raise ValueError("A job needs the script text in \"script\"")
+                job = service.submit(
+                    script=request["script"],
+                    output=request.get("output", "output.mp3"),
+                    voices=request.get("voices"),
+                    pans=request.get("pans"),
+                    seed=request.get("seed", 0),
+                    extra_outputs=request.get("extra_outputs", []),
+                )
+            except (ValueError, OSError) as e:
+                self._send(400, {"error": str(e)})
+                return
+            self._send(202, job.to_dict())
+
+    return RenderHandler
+
+
+def serve(args):
+    service = RenderService(args.jobs_dir, args.workers, args.stretch_backend, args.jobs,
+                            args.tts_concurrency, args.tts_rps, args.processed_cache_max_mb,
+                            cache_max_mb=args.cache_max_mb, cache_max_age_days=args.cache_max_age_days)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"Render service listening on http://{args.host}:{args.port} with {args.workers} workers")
+    server.serve_forever()
+
+
+def _request(url, body=None):
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def submit(args):
+    body = {"output": args.output, "seed": args.seed, "extra_outputs": args.extra_output}
+    with open(args.script, "r") as file:
+        body["script"] = file.read()
+    if args.voices:
+        with open(args.voices, "r") as file:
+            cast = json.load(file)
+        body["voices"] = {speaker: entry["voice"] for speaker, entry in cast.items()}
+        body["pans"] = {speaker: entry.get("pan", 0.0) for speaker, entry in cast.items()}
+    job = _request(f"{args.url}/jobs", body)
+    print(json.dumps(job, indent=2))
+    while args.wait and job["status"] in ("queued", "running"):
+        time.sleep(1)
+        job = _request(f"{args.url}/jobs/{job['id']}")
+        print(f"{job['status']}: {job['stage']}")
+    if args.wait:
+        print(json.dumps(job, indent=2))
+
+
+def status(args):
+    path = f"/jobs/{args.job_id}" if args.job_id else "/jobs"
+    print(json.dumps(_request(f"{args.url}{path}"), indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render podcast episodes from a warm, long-running service.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="Run the render service.")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--workers", type=int, default=2, help="Episodes rendered at once.")
+    serve_parser.add_argument("--jobs-dir", default="jobs", help="Directory for per-job working directories.")
+    serve_parser.add_argument("--jobs", type=int, default=1, help="Processes for per-line audio processing per episode.")
+    serve_parser.add_argument("--stretch-backend", choices=sorted(timestretch.BACKENDS), default="wsola")
+    serve_parser.add_argument("--tts-concurrency", type=int, default=4)
+    serve_parser.add_argument("--tts-rps", type=float, default=None)
+    serve_parser.add_argument("--cache-max-mb", type=int, default=None,
+                              help="Evict least recently used segments above this size after each job.")
+    serve_parser.add_argument("--cache-max-age-days", type=int, default=None,
+                              help="Evict segments unused for this many days after each job.")
+    serve_parser.add_argument("--processed-cache-max-mb", type=int, default=2048,
+                              help="Size cap for the processed-audio cache.")
+    serve_parser.set_defaults(handler=serve)
+
+    submit_parser = commands.add_parser("submit", help="Queue an episode.")
+    submit_parser.add_argument("--url", default="http://127.0.0.1:8765")
+    submit_parser.add_argument("--script", default="script.txt")
+    submit_parser.add_argument("--output", default="output.mp3", help="Output path, relative to the job directory.")
+    submit_parser.add_argument("--extra-output", action="append", default=[], metavar="PATH[:BITRATE]",
+                               help="Also encode to this file (.mp3, .m4a or .aac), e.g. output.m4a:160k. Repeatable.")
+    submit_parser.add_argument("--voices", help='JSON file of {"Speaker": {"voice": id, "pan": -0.25}}.')
+    submit_parser.add_argument("--seed", type=int, default=0)
+    submit_parser.add_argument("--wait", action="store_true", help="Poll until the job finishes.")
+    submit_parser.set_defaults(handler=submit)
+
+    status_parser = commands.add_parser("status", help="Show one job, or all jobs.")
+    status_parser.add_argument("--url", default="http://127.0.0.1:8765")
+    status_parser.add_argument("job_id", nargs="?")
+    status_parser.set_defaults(handler=status)
+
+    args = parser.parse_args()
+    args.handler(args)
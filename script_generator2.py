@@ -1,9 +1,10 @@
 import os
 import json
-import requests
 from datetime import datetime
-from openai import OpenAI
 from string import Template
+from hn_fetch import HN_ITEM_URL, Fetcher, expand_story_ids, top_stories
+from llm_cache import ResponseCache
+from prompt_builder import build_story_text, count_tokens
 
 class HackerNewsPodcastGenerator:
     default_prompt_template = """
@@ -12,70 +13,188 @@ Based on the following top stories from Hacker News, generate a creative and eng
 $stories
 Conversation:
 """
+    system_prompt = "You are a creative assistant."
 
-    def __init__(self, url, num_stories=3, prompt_template=None):
+    # fetcher defaults to a pooled, disk-cached Fetcher, so reruns on the same day get 304s.
+    # If url lists bare story ids (like the HN API's topstories.json), each story and its
+    # first comments are fetched from item_url.
+    # client is anything with chat.completions.create(...) like OpenAI's, e.g. a local fake.
+    # cache (an llm_cache.ResponseCache) answers a request it has seen before without calling
+    # the model. max_prompt_tokens caps the prompt, trimming paragraphs and comments (and
+    # dropping the lowest-ranked stories) to fit; the template itself is never cut.
+    def __init__(self, url, num_stories=3, prompt_template=None, fetcher=None, item_url=HN_ITEM_URL, client=None,
+                 model="gpt-4-turbo", cache=None, max_prompt_tokens=None, comments_per_story=3):
         self.url = url
         self.num_stories = num_stories
         self.prompt_template = prompt_template or self.default_prompt_template
+        self.fetcher = fetcher or Fetcher()
+        self.item_url = item_url
+        self.client = client
+        self.model = model
+        self.cache = cache
+        self.max_prompt_tokens = max_prompt_tokens
+        self.comments_per_story = comments_per_story
     
     def fetch_top_stories(self):
-        response = requests.get(self.url)
-        data = response.json()
-        stories = data  # Assuming the JSON data is already a list of stories
-        stories.sort(key=lambda x: x["points"], reverse=True)
-        return stories[:self.num_stories]
+        stories = self.fetcher.get_json(self.url)
+        if stories and all(isinstance(story, int) for story in stories):
+            stories = expand_story_ids(self.fetcher, stories, self.num_stories, item_url=self.item_url)
+        else:
+            stories = top_stories(stories, self.num_stories)
+        print(f"Fetched {len(stories)} stories ({self.fetcher.stats['requests']} requests, "
+              f"{self.fetcher.stats['not_modified']} not modified)")
+        return stories
     
-    def generate_conversation(self, stories):
-        client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-        
-        story_text = ""
-        for story in stories:
-            story_text += f"Title: {story['title']}\nFirst Paragraph: {story['first_paragraph']}\n\nComments:\n"
-            for comment in story["comments"][:3]:
-                story_text += f"- {comment}\n"
-            story_text += "\n"
-        
+    def _client(self):
+        if self.client is None:
+            # Imported here so that an injected client doesn't need the OpenAI SDK
+            from openai import OpenAI
+            self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        return self.client
+
+    def _messages(self, stories):
         prompt_template = Template(self.prompt_template)
+        story_budget = None
+        if self.max_prompt_tokens is not None:
+            overhead = count_tokens(self.system_prompt) + count_tokens(prompt_template.substitute(stories=""))
+            story_budget = max(0, self.max_prompt_tokens - overhead)
+        story_text = build_story_text(stories, story_budget, self.comments_per_story)
         prompt_text = prompt_template.substitute(stories=story_text)
-        
-        response = client.chat.completions.create(
-            model="gpt-4-turbo",
-            messages=[
-                {"role": "system", "content": "You are a creative assistant."},
-                {"role": "user", "content": prompt_text}
-            ]
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": prompt_text}
+        ]
+    
+    def _cached(self, messages):
+        content = self.cache.lookup(self.model, messages) if self.cache else None
+        if content is not None:
+            print("Using the cached conversation for these stories")
+        return content
+    
+    # Cache a response with its token usage (estimated if the API didn't report it)
+    def _store(self, messages, content, usage):
+        if not self.cache:
+            return
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+        if prompt_tokens is None:
+            prompt_tokens = sum(count_tokens(message["content"]) for message in messages)
+        if completion_tokens is None:
+            completion_tokens = count_tokens(content)
+        self.cache.store(self.model, messages, content, prompt_tokens, completion_tokens)
+    
+    def generate_conversation(self, stories):
+        messages = self._messages(stories)
+        cached = self._cached(messages)
+        if cached is not None:
+            return cached
+        response = self._client().chat.completions.create(
+            model=self.model,
+            messages=messages
         )
         
         if response and response.choices and len(response.choices) > 0:
             content = response.choices[0].message.content.strip()
+            self._store(messages, content, getattr(response, "usage", None))
             return content
         else:
             raise Exception("Failed to generate conversation.")
     
-    def generate_script_json(self):
-        top_stories = self.fetch_top_stories()
-        conversation = self.generate_conversation(top_stories)
-        
+    # The conversation as it is generated: yields each complete line of the script as soon
+    # as its newline arrives in the token stream (and the last line when the stream ends)
+    def stream_conversation(self, stories):
+        messages = self._messages(stories)
+        cached = self._cached(messages)
+        if cached is not None:
+            yield from cached.split("\n")
+            return
+        stream = self._client().chat.completions.create(
+            model=self.model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        received = []
+        pending = []
+        usage = None
+        for chunk in stream:
+            # With include_usage the last chunk has the usage and no choices
+            usage = getattr(chunk, "usage", None) or usage
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            if not text:
+                continue
+            received.append(text)
+            *lines, rest = text.split("\n")
+            for line in lines:
+                pending.append(line)
+                yield "".join(pending)
+                pending = []
+            pending.append(rest)
+        if "".join(pending):
+            yield "".join(pending)
+        self._store(messages, "".join(received).strip(), usage)
+    
+    # Trim the response cache and print this run's hits and tokens saved
+    def report(self):
+        if self.cache:
+            self.cache.evict()
+            self.cache.print_stats()
+    
+    # Generate the script, putting each line on line_queue as soon as it is complete (so
+    # podgen can synthesize it while the rest is still being written) and then None. If
+    # generation fails the exception is put on the queue instead. Writes script.txt and the
+    # JSON record as generate_script_json does.
+    def stream_script(self, line_queue, script_file="script.txt"):
+        try:
+            top_stories = self.fetch_top_stories()
+            lines = []
+            with open(script_file, "w") as file:
+                for line in self.stream_conversation(top_stories):
+                    file.write(line + "\n")
+                    file.flush()
+                    lines.append(line)
+                    line_queue.put(line)
+            self._save_json(json.dumps(self._output_data(top_stories, "\n".join(lines).strip()), indent=2))
+        except Exception as e:
+            line_queue.put(e)
+            raise
+        line_queue.put(None)
+        self.report()
+    
+    def _output_data(self, top_stories, conversation):
         today = datetime.now().strftime("%Y-%m-%d")
-        output_data = {
+        return {
             "date": today,
             "input_data": top_stories,
             "conversation": conversation
         }
+    
+    def generate_script_json(self):
+        top_stories = self.fetch_top_stories()
+        conversation = self.generate_conversation(top_stories)
+        
+        output_data = self._output_data(top_stories, conversation)
         with open("script.txt", "w") as file:
             file.write(conversation)
         return json.dumps(output_data, indent=2)
     
-    def save_script(self):
-        script_json = self.generate_script_json()
+    def _save_json(self, script_json):
         today = datetime.now().strftime("%Y-%m-%d")
         output_filename = f"script-{today}.json"
         with open(output_filename, "w") as file:
             file.write(script_json) 
         print(f"Generated script saved as {output_filename}")
         return output_filename
+    
+    def save_script(self):
+        output_filename = self._save_json(self.generate_script_json())
+        self.report()
+        return output_filename
 
-def main():
+# The generator for the daily Quacker News episode
+def default_generator(client=None):
     url = "https://quackernews.com/output/output2.json"
     num_stories = 5  # Change this to the desired number of top stories
     
@@ -98,8 +217,12 @@ $stories
 Conversation:
 """
     
-    generator = HackerNewsPodcastGenerator(url, num_stories, prompt_template=custom_prompt_template)
-    generator.save_script()
+    # Reruns on the same day with the same stories reuse the conversation instead of paying for it again
+    return HackerNewsPodcastGenerator(url, num_stories, prompt_template=custom_prompt_template, client=client,
+                                      cache=ResponseCache(), max_prompt_tokens=6000)
+
+def main():
+    default_generator().save_script()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,131 @@
+import re
+from dataclasses import dataclass
+
+from segment_cache import DEFAULT_MODEL, segment_key
+
+# "[break]", "[pause 1.5s]", "[pause 800ms]", "[overlap 300ms]"
+_DIRECTIVE = re.compile(r"\[\s*([a-z]+)(?:\s+([^\]]*?))?\s*\]", re.IGNORECASE)
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)\s*(ms|s)?", re.IGNORECASE)
+# What a speaker label looks like, for check_speakers: up to four words, starting with a
+# letter. Anything else before a colon (a timestamp, a URL scheme followed by //) is just text.
+_SPEAKER_LABEL = re.compile(r"[^\W\d_][\w'.-]*(?: [\w'.-]+){0,3}")
+
+MAX_PAUSE_MS = 60000
+# How far a line can start over the end of the one before it
+MAX_OVERLAP_MS = 2000
+
+
+class ScriptError(ValueError):
+    def __init__(self, line, message):
+        super().__init__(f"Script line {line}: {message}")
+        self.line = line
+
+
+# A spoken line. source_key is the TTS cache key for (voice, model, text); speaker_index is
+# the speaker's position in the voice table.
+@dataclass(slots=True)
+class Utterance:
+    line: int
+    speaker: str
+    speaker_index: int
+    voice: str
+    pan: float
+    text: str
+    source_key: str
+
+
+@dataclass(slots=True)
+class Break:
+    line: int
+
+
+@dataclass(slots=True)
+class Pause:
+    line: int
+    ms: int
+
+
+# The next line starts ms before the previous one ends, both speakers talking at once
+@dataclass(slots=True)
+class Overlap:
+    line: int
+    ms: int
+
+
+# Parses script lines into Utterance, Break, Pause and Overlap records as they are read, so a
+# script can come from a file or from a generator that is still writing it.
+#
+# "Speaker: text" lines are dialogue when the label is a speaker from speaker_voices;
+# any other line is prose and ignored, "Note: ..." and "Update: ..." included. With
+# check_speakers, a label that looks like a name (not a timestamp or URL) but isn't a
+# known speaker is treated as a typo instead, so it fails the run before any TTS is paid
+# for. Malformed [directives], and with check_speakers unknown speakers, raise
+# ScriptError with strict (the default); otherwise the line is reported and skipped.
+class ScriptParser:
+    def __init__(self, speaker_voices, speaker_pans=None, model=DEFAULT_MODEL, strict=True, check_speakers=False):
+        self.speakers = {name: index for index, name in enumerate(speaker_voices)}
+        self.voices = dict(speaker_voices)
+        self.pans = dict(speaker_pans or {})
+        self.model = model
+        self.strict = strict
+        self.check_speakers = check_speakers
+        self.skipped = 0
+
+    def _reject(self, line_number, message):
+        if self.strict:
+            raise ScriptError(line_number, message)
+        print(f"Skipping script line {line_number}: {message}")
+        self.skipped += 1
+
+    def _directive(self, line_number, stripped):
+        match = _DIRECTIVE.fullmatch(stripped)
+        if match is None:
+            return None
+        name, argument = match.group(1).lower(), match.group(2)
+        if name == "break" and not argument:
+            return Break(line_number)
+        if name in ("pause", "overlap"):
+            limit, record = (MAX_PAUSE_MS, Pause) if name == "pause" else (MAX_OVERLAP_MS, Overlap)
+            duration = _DURATION.fullmatch(argument or "")
+            if duration is None:
+                self._reject(line_number, f"{name} needs a duration like [{name} 2s] or [{name} 500ms], got {stripped!r}")
+                return None
+            value = float(duration.group(1))
+            ms = int(round(value if (duration.group(2) or "s").lower() == "ms" else value * 1000))
+            if not 0 < ms <= limit:
+                self._reject(line_number, f"{name} must be between 1 and {limit} ms, got {stripped!r}")
+                return None
+            return record(line_number, ms)
+        self._reject(line_number, f"unknown directive {stripped!r}")
+        return None
+
+    def parse(self, lines):
+        speakers = self.speakers
+        for line_number, line in enumerate(lines, start=1):
+            stripped = line.strip()
+            if not stripped:
+                continue
+            if stripped[0] == "[":
+                record = self._directive(line_number, stripped)
+                if record is not None:
+                    yield record
+                continue
+            label, colon, text = stripped.partition(":")
+            if not colon:
+                continue
+            label, text = label.strip(), text.strip()
+            index = speakers.get(label)
+            if index is None:
+                if self.check_speakers and text and not text.startswith("//") and _SPEAKER_LABEL.fullmatch(label):
+                    self._reject(line_number, f"unknown speaker {label!r} (expected one of {', '.join(speakers)})")
+                continue
+            if not text:
+                continue
+            voice = self.voices[label]
+            yield Utterance(line_number, label, index, voice, self.pans.get(label, 0.0), text,
+                            segment_key(voice, self.model, text))
+
+    # Parse a script file without reading it into memory first
+    def parse_file(self, path):
+        with open(path, "r") as file:
+            yield from self.parse(file)
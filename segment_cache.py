@@ -0,0 +1,303 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+# Model used for every TTS call; part of the cache key so switching models re-synthesizes
+DEFAULT_MODEL = "eleven_multilingual_v2"
+
+
+# Collapse whitespace so cosmetic script edits don't miss the cache
+def normalize_text(text):
+    return " ".join(text.split())
+
+
+# Content address of a spoken line: same voice, model and words -> same audio
+def segment_key(voice, model, text):
+    digest = hashlib.sha256()
+    digest.update("\0".join([voice, model, normalize_text(text)]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Write a file atomically: write(path) fills a temp file next to final_path, which is then renamed into place
+def atomic_write(final_path, write):
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(final_path), suffix=".tmp")
+    os.close(fd)
+    try:
+        write(temp_path)
+        os.replace(temp_path, final_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class SegmentCache:
+    def __init__(self, cache_dir="segments", max_bytes=None, max_age_days=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self.run_started = time.time()
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(cache_dir, "cache.db"), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS segments ("
+            "key TEXT PRIMARY KEY, path TEXT NOT NULL, voice TEXT, model TEXT, text TEXT, "
+            "size INTEGER, created REAL, last_used REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS segments_last_used ON segments (last_used)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self.db.commit()
+
+        self._import_legacy_index(os.path.join(cache_dir, "segments.json"))
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.mp3")
+
+    # Return the cached file for this line, or None if it has to be synthesized
+    def lookup(self, voice, text, model=DEFAULT_MODEL):
+        path = self.get(voice, text, model)
+        with self._lock:
+            if path is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return path
+
+    # Like lookup, but without counting a hit or miss (for reading back lines already looked up)
+    def get(self, voice, text, model=DEFAULT_MODEL):
+        key = segment_key(voice, model, text)
+        with self._lock:
+            row = self.db.execute("SELECT path FROM segments WHERE key = ?", (key,)).fetchone()
+            if row and os.path.exists(row[0]):
+                self.db.execute("UPDATE segments SET last_used = ? WHERE key = ?", (time.time(), key))
+                self.db.commit()
+                return row[0]
+            if row:
+                # The file was deleted behind our back; forget it
+                self.db.execute("DELETE FROM segments WHERE key = ?", (key,))
+                self.db.commit()
+            return None
+
+    # Write a new segment atomically: write_audio(path) fills a temp file which is then renamed into place
+    def store(self, voice, text, write_audio, model=DEFAULT_MODEL):
+        key = segment_key(voice, model, text)
+        path = self.path_for(key)
+        atomic_write(path, write_audio)
+        self._record(key, path, voice, model, text)
+        return path
+
+    def _record(self, key, path, voice, model, text):
+        now = time.time()
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO segments (key, path, voice, model, text, size, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, path, voice, model, normalize_text(text), os.path.getsize(path), now, now),
+            )
+            self.db.commit()
+
+    # Carry over segments recorded by the old segments.json so they are never re-synthesized
+    def _import_legacy_index(self, legacy_path):
+        if not os.path.exists(legacy_path):
+            return
+        with self._lock:
+            if self.db.execute("SELECT 1 FROM meta WHERE name = 'legacy_imported'").fetchone():
+                return
+        with open(legacy_path, "r") as file:
+            legacy = json.load(file)
+        imported = 0
+        for segment_file, segment_data in legacy.items():
+            if not os.path.exists(segment_file):
+                continue
+            key = segment_key(segment_data["voice"], DEFAULT_MODEL, segment_data["utterance"])
+            self._record(key, segment_file, segment_data["voice"], DEFAULT_MODEL, segment_data["utterance"])
+            imported += 1
+        with self._lock:
+            self.db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('legacy_imported', ?)", (str(imported),))
+            self.db.commit()
+        print(f"Imported {imported} segments from {legacy_path}")
+
+    def _delete(self, key, path):
+        if os.path.exists(path):
+            os.remove(path)
+        self.db.execute("DELETE FROM segments WHERE key = ?", (key,))
+
+    # Drop segments unused for max_age_days, then least recently used ones until under max_bytes.
+    # Anything used since used_since (by default, the start of this run) is kept even if the
+    # size cap is too small for it; a long-running service passes the start of its oldest
+    # job still running.
+    def evict(self, used_since=None):
+        used_since = self.run_started if used_since is None else used_since
+        evicted = 0
+        with self._lock:
+            if self.max_age_days is not None:
+                cutoff = time.time() - self.max_age_days * 86400
+                rows = self.db.execute("SELECT key, path FROM segments WHERE last_used < ?", (cutoff,)).fetchall()
+                for key, path in rows:
+                    self._delete(key, path)
+                    evicted += 1
+            if self.max_bytes is not None:
+                total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM segments").fetchone()[0]
+                rows = self.db.execute(
+                    "SELECT key, path, size FROM segments WHERE last_used < ? ORDER BY last_used",
+                    (used_since,),
+                )
+                for key, path, size in rows.fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    self._delete(key, path)
+                    total -= size
+                    evicted += 1
+            self.db.commit()
+        return evicted
+
+    def stats(self):
+        with self._lock:
+            count, total, oldest, newest = self.db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), MIN(last_used), MAX(last_used) FROM segments"
+            ).fetchone()
+            per_voice = self.db.execute(
+                "SELECT voice, COUNT(*), COALESCE(SUM(size), 0) FROM segments GROUP BY voice ORDER BY voice"
+            ).fetchall()
+        return {
+            "segments": count,
+            "bytes": total,
+            "oldest_use": oldest,
+            "newest_use": newest,
+            "voices": {voice: {"segments": n, "bytes": size} for voice, n, size in per_voice},
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"Cache directory: {self.cache_dir}")
+        print(f"Segments: {stats['segments']} ({stats['bytes'] / 1e6:.1f} MB)")
+        if stats["segments"]:
+            print("Least recently used:", time.strftime("%Y-%m-%d %H:%M", time.localtime(stats["oldest_use"])))
+            print("Most recently used:", time.strftime("%Y-%m-%d %H:%M", time.localtime(stats["newest_use"])))
+        for voice, voice_stats in stats["voices"].items():
+            print(f"  {voice}: {voice_stats['segments']} segments ({voice_stats['bytes'] / 1e6:.1f} MB)")
+        print(f"This run: {stats['hits']} hits, {stats['misses']} misses")
+
+    def close(self):
+        self.db.close()
+
+
+# Key for a processed line: the source segment plus every parameter of the processing chain
+def processed_key(source_key, params):
+    digest = hashlib.sha256()
+    digest.update(source_key.encode("utf-8"))
+    digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Second cache tier: post-processed PCM (.npy) for each line, so a remix only reprocesses
+# lines whose audio or processing parameters changed. Least recently used entries are
+# evicted once the cache grows past max_bytes.
+class ProcessedCache:
+    def __init__(self, cache_dir="segments/processed", max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.run_started = time.time()
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(cache_dir, "processed.db"), timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS processed ("
+            "key TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER, last_used REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS processed_last_used ON processed (last_used)")
+        self.db.commit()
+        self.total_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM processed").fetchone()[0]
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npy")
+
+    # Return the processed samples (memory-mapped, read-only) or None
+    def lookup(self, source_key, params):
+        samples = self.get(source_key, params)
+        if samples is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return samples
+
+    # Like lookup, but without counting a hit or miss (for reading back freshly processed lines)
+    def get(self, source_key, params):
+        key = processed_key(source_key, params)
+        with self._lock:
+            row = self.db.execute("SELECT path FROM processed WHERE key = ?", (key,)).fetchone()
+            if row and os.path.exists(row[0]):
+                self.db.execute("UPDATE processed SET last_used = ? WHERE key = ?", (time.time(), key))
+                self.db.commit()
+                return np.load(row[0], mmap_mode="r")
+            return None
+
+    def store(self, source_key, params, samples):
+        key = processed_key(source_key, params)
+        path = self.path_for(key)
+
+        def write(temp_path):
+            with open(temp_path, "wb") as file:
+                np.save(file, samples)
+
+        atomic_write(path, write)
+        size = os.path.getsize(path)
+        with self._lock:
+            previous = self.db.execute("SELECT size FROM processed WHERE key = ?", (key,)).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO processed (key, path, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, path, size, time.time()),
+            )
+            self.total_bytes += size - (previous[0] if previous else 0)
+            self._evict()
+            self.db.commit()
+
+    # Re-read the size (other processes may have stored entries) and enforce max_bytes,
+    # keeping anything used since used_since (by default, the start of this run)
+    def evict(self, used_since=None):
+        with self._lock:
+            self.total_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM processed").fetchone()[0]
+            self._evict(used_since)
+            self.db.commit()
+
+    # Drop least recently used entries not used since used_since until under max_bytes
+    def _evict(self, used_since=None):
+        if self.max_bytes is None or self.total_bytes <= self.max_bytes:
+            return
+        rows = self.db.execute(
+            "SELECT key, path, size FROM processed WHERE last_used < ? ORDER BY last_used",
+            (self.run_started if used_since is None else used_since,)
+        ).fetchall()
+        for key, path, size in rows:
+            if self.total_bytes <= self.max_bytes:
+                break
+            if os.path.exists(path):
+                os.remove(path)
+            self.db.execute("DELETE FROM processed WHERE key = ?", (key,))
+            self.total_bytes -= size
+
+    def print_stats(self):
+        with self._lock:
+            count = self.db.execute("SELECT COUNT(*) FROM processed").fetchone()[0]
+        print(f"Processed audio: {count} lines ({self.total_bytes / 1e6:.1f} MB)")
+        print(f"This run: {self.hits} hits, {self.misses} misses")
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,310 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+from html import escape
+from string import Formatter
+
+from feed_builder import FEED_KEYS
+from publisher import STATIC_PREFIX, Publisher
+
+# Bump when the templates change, so every page is rendered again
+SITE_FORMAT_VERSION = 1
+
+INDEX_KEY = 'index.html'
+FRONT_PAGE_SIZE = 10
+ARCHIVE_PAGE_SIZE = 50
+
+# Pages that change with every episode (the front page and the newest archive page) are
+# cached briefly; episode pages and full archive pages only change when a record or the
+# templates do, so caches keep them for an hour and may serve them stale for a day while
+# they revalidate in the background
+RECENT_PAGE_CACHE_CONTROL = 'public, max-age=60, stale-while-revalidate=600'
+PAGE_CACHE_CONTROL = 'public, max-age=3600, stale-while-revalidate=86400'
+
+SITE_CSS = '''body {
+    font-family: 'Montserrat', sans-serif;
+    background-color: #F5F5DC;
+    color: #4B0082;
+    margin: 0;
+    padding: 0;
+}
+header {
+    background-color: #4B0082;
+    color: #FFFFFF;
+    padding: 20px;
+    text-align: center;
+}
+header a {
+    color: inherit;
+    text-decoration: none;
+}
+h1 {
+    font-size: 36px;
+    margin: 0;
+}
+main {
+    max-width: 800px;
+    margin: 0 auto;
+    padding: 20px;
+}
+.episode {
+    background-color: #FFFFFF;
+    border-radius: 5px;
+    padding: 20px;
+    margin-bottom: 20px;
+    box-shadow: 0 2px 5px rgba(0, 0, 0, 0.1);
+}
+.episode-title {
+    font-size: 24px;
+    font-weight: bold;
+    margin-bottom: 10px;
+}
+.episode-title a {
+    color: inherit;
+}
+.episode-meta {
+    font-size: 14px;
+    color: #666666;
+    margin-bottom: 10px;
+}
+.episode-description {
+    font-size: 16px;
+    color: #333333;
+    margin-bottom: 10px;
+}
+audio {
+    width: 100%;
+}
+.pages {
+    display: flex;
+    justify-content: space-between;
+    margin: 20px 0;
+}
+.pages a {
+    color: #4B0082;
+}
+.subscribe-section {
+    text-align: center;
+    margin-top: 40px;
+}
+.subscribe-link {
+    display: inline-block;
+    background-color: #4B0082;
+    color: #FFFFFF;
+    font-size: 20px;
+    padding: 10px 20px;
+    text-decoration: none;
+    border-radius: 5px;
+}
+.subscribe-link:hover {
+    background-color: #6A5ACD;
+}
+'''
+
+# Named by content, so it never changes under a key and caches may keep it forever
+CSS_KEY = f"{STATIC_PREFIX}site-{hashlib.sha256(SITE_CSS.encode('utf-8')).hexdigest()[:12]}.css"
+
+
+def episode_page_key(episode_id):
+    return f'episode/{episode_id:06d}.html'
+
+
+def archive_page_key(page):
+    return f'archive/page-{page:05d}.html'
+
+
+# Split a template into its literal text and {fields} once, so rendering is a single join.
+# Values are HTML-escaped, except for fields named *_html, which are inserted as they are.
+def compile_template(source):
+    parts = [(literal, field, field is not None and field.endswith('_html'))
+             for literal, field, _, _ in Formatter().parse(source)]
+
+    def render(**values):
+        out = []
+        for literal, field, raw in parts:
+            out.append(literal)
+            if field is not None:
+                value = str(values[field])
+                out.append(value if raw else escape(value))
+        return ''.join(out)
+
+    return render
+
+
+_PAGE = compile_template('''<!DOCTYPE html>
+<html lang="{language}">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{title}</title>
+<link href="https://fonts.googleapis.com/css2?family=Montserrat:wght@400;700&display=swap" rel="stylesheet">
+<link href="{css_url}" rel="stylesheet">
+<link rel="alternate" type="application/rss+xml" title="{podcast_title}" href="{feed_url}">
+</head>
+<body>
+<header><h1><a href="{home_url}">{podcast_title}</a></h1></header>
+<main>
+{content_html}
+<div class="subscribe-section">
+<a class="subscribe-link" href="{feed_url}">Subscribe to {podcast_title}</a>
+</div>
+</main>
+</body>
+</html>
+''')
+
+# preload="none" so a page of players doesn't fetch the head of every MP3 on load
+_EPISODE = compile_template('''<div class="episode">
+<div class="episode-title"><a href="{url}">{title}</a></div>
+<div class="episode-meta">{meta}</div>
+<div class="episode-description">{summary}</div>
+<audio controls preload="none">
+<source src="{mp3_url}" type="audio/mpeg">
+Your browser does not support the audio element.
+</audio>
+</div>
+''')
+
+_HEADING = compile_template('<h2>{text}</h2>\n')
+_LINK = compile_template('<a href="{url}">{text}</a>')
+_NAV = compile_template('<nav class="pages"><span>{older_html}</span><span>{newer_html}</span></nav>\n')
+
+
+def _display_date(pub_date):
+    published = datetime.fromisoformat(pub_date)
+    return f'{published:%B} {published.day}, {published.year}'
+
+
+# Builds the web site from the episode index: a page per episode, archive pages listing
+# every episode, and the front page with the newest. All of them share one stylesheet,
+# uploaded under a content-hashed key (CSS_KEY) with an immutable cache lifetime.
+#
+# Archive pages are fixed-size and numbered from the oldest episode, so an episode stays on
+# the same page forever and a full page only changes if one of its records does. Each page
+# is identified by the hash of its inputs (the record hashes from the manifest, its
+# navigation and the templates); pages whose hash matches the last publish from this cache
+# are neither rendered nor fetched. Adding an episode renders its own page, the front page
+# and the newest archive page (and the one before it when a new page starts), however many
+# episodes there are.
+class SiteBuilder:
+    def __init__(self, index, channel, cache_dir='.podcast_cache', front_page_size=FRONT_PAGE_SIZE,
+                 archive_page_size=ARCHIVE_PAGE_SIZE):
+        self.index = index
+        self.channel = channel
+        self.front_page_size = front_page_size
+        self.archive_page_size = archive_page_size
+        self.cache_root = cache_dir
+        self.state_path = os.path.join(cache_dir, index.storage.cache_id, 'site', 'published.json')
+        self.pages_rendered = 0
+        self._pending = {}
+        settings = json.dumps([SITE_FORMAT_VERSION, CSS_KEY, channel], sort_keys=True)
+        self._salt = hashlib.sha256(settings.encode('utf-8')).hexdigest()[:8]
+
+    def _url(self, key):
+        return f"{self.channel['url']}/{key}"
+
+    def _render_page(self, title, content_html):
+        channel = self.channel
+        return _PAGE(language=channel['language'], title=title, podcast_title=channel['title'],
+                     css_url=self._url(CSS_KEY), feed_url=self._url(FEED_KEYS['main']), home_url=self._url(INDEX_KEY),
+                     content_html=content_html)
+
+    def render_episode(self, episode):
+        meta = _display_date(episode['pub_date'])
+        if episode.get('duration'):
+            meta += f" · {episode['duration']}"
+        return _EPISODE(url=self._url(episode_page_key(episode['id'])), title=episode['title'], meta=meta,
+                        summary=episode['summary'], mp3_url=self._url(episode['mp3_key']))
+
+    def _nav(self, older=None, newer=None):
+        return _NAV(older_html=_LINK(url=self._url(older[0]), text=older[1]) if older else '',
+                    newer_html=_LINK(url=self._url(newer[0]), text=newer[1]) if newer else '')
+
+    def _render_episode_page(self, episodes, archive_page):
+        episode = episodes[0]
+        nav = self._nav(newer=(archive_page_key(archive_page), 'More episodes'))
+        return self._render_page(f"{episode['title']} - {self.channel['title']}", self.render_episode(episode) + nav)
+
+    def _render_archive_page(self, episodes, page, first, last_page):
+        newer = (INDEX_KEY, 'Latest episodes') if last_page else (archive_page_key(page + 1), 'Newer episodes')
+        older = (archive_page_key(page - 1), 'Older episodes') if page else None
+        heading = _HEADING(text=f'Episodes {first} to {first + len(episodes) - 1}')
+        content = heading + ''.join(self.render_episode(episode) for episode in episodes)
+        return self._render_page(f"{self.channel['title']} (archive {page + 1})",
+                                 content + self._nav(older, newer))
+
+    def _render_front_page(self, episodes, archive_pages):
+        nav = self._nav(older=(archive_page_key(archive_pages - 1), 'All episodes')) if archive_pages else ''
+        return self._render_page(self.channel['title'], ''.join(self.render_episode(episode) for episode in episodes) + nav)
+
+    # [(key, manifest entries, navigation, render, cache control)] for every page of the
+    # site; render(records, **navigation) returns the page's HTML
+    def pages(self):
+        # pub_dates are ISO strings, so they sort chronologically without parsing
+        entries = sorted(self.index.entries(), key=lambda entry: entry['pub_date'])
+        size = self.archive_page_size
+        archive = [entries[start:start + size] for start in range(0, len(entries), size)]
+        pages = [(INDEX_KEY, entries[::-1][:self.front_page_size], {'archive_pages': len(archive)},
+                  self._render_front_page, RECENT_PAGE_CACHE_CONTROL)]
+        for number, page in enumerate(archive):
+            last_page = number == len(archive) - 1
+            pages.append((archive_page_key(number), page[::-1],
+                          {'page': number, 'first': number * size + 1, 'last_page': last_page},
+                          self._render_archive_page, RECENT_PAGE_CACHE_CONTROL if last_page else PAGE_CACHE_CONTROL))
+            for entry in page:
+                pages.append((episode_page_key(entry['id']), [entry], {'archive_page': number},
+                              self._render_episode_page, PAGE_CACHE_CONTROL))
+        return pages
+
+    def _digest(self, key, entries, navigation):
+        inputs = [self._salt, key, [(entry['id'], entry['hash']) for entry in entries], navigation]
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _published(self):
+        try:
+            with open(self.state_path, 'r') as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    # [(key, body, content type, cache control)] for the stylesheet, if it hasn't been
+    # published from this cache, and every page whose inputs changed since the last publish.
+    # The records of those pages' episodes are fetched concurrently in one batch.
+    def changed(self):
+        published = self._published()
+        documents = []
+        if CSS_KEY not in published:
+            documents.append((CSS_KEY, SITE_CSS.encode('utf-8'), None, None))
+            self._pending[CSS_KEY] = CSS_KEY
+        due = []
+        for key, entries, navigation, render, cache_control in self.pages():
+            digest = self._digest(key, entries, navigation)
+            if published.get(key) != digest:
+                due.append((key, entries, navigation, render, cache_control, digest))
+
+        needed = {entry['id']: entry for page in due for entry in page[1]}
+        records = dict(zip(needed, self.index.records(list(needed.values()))))
+        for key, entries, navigation, render, cache_control, digest in due:
+            body = render([records[entry['id']] for entry in entries], **navigation).encode('utf-8')
+            documents.append((key, body, None, cache_control))
+            self._pending[key] = digest
+            self.pages_rendered += 1
+        return documents
+
+    def mark_published(self, documents):
+        published = self._published()
+        published.update((document[0], self._pending.pop(document[0])) for document in documents)
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        temp_path = f'{self.state_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(published, file)
+        os.replace(temp_path, self.state_path)
+
+    # Render the changed pages and upload them in one concurrent batch. Returns the keys written.
+    def publish(self, publisher=None):
+        publisher = publisher or Publisher(self.index.storage, self.cache_root)
+        documents = self.changed()
+        written = publisher.put_many(documents)
+        self.mark_published(documents)
+        return written
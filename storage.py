@@ -0,0 +1,313 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import uuid
+
+
+class NotFound(Exception):
+    pass
+
+
+# A conditional write lost: the object changed (If-Match) or already exists (If-None-Match: *)
+class PreconditionFailed(Exception):
+    pass
+
+
+def _etag(body):
+    return '"' + hashlib.md5(body).hexdigest() + '"'
+
+
+# The ETag S3 gives an object assembled from parts: the MD5 of the parts' MD5s, plus -count
+def multipart_etag(part_digests):
+    return '"' + hashlib.md5(b''.join(part_digests)).hexdigest() + f'-{len(part_digests)}"'
+
+
+# botocore errors carry the S3 error code in response['Error']['Code']
+def _error_code(error):
+    return str(getattr(error, 'response', {}).get('Error', {}).get('Code', ''))
+
+
+# Object storage in an S3 bucket. get/put speak ETags so callers can cache (If-None-Match)
+# and make safe read-modify-write updates (If-Match) without a lock service.
+# One client is shared by every thread; max_pool_connections sizes its connection pool for
+# concurrent uploads.
+class S3Storage:
+    def __init__(self, bucket_name, s3=None, max_pool_connections=16):
+        if s3 is None:
+            import boto3
+            from botocore.config import Config
+            s3 = boto3.client('s3', config=Config(max_pool_connections=max_pool_connections,
+                                                  retries={'max_attempts': 5, 'mode': 'adaptive'}))
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.cache_id = f's3-{bucket_name}'
+
+    # Returns (body, etag); body is None if the object still has etag if_none_match
+    def get(self, key, if_none_match=None):
+        kwargs = {'Bucket': self.bucket_name, 'Key': key}
+        if if_none_match:
+            kwargs['IfNoneMatch'] = if_none_match
+        try:
+            response = self.s3.get_object(**kwargs)
+        except Exception as e:
+            code = _error_code(e)
+            if code in ('NoSuchKey', '404'):
+                raise NotFound(key) from e
+            if code in ('NotModified', '304'):
+                return None, if_none_match
+            raise
+        return response['Body'].read(), response['ETag']
+
+    # Write body and return its ETag. if_match only overwrites that version;
+    # if_none_match='*' only creates. Either raises PreconditionFailed if it loses.
+    def put(self, key, body, if_match=None, if_none_match=None, content_type=None, cache_control=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        kwargs = {'Bucket': self.bucket_name, 'Key': key, 'Body': body}
+        if if_match:
+            kwargs['IfMatch'] = if_match
+        if if_none_match:
+            kwargs['IfNoneMatch'] = if_none_match
+        if content_type:
+            kwargs['ContentType'] = content_type
+        if cache_control:
+            kwargs['CacheControl'] = cache_control
+        try:
+            response = self.s3.put_object(**kwargs)
+        except Exception as e:
+            if _error_code(e) in ('PreconditionFailed', '412', 'ConditionalRequestConflict', '409'):
+                raise PreconditionFailed(key) from e
+            raise
+        return response['ETag']
+
+    # The object's ETag, or None if it doesn't exist
+    def head(self, key):
+        try:
+            return self.s3.head_object(Bucket=self.bucket_name, Key=key)['ETag']
+        except Exception as e:
+            if _error_code(e) in ('NoSuchKey', '404', 'NotFound'):
+                return None
+            raise
+
+    # length bytes from offset (fewer at the end of the object), and the object's size
+    def read_range(self, key, offset, length):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket_name, Key=key,
+                                          Range=f'bytes={offset}-{offset + length - 1}')
+        except Exception as e:
+            if _error_code(e) in ('NoSuchKey', '404'):
+                raise NotFound(key) from e
+            if _error_code(e) in ('InvalidRange', '416'):
+                return b''
+            raise
+        return response['Body'].read()
+
+    def size(self, key):
+        try:
+            return self.s3.head_object(Bucket=self.bucket_name, Key=key)['ContentLength']
+        except Exception as e:
+            if _error_code(e) in ('NoSuchKey', '404', 'NotFound'):
+                raise NotFound(key) from e
+            raise
+
+    # A single PutObject, streamed from the file, so the ETag is the file's plain MD5 (which
+    # Publisher.expected_etag relies on). boto3's upload_file would switch to multipart at
+    # 8 MiB; Publisher does its own multipart uploads above its threshold.
+    def upload_file(self, path, key, content_type=None, cache_control=None):
+        kwargs = {'Bucket': self.bucket_name, 'Key': key}
+        if content_type:
+            kwargs['ContentType'] = content_type
+        if cache_control:
+            kwargs['CacheControl'] = cache_control
+        with open(path, 'rb') as file:
+            self.s3.put_object(Body=file, **kwargs)
+
+    # Multipart uploads, for publisher.Publisher. Parts are {part number: ETag}.
+    def create_multipart(self, key, content_type=None, cache_control=None):
+        kwargs = {'Bucket': self.bucket_name, 'Key': key}
+        if content_type:
+            kwargs['ContentType'] = content_type
+        if cache_control:
+            kwargs['CacheControl'] = cache_control
+        return self.s3.create_multipart_upload(**kwargs)['UploadId']
+
+    def upload_part(self, key, upload_id, number, body):
+        return self.s3.upload_part(Bucket=self.bucket_name, Key=key, UploadId=upload_id, PartNumber=number,
+                                   Body=body)['ETag']
+
+    # Parts already uploaded, or None if the upload no longer exists
+    def list_parts(self, key, upload_id):
+        parts = {}
+        marker = 0
+        try:
+            while True:
+                response = self.s3.list_parts(Bucket=self.bucket_name, Key=key, UploadId=upload_id,
+                                              PartNumberMarker=marker)
+                for part in response.get('Parts', []):
+                    parts[part['PartNumber']] = part['ETag']
+                if not response.get('IsTruncated'):
+                    return parts
+                marker = response['NextPartNumberMarker']
+        except Exception as e:
+            if _error_code(e) in ('NoSuchUpload', '404'):
+                return None
+            raise
+
+    def complete_multipart(self, key, upload_id, parts):
+        response = self.s3.complete_multipart_upload(
+            Bucket=self.bucket_name, Key=key, UploadId=upload_id,
+            MultipartUpload={'Parts': [{'PartNumber': number, 'ETag': parts[number]} for number in sorted(parts)]},
+        )
+        return response['ETag']
+
+    def abort_multipart(self, key, upload_id):
+        self.s3.abort_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload_id)
+
+
+# The same interface over a local directory, for tests and dry runs. Conditional writes
+# are serialized with a lock file, so they hold across processes as well as threads.
+# Headers (and multipart ETags) are kept next to the objects under .meta/, in-progress
+# multipart uploads under .multipart/.
+class FilesystemStorage:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self.cache_id = 'fs-' + hashlib.sha1(self.root.encode('utf-8')).hexdigest()[:12]
+
+    def path_for(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def _meta_path(self, key):
+        return os.path.join(self.root, '.meta', *key.split('/')) + '.json'
+
+    # The headers stored with an object: content_type, cache_control and, for multipart objects, etag
+    def metadata(self, key):
+        try:
+            with open(self._meta_path(key), 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def _write_meta(self, key, **meta):
+        path = self._meta_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            json.dump({name: value for name, value in meta.items() if value is not None}, file)
+
+    def get(self, key, if_none_match=None):
+        try:
+            with open(self.path_for(key), 'rb') as file:
+                body = file.read()
+        except FileNotFoundError:
+            raise NotFound(key) from None
+        etag = self.metadata(key).get('etag') or _etag(body)
+        if if_none_match == etag:
+            return None, etag
+        return body, etag
+
+    def head(self, key):
+        try:
+            return self.get(key)[1]
+        except NotFound:
+            return None
+
+    def read_range(self, key, offset, length):
+        try:
+            with open(self.path_for(key), 'rb') as file:
+                file.seek(offset)
+                return file.read(length)
+        except FileNotFoundError:
+            raise NotFound(key) from None
+
+    def size(self, key):
+        try:
+            return os.path.getsize(self.path_for(key))
+        except FileNotFoundError:
+            raise NotFound(key) from None
+
+    def _write(self, key, write):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                write(file)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def put(self, key, body, if_match=None, if_none_match=None, content_type=None, cache_control=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        with open(os.path.join(self.root, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if if_match or if_none_match:
+                try:
+                    _, current = self.get(key)
+                except NotFound:
+                    current = None
+                if (if_none_match == '*' and current is not None) or (if_match and current != if_match):
+                    raise PreconditionFailed(key)
+            self._write(key, lambda file: file.write(body))
+            self._write_meta(key, content_type=content_type, cache_control=cache_control)
+        return _etag(body)
+
+    def upload_file(self, path, key, content_type=None, cache_control=None):
+        with open(path, 'rb') as source:
+            self._write(key, lambda file: shutil.copyfileobj(source, file))
+        self._write_meta(key, content_type=content_type, cache_control=cache_control)
+
+    def _upload_dir(self, upload_id):
+        return os.path.join(self.root, '.multipart', upload_id)
+
+    def create_multipart(self, key, content_type=None, cache_control=None):
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._upload_dir(upload_id))
+        with open(os.path.join(self._upload_dir(upload_id), 'upload.json'), 'w') as file:
+            json.dump({'key': key, 'content_type': content_type, 'cache_control': cache_control}, file)
+        return upload_id
+
+    def upload_part(self, key, upload_id, number, body):
+        path = os.path.join(self._upload_dir(upload_id), f'{number:05d}.part')
+        with open(f'{path}.tmp', 'wb') as file:
+            file.write(body)
+        os.replace(f'{path}.tmp', path)
+        return _etag(body)
+
+    def list_parts(self, key, upload_id):
+        if not os.path.isdir(self._upload_dir(upload_id)):
+            return None
+        parts = {}
+        for name in os.listdir(self._upload_dir(upload_id)):
+            if name.endswith('.part'):
+                with open(os.path.join(self._upload_dir(upload_id), name), 'rb') as file:
+                    parts[int(name[:-5])] = _etag(file.read())
+        return parts
+
+    def complete_multipart(self, key, upload_id, parts):
+        upload_dir = self._upload_dir(upload_id)
+        with open(os.path.join(upload_dir, 'upload.json'), 'r') as file:
+            upload = json.load(file)
+        digests = []
+
+        def assemble(file):
+            for number in sorted(parts):
+                with open(os.path.join(upload_dir, f'{number:05d}.part'), 'rb') as part:
+                    body = part.read()
+                if _etag(body) != parts[number]:
+                    raise ValueError(f'Part {number} of {key} does not match its ETag')
+                digests.append(hashlib.md5(body).digest())
+                file.write(body)
+
+        self._write(key, assemble)
+        etag = multipart_etag(digests)
+        self._write_meta(key, content_type=upload['content_type'], cache_control=upload['cache_control'], etag=etag)
+        shutil.rmtree(upload_dir)
+        return etag
+
+    def abort_multipart(self, key, upload_id):
+        shutil.rmtree(self._upload_dir(upload_id), ignore_errors=True)
@@ -0,0 +1,89 @@
+import io
+import os
+import sys
+import threading
+import wave
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pydub import AudioSegment
+
+import encoder
+import parallel
+import podgen
+from assets import AssetPool
+from segment_cache import ProcessedCache, SegmentCache
+from tts_pool import SynthesisPool
+
+FRAME_RATE = 44100
+
+
+def wav_bytes(seconds, frequency=220, channels=1):
+    t = np.arange(int(seconds * FRAME_RATE)) / FRAME_RATE
+    samples = (np.sin(2 * np.pi * frequency * t) * 6000).astype(np.int16)
+    if channels == 2:
+        samples = np.repeat(samples[:, None], 2, axis=1)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as file:
+        file.setnchannels(channels)
+        file.setsampwidth(2)
+        file.setframerate(FRAME_RATE)
+        file.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+# Returns WAV bytes (stored under .mp3 names, so decoding is patched to read WAV)
+class FakeTTS:
+    def __init__(self):
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def generate(self, text, voice, model):
+        with self._lock:
+            self.requests += 1
+        return wav_bytes(0.5)
+
+
+# Counts what it is given instead of running ffmpeg
+class NullEncoder:
+    def __init__(self, outputs, frame_rate, channels, max_pending_blocks=16):
+        self.outputs = [encoder.parse_output(spec) if isinstance(spec, str) else spec for spec in outputs]
+        self.bytes_written = 0
+        for path, _ in self.outputs:
+            open(path, "wb").close()
+
+    def write(self, samples):
+        self.bytes_written += np.ascontiguousarray(samples, dtype=np.int16).nbytes
+
+    def close(self):
+        return [path for path, _ in self.outputs]
+
+
+# Everything generate_podcast needs, offline, in a scratch directory: a fake TTS, WAV
+# decoding for the cached segments and no ffmpeg
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from_file = AudioSegment.from_file
+    monkeypatch.setattr(parallel.AudioSegment, "from_file", lambda path, *args, **kwargs: from_file(path, "wav"))
+    monkeypatch.setattr(podgen, "StreamingEncoder", NullEncoder)
+    assets = AssetPool(str(tmp_path / "sounds"))
+    for name in ("intro.mp3", "outro.mp3", "global_ambiance.mp3"):
+        assets._decoded[name] = np.zeros((FRAME_RATE, 2), np.int16)
+    tts = FakeTTS()
+    segment_cache = SegmentCache(str(tmp_path / "segments"))
+    return {
+        "tts": tts,
+        "segment_cache": segment_cache,
+        "processed_cache": ProcessedCache(str(tmp_path / "segments" / "processed")),
+        "synthesis_pool": SynthesisPool(tts, concurrency=2),
+        "asset_pool": assets,
+    }
+
+
+def write_script(lines):
+    with open("script.txt", "w") as file:
+        file.write("\n".join(f"{'Dave' if index % 2 == 0 else 'Julie'}: line {index}" for index in range(lines)))
@@ -0,0 +1,31 @@
+import numpy as np
+
+import mastering
+
+
+def noise(frames, level=3000, seed=0):
+    return (np.random.default_rng(seed).standard_normal((frames, 2)) * level).astype(np.int16)
+
+
+# 211780 frames leaves a partial hop (under 4410 frames) pending at the end
+def test_integrated_with_partial_hop():
+    meter = mastering.LoudnessMeter()
+    meter.add(noise(211780))
+    assert np.isfinite(meter.integrated())
+
+
+def test_integrated_between_adds_matches_one_pass():
+    samples = noise(211780)
+    whole = mastering.LoudnessMeter()
+    whole.add(samples)
+    split = mastering.LoudnessMeter()
+    split.add(samples[:100003])
+    split.integrated()
+    split.add(samples[100003:])
+    assert split.integrated() == whole.integrated()
+
+
+def test_less_than_a_hop_is_silence():
+    meter = mastering.LoudnessMeter()
+    meter.add(noise(100))
+    assert meter.integrated() == -np.inf
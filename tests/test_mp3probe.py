@@ -0,0 +1,49 @@
+import struct
+
+import pytest
+
+from mp3probe import HEAD_BYTES, probe
+
+# MPEG-1 layer III, 128 kbps, 44.1 kHz, joint stereo: 417-byte frames of 1152 samples
+HEADER = bytes([0xFF, 0xFB, 0x90, 0x64])
+FRAME_LENGTH = 417
+FRAMES = 20
+
+
+def id3_tag(total):
+    size = total - 10
+    return b"ID3\x04\x00\x00" + bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0)) + bytes(size)
+
+
+def xing_frame(frames, audio_bytes):
+    tag = b"Xing" + struct.pack(">III", 3, frames, audio_bytes)
+    frame = HEADER + bytes(32) + tag
+    return frame + bytes(FRAME_LENGTH - len(frame))
+
+
+def mp3(tag_end):
+    audio = HEADER + bytes(FRAME_LENGTH - 4)
+    return id3_tag(tag_end) + xing_frame(FRAMES, FRAMES * FRAME_LENGTH) + audio * FRAMES
+
+
+def reader(data):
+    return lambda offset, length: data[offset:offset + length]
+
+
+# The first frame and its Xing tag are read even when the ID3 tag ends just short of the head
+@pytest.mark.parametrize("tag_end", [1024, HEAD_BYTES - 100, HEAD_BYTES - 10, HEAD_BYTES + 10])
+def test_vbr_tag_after_id3_tag(tag_end):
+    data = mp3(tag_end)
+    info = probe(reader(data), len(data))
+    assert info.vbr
+    assert info.frames == FRAMES
+    assert info.duration == pytest.approx(FRAMES * 1152 / 44100)
+    assert info.bitrate == pytest.approx(128000, rel=0.01)
+
+
+def test_cbr_duration_from_size():
+    audio = HEADER + bytes(FRAME_LENGTH - 4)
+    data = id3_tag(HEAD_BYTES - 10) + audio * FRAMES
+    info = probe(reader(data), len(data))
+    assert not info.vbr
+    assert info.duration == pytest.approx(FRAMES * FRAME_LENGTH * 8 / 128000)
@@ -0,0 +1,90 @@
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from conftest import FakeTTS
+from render_service import RenderService, make_handler
+
+
+def script(prefix, lines):
+    return "\n".join(f"{'Dave' if index % 2 == 0 else 'Julie'}: {prefix} line {index}" for index in range(lines))
+
+
+# job.json is written last, after the caches are trimmed
+def wait(job, timeout=30):
+    deadline = time.time() + timeout
+    while not os.path.exists(os.path.join(job.work_dir, "job.json")):
+        assert time.time() < deadline, "job did not finish"
+        time.sleep(0.05)
+    assert job.status == "done", job.error
+
+
+def rows(cache, table):
+    with cache._lock:
+        return cache.db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+# With caps of zero, everything a job used goes once no job is running
+def test_caches_are_trimmed_after_each_job(pipeline):
+    service = RenderService(workers=1, client=FakeTTS(), cache_max_mb=0, processed_cache_max_mb=0)
+    service.asset_pool = pipeline["asset_pool"]
+    wait(service.submit(script=script("first", 4)))
+    assert rows(service.segment_cache, "segments") == 0
+    assert rows(service.processed_cache, "processed") == 0
+
+
+def test_eviction_keeps_what_a_running_job_may_use(pipeline):
+    service = RenderService(workers=1, client=FakeTTS(), cache_max_mb=0, processed_cache_max_mb=0)
+    service.asset_pool = pipeline["asset_pool"]
+    with service._evict_lock:
+        service._running["other"] = time.time()
+    wait(service.submit(script=script("first", 4)))
+    assert rows(service.segment_cache, "segments") == 4
+    assert rows(service.processed_cache, "processed") == 4
+    with service._evict_lock:
+        del service._running["other"]
+    wait(service.submit(script=script("second", 2)))
+    assert rows(service.segment_cache, "segments") == 0
+
+
+def post(service, body):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(service))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        request = urllib.request.Request(f"http://127.0.0.1:{server.server_port}/jobs",
+                                         data=json.dumps(body).encode("utf-8"), method="POST")
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_http_takes_only_inline_scripts(pipeline, tmp_path):
+    service = RenderService(workers=0, client=FakeTTS())
+    (tmp_path / "secret.txt").write_text("Dave: secret")
+    status, body = post(service, {"script_file": str(tmp_path / "secret.txt")})
+    assert status == 400
+    assert service.render_jobs == {}
+    status, body = post(service, {"script": script("inline", 2)})
+    assert status == 202
+    with open(os.path.join(body["work_dir"], "script.txt")) as file:
+        assert file.read() == script("inline", 2)
+
+
+@pytest.mark.parametrize("voices, pans, expected", [
+    ({"Ann": "voice-a", "Bob": "voice-b"}, None, {"Ann": 0.0, "Bob": 0.0}),
+    ({"Ann": "voice-a"}, {"Ann": -0.5}, {"Ann": -0.5}),
+])
+def test_custom_voices_are_centred_without_pans(pipeline, voices, pans, expected):
+    service = RenderService(workers=0, client=FakeTTS())
+    job = service.submit(script="Ann: hello", voices=voices, pans=pans)
+    assert job.speaker_pans == expected
@@ -0,0 +1,26 @@
+import pytest
+
+from conftest import write_script
+import podgen
+from segment_cache import ProcessedCache
+
+LINES = 4
+
+
+# Each line is counted once per run, however many stages read its segment. The second run
+# gets an empty processed cache, so every line is read back for processing again.
+@pytest.mark.parametrize("streamed", [False, True])
+def test_each_line_counts_once(pipeline, tmp_path, streamed):
+    write_script(LINES)
+    segment_cache = pipeline["segment_cache"]
+
+    def run(processed_dir):
+        segment_cache.hits = segment_cache.misses = 0
+        with open("script.txt") as file:
+            script_lines = iter(file.read().splitlines()) if streamed else None
+        podgen.generate_podcast(segment_cache, ProcessedCache(str(tmp_path / processed_dir)),
+                                pipeline["synthesis_pool"], pipeline["asset_pool"], script_lines=script_lines)
+        return segment_cache.hits, segment_cache.misses
+
+    assert run("processed-cold") == (0, LINES)
+    assert run("processed-warm") == (LINES, 0)
@@ -0,0 +1,47 @@
+import time
+
+import dsp
+from conftest import write_script
+from instrumentation import Recorder
+import podgen
+
+LINES = 4
+DSP_SECONDS = 0.25
+
+
+def slow_dsp(monkeypatch):
+    process_utterance = dsp.process_utterance
+
+    def slow(*args, **kwargs):
+        time.sleep(DSP_SECONDS)
+        return process_utterance(*args, **kwargs)
+
+    monkeypatch.setattr(dsp, "process_utterance", slow)
+
+
+def stage(recorder, name):
+    return next(stage for stage in recorder.stages if stage["name"] == name)
+
+
+def run(pipeline, recorder, script_lines=None):
+    podgen.generate_podcast(pipeline["segment_cache"], pipeline["processed_cache"], pipeline["synthesis_pool"],
+                            pipeline["asset_pool"], recorder=recorder, script_lines=script_lines)
+
+
+def test_batch_processing_time_is_in_process_not_mix(pipeline, monkeypatch):
+    slow_dsp(monkeypatch)
+    write_script(LINES)
+    recorder = Recorder()
+    run(pipeline, recorder)
+    assert stage(recorder, "process")["wall_s"] >= LINES * DSP_SECONDS * 0.9
+    assert stage(recorder, "mix")["wall_s"] < DSP_SECONDS
+    assert len(recorder.observations["process_line_s"]) == LINES
+
+
+def test_streamed_processing_time_is_in_stream(pipeline, monkeypatch):
+    slow_dsp(monkeypatch)
+    lines = [f"{'Dave' if index % 2 == 0 else 'Julie'}: streamed {index}" for index in range(LINES)]
+    recorder = Recorder()
+    run(pipeline, recorder, script_lines=iter(lines))
+    assert stage(recorder, "stream")["wall_s"] >= LINES * DSP_SECONDS * 0.9
+    assert len(recorder.observations["process_line_s"]) == LINES
@@ -0,0 +1,57 @@
+import pytest
+
+from tts_pool import SynthesisPool, is_retryable
+
+
+# Stand-ins for the SDKs' transport errors, which don't derive from the builtin ones
+class TransportError(Exception):
+    __module__ = "httpx"
+
+
+class ReadTimeout(TransportError):
+    __module__ = "httpx"
+
+
+class APIConnectionError(Exception):
+    __module__ = "openai"
+
+
+class APIStatusError(Exception):
+    __module__ = "openai"
+
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+class FlakyTTS:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.requests = 0
+
+    def generate(self, text, voice, model):
+        self.requests += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return b"audio"
+
+
+@pytest.mark.parametrize("error, retryable", [
+    (ConnectionResetError(), True),
+    (ReadTimeout(), True),
+    (APIConnectionError(), True),
+    (APIStatusError(503), True),
+    (APIStatusError(429), True),
+    (APIStatusError(400), False),
+    (ValueError(), False),
+])
+def test_is_retryable(error, retryable):
+    assert is_retryable(error) == retryable
+
+
+def test_transport_errors_are_retried(tmp_path):
+    client = FlakyTTS([APIConnectionError(), ReadTimeout()])
+    pool = SynthesisPool(client, sleep=lambda seconds: None)
+    pool.synthesize("Hello", "voice", str(tmp_path / "line.mp3"))
+    assert client.requests == 3
+    assert (tmp_path / "line.mp3").read_bytes() == b"audio"
@@ -0,0 +1,90 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import wave
+
+import numpy as np
+
+
+# Waveform-similarity overlap-add: copy windowed frames from the input at speed * the output
+# hop, nudging each one (within tolerance_ms) to line up with the natural continuation of the
+# previous frame so pitch is preserved without phasing. Runs in process on the sample array.
+def wsola_stretch(samples, frame_rate, speed, frame_ms=40, tolerance_ms=10):
+    frame = int(frame_rate * frame_ms / 1000) // 2 * 2
+    hop = frame // 2
+    analysis_hop = hop * speed
+    tolerance = int(frame_rate * tolerance_ms / 1000)
+    window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(frame) / frame)).astype(np.float32)[:, None]
+
+    pad = tolerance + frame
+    source = np.pad(samples.astype(np.float32), ((pad, pad + frame + int(2 * analysis_hop) + 1), (0, 0)))
+    mono = source.mean(axis=1)
+    output_frames = int(round(len(samples) / speed))
+    frame_count = output_frames // hop + 1
+    output = np.zeros((frame_count * hop + frame, samples.shape[1]), dtype=np.float32)
+
+    fft_size = 1 << int(np.ceil(np.log2(frame + 2 * tolerance + frame)))
+    delta = 0
+    for k in range(frame_count):
+        # Frame k is centred on output k * hop and input k * analysis_hop
+        position = pad + int(k * analysis_hop) - hop + delta
+        output[k * hop:k * hop + frame] += source[position:position + frame] * window
+
+        # Find where the next frame best matches what would naturally follow this one
+        template = mono[position + hop:position + hop + frame]
+        nominal = pad + int((k + 1) * analysis_hop) - hop
+        region = mono[nominal - tolerance:nominal + tolerance + frame]
+        spectrum = np.fft.rfft(region, fft_size) * np.conj(np.fft.rfft(template, fft_size))
+        correlation = np.fft.irfft(spectrum, fft_size)[:2 * tolerance + 1]
+        delta = int(np.argmax(correlation)) - tolerance
+
+    # The buffer starts half a frame before output time zero
+    output = output[hop:hop + output_frames]
+    return np.clip(output, -32768, 32767).astype(np.int16)
+
+
+def _write_wav(path, samples, frame_rate):
+    with wave.open(path, "wb") as file:
+        file.setnchannels(samples.shape[1])
+        file.setsampwidth(2)
+        file.setframerate(frame_rate)
+        file.writeframes(np.ascontiguousarray(samples, dtype=np.int16).tobytes())
+
+
+def _read_wav(path):
+    with wave.open(path, "rb") as file:
+        channels = file.getnchannels()
+        if file.getsampwidth() != 2:
+            raise ValueError(f"Expected 16-bit audio from rubberband, got {file.getsampwidth() * 8}-bit")
+        return np.frombuffer(file.readframes(file.getnframes()), dtype=np.int16).reshape(-1, channels)
+
+
+# The rubberband CLI (R3 engine). Each call uses its own temp directory so calls can run concurrently.
+def rubberband_stretch(samples, frame_rate, speed):
+    if shutil.which("rubberband") is None:
+        raise RuntimeError("rubberband is not installed; use --stretch-backend wsola")
+    with tempfile.TemporaryDirectory(prefix="podgen-stretch-") as temp_dir:
+        input_file = os.path.join(temp_dir, "input.wav")
+        output_file = os.path.join(temp_dir, "output.wav")
+        _write_wav(input_file, samples, frame_rate)
+        subprocess.run(
+            ["rubberband", "--quiet", "--tempo", str(speed), "-3", input_file, output_file],
+            check=True,
+        )
+        return _read_wav(output_file)
+
+
+BACKENDS = {
+    "wsola": wsola_stretch,
+    "rubberband": rubberband_stretch,
+}
+
+
+# Speed audio up by speed (1.1 = 10% faster) without changing pitch
+def time_stretch(samples, frame_rate, speed, backend="wsola"):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown time-stretch backend {backend!r}; choose from {', '.join(BACKENDS)}")
+    if speed == 1.0:
+        return samples
+    return BACKENDS[backend](samples, frame_rate, speed)
@@ -0,0 +1,174 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from instrumentation import NULL_RECORDER
+from segment_cache import DEFAULT_MODEL, segment_key
+
+
+# Spaces requests out so that no more than requests_per_second start in any second
+class RateLimiter:
+    def __init__(self, requests_per_second, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = self.clock()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            self.sleep(slot - now)
+
+
+# ElevenLabs errors carry status_code; requests-style errors carry a response
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+# Transport failures from the SDKs' HTTP stacks, matched by class name so that none of them
+# has to be imported: openai's APIConnectionError/APITimeoutError, httpx's TransportError
+# (which ElevenLabs raises), requests' ConnectionError/Timeout and urllib3's ProtocolError
+TRANSPORT_ERRORS = {"APIConnectionError", "APITimeoutError", "TransportError", "ConnectionError", "Timeout",
+                    "ProtocolError"}
+
+
+def is_retryable(error):
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    if any(cls.__name__ in TRANSPORT_ERRORS for cls in type(error).__mro__):
+        return True
+    status = _status_code(error)
+    return status is not None and (status == 429 or 500 <= status < 600)
+
+
+def _retry_after(error):
+    headers = getattr(error, "headers", None) or getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+# Write the audio returned by client.generate (bytes or an iterator of chunks) to output_file
+def write_audio(audio, output_file):
+    with open(output_file, "wb") as file:
+        if isinstance(audio, bytes):
+            file.write(audio)
+        else:
+            for chunk in audio:
+                file.write(chunk)
+
+
+class SynthesisPool:
+    # client is anything with generate(text=..., voice=..., model=...), e.g. ElevenLabs or a local fake
+    def __init__(self, client, model=DEFAULT_MODEL, concurrency=4, requests_per_second=None,
+                 max_retries=5, base_delay=1.0, max_delay=30.0, sleep=time.sleep):
+        self.client = client
+        self.model = model
+        self.concurrency = max(1, concurrency)
+        self.limiter = RateLimiter(requests_per_second, sleep=sleep)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+
+    # Synthesize one line into output_file, backing off exponentially on 429/5xx
+    def synthesize(self, text, voice, output_file, recorder=NULL_RECORDER):
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            started = time.perf_counter()
+            try:
+                print("Generating audio for:", text)
+                audio = self.client.generate(text=text, voice=voice, model=self.model)
+                write_audio(audio, output_file)
+                recorder.observe("tts_latency_s", time.perf_counter() - started, started)
+                recorder.count("tts_bytes_downloaded", os.path.getsize(output_file))
+                return output_file
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                recorder.count("tts_retries")
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                print(f"TTS request failed ({e}); retrying in {delay:.1f}s")
+                self.sleep(delay)
+                attempt += 1
+
+    def _synthesize_line(self, voice, text, segment_cache, recorder):
+        return segment_cache.store(
+            voice, text, lambda path: self.synthesize(text, voice, path, recorder), model=self.model
+        )
+
+    # Synthesize every (voice, text) pair missing from the cache, concurrently.
+    # Files are content-addressed by the cache, so completion order doesn't matter.
+    def synthesize_missing(self, lines, segment_cache, recorder=NULL_RECORDER):
+        pending = {}
+        for voice, text in lines:
+            key = segment_key(voice, self.model, text)
+            if key not in pending and segment_cache.lookup(voice, text, model=self.model) is None:
+                pending[key] = (voice, text)
+        recorder.count("segment_cache_hits", len(lines) - len(pending))
+        recorder.count("segment_cache_misses", len(pending))
+        if not pending:
+            return 0
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self._synthesize_line, voice, text, segment_cache, recorder)
+                       for voice, text in pending.values()]
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            # Everything that succeeded is already cached, so a rerun only retries the failures
+            print(f"{len(errors)} of {len(futures)} lines failed to synthesize")
+            raise errors[0]
+        return len(futures)
+
+    # For lines that arrive one at a time (e.g. while the script is still being written)
+    def stream(self, segment_cache, recorder=NULL_RECORDER):
+        return SynthesisStream(self, segment_cache, recorder)
+
+
+# Synthesizes lines as they are submitted, with the pool's concurrency, rate limit and
+# retries. submit() returns a future for the line's cached segment file; lines already in
+# the cache get a finished one, and repeats of a line share a future.
+class SynthesisStream:
+    def __init__(self, pool, segment_cache, recorder=NULL_RECORDER):
+        self.pool = pool
+        self.segment_cache = segment_cache
+        self.recorder = recorder
+        self.executor = ThreadPoolExecutor(max_workers=pool.concurrency)
+        self.futures = {}
+
+    def submit(self, voice, text):
+        key = segment_key(voice, self.pool.model, text)
+        path = None if key in self.futures else self.segment_cache.lookup(voice, text, model=self.pool.model)
+        if key in self.futures or path is not None:
+            self.recorder.count("segment_cache_hits")
+        if path is not None:
+            self.futures[key] = Future()
+            self.futures[key].set_result(path)
+        elif key not in self.futures:
+            self.recorder.count("segment_cache_misses")
+            self.futures[key] = self.executor.submit(self.pool._synthesize_line, voice, text,
+                                                     self.segment_cache, self.recorder)
+        return self.futures[key]
+
+    # Wait for every submitted line and return the errors of those that failed
+    def close(self):
+        self.executor.shutdown(wait=True)
+        errors = [future.exception() for future in self.futures.values() if future.exception() is not None]
+        if errors:
+            print(f"{len(errors)} of {len(self.futures)} lines failed to synthesize")
+        return errors
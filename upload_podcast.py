@@ -1,38 +1,46 @@
 from podcast_manager import PodcastManager
+from storage import FilesystemStorage
 import argparse
 import os
 
 def main(args):
     # Create an instance of the PodcastManager
-    podcast_manager = PodcastManager(args.bucket_name, args.index_file, args.num_episodes)
+    storage = FilesystemStorage(args.local_dir) if args.local_dir else None
+    podcast_manager = PodcastManager(args.bucket_name, args.index_file, args.num_episodes, storage, args.cache_dir,
+                                     args.max_feed_items)
 
     try:
+        if args.backfill:
+            # Fill in duration and enclosure length for existing episodes and republish
+            podcast_manager.backfill_metadata()
+            podcast_manager.publish_site()
+            return
+
         # Add the new episode to the podcast manager
         podcast_manager.add_episode(args.title, args.summary, args.mp3_file, duration=args.duration)
         print('Episode added successfully.')
 
-        # Generate the main and test RSS feeds
-        podcast_manager.generate_rss_feed('main')
-        podcast_manager.generate_rss_feed('test')
-        print('RSS feeds generated successfully.')
-
-        # Generate the index.html file
-        podcast_manager.generate_web_page()
-        print('index.html file generated successfully.')
+        # Generate the RSS feeds (and the archive, if capped) and the web pages, and upload
+        # whichever changed in one batch
+        podcast_manager.publish_site()
+        print('RSS feeds and web pages generated successfully.')
 
     except Exception as e:
         print(f'An error occurred: {str(e)}')
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Upload a podcast episode and generate RSS feeds and index.html.')
+    parser = argparse.ArgumentParser(description='Upload a podcast episode and generate RSS feeds and the web site.')
     parser.add_argument('--bucket-name', type=str, default="quackernewspodcast", help='The name of the S3 bucket.')
-    parser.add_argument('--index-file', type=str, default='index.json', help='The name of the index file.')
-    parser.add_argument('--num-episodes', type=int, default=10, help='The number of episodes to display on the web page.')
+    parser.add_argument('--index-file', type=str, default='index.json', help='The name of the legacy index file to import from.')
+    parser.add_argument('--cache-dir', type=str, default='.podcast_cache', help='Local cache of the episode index.')
+    parser.add_argument('--local-dir', type=str, default=None, help='Publish into this directory instead of S3 (for testing).')
+    parser.add_argument('--num-episodes', type=int, default=10, help='The number of episodes to display on the front page; the rest are on archive pages.')
+    parser.add_argument('--max-feed-items', type=int, default=None, help='Keep only this many episodes in podcast.rss; older ones go to paged archive feeds under archive/.')
     parser.add_argument('--title', type=str, default="Test Podcast", help='The title of the podcast episode.')
     parser.add_argument('--summary', type=str, default="Test Podcast Summary", help='The summary of the podcast episode.')
     parser.add_argument('--mp3-file', type=str, default="output.mp3", help='The path to the MP3 file of the podcast episode.')
-    # TODO compute duration of the mp3
-    parser.add_argument('--duration', type=str, default="00:05:00", help='The duration of the podcast episode (HH:MM:SS).')
+    parser.add_argument('--duration', type=str, default=None, help='The duration of the podcast episode (HH:MM:SS); read from the MP3 by default.')
+    parser.add_argument('--backfill', action='store_true', help='Fill in duration and length for existing episodes instead of adding one.')
 
     args = parser.parse_args()
     main(args)
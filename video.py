@@ -0,0 +1,209 @@
+import argparse
+import os
+import queue
+import struct
+import subprocess
+import threading
+
+import numpy as np
+
+from encoder import PipeWriter
+from mixer import EPISODE_CHANNELS, EPISODE_FRAME_RATE
+
+WAVE_WIDTH = 1280
+WAVE_HEIGHT = 200
+WAVE_COLOR = (255, 255, 255)
+
+# Software-only x264 settings, fastest first. A mostly static picture compresses well, so
+# even the fast presets stay small.
+PRESETS = {
+    "draft": {"fps": 15, "x264_preset": "ultrafast", "crf": 30},
+    "fast": {"fps": 25, "x264_preset": "veryfast", "crf": 26},
+    "quality": {"fps": 25, "x264_preset": "medium", "crf": 20},
+}
+
+
+def png_size(path):
+    with open(path, "rb") as file:
+        header = file.read(24)
+    if header[:8] != b"\x89PNG\r\n\x1a\n" or header[12:16] != b"IHDR":
+        raise ValueError(f"{path} is not a PNG")
+    return struct.unpack(">II", header[16:24])
+
+
+# Decode the background once to an RGB array, cropped to even dimensions for yuv420p
+def load_background(path="background.png"):
+    width, height = png_size(path)
+    raw = subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-i", path, "-frames:v", "1", "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"],
+        stdout=subprocess.PIPE, check=True,
+    ).stdout
+    background = np.frombuffer(raw, dtype=np.uint8).reshape(height, width, 3)
+    return background[:height - height % 2, :width - width % 2]
+
+
+# Waveform pictures for a batch of video frames, like ffmpeg's showwaves in line mode: each
+# column is a line from the centre to the loudest sample (with its sign) of that column's
+# slice of the frame's audio. windows is (frames, samples) of mono audio in [-1, 1];
+# returns a (frames, height, width) boolean mask.
+def waveform_masks(windows, width=WAVE_WIDTH, height=WAVE_HEIGHT):
+    edges = np.arange(width) * windows.shape[1] // width
+    peaks = np.maximum.reduceat(windows, edges, axis=1)
+    troughs = np.minimum.reduceat(windows, edges, axis=1)
+    values = np.where(peaks >= -troughs, peaks, troughs)
+    centre = height // 2
+    tips = np.clip(np.round(centre - values * centre), 0, height - 1)[:, None, :]
+    rows = np.arange(height)[None, :, None]
+    return (rows >= np.minimum(tips, centre)) & (rows <= np.maximum(tips, centre))
+
+
+# Draws waveform frames over the background. Only the waveform strip changes between
+# frames, so one batch of background frames is reused and just that strip is redrawn.
+class WaveformPainter:
+    def __init__(self, background):
+        height, width, _ = background.shape
+        self.background = background
+        self.wave_width = min(WAVE_WIDTH, width)
+        self.wave_height = min(WAVE_HEIGHT, height)
+        self.wave_left = (width - self.wave_width) // 2
+        self.wave_top = height - self.wave_height
+        self._strip = background[self.wave_top:, self.wave_left:self.wave_left + self.wave_width]
+        self._frames = None
+
+    # windows is (frames, samples) of mono audio; returns (frames, height, width, 3) RGB
+    def paint(self, windows):
+        masks = waveform_masks(windows, self.wave_width, self.wave_height)
+        if self._frames is None or len(self._frames) < len(masks):
+            self._frames = np.repeat(self.background[None], len(masks), axis=0)
+        frames = self._frames[:len(masks)]
+        region = frames[:, self.wave_top:self.wave_top + self.wave_height,
+                        self.wave_left:self.wave_left + self.wave_width]
+        region[:] = self._strip
+        region[masks] = WAVE_COLOR
+        return frames
+
+
+# Renders the episode video (waveform over the background) from PCM as it is mixed, so
+# there is no second pass decoding the finished MP3. Audio and raw RGB frames go to one
+# ffmpeg process over two pipes; frames are drawn on a background thread.
+class VideoRenderer:
+    def __init__(self, output_file, background, frame_rate=EPISODE_FRAME_RATE, channels=EPISODE_CHANNELS,
+                 preset="fast", audio_bitrate="192k", frames_per_batch=10):
+        settings = PRESETS[preset]
+        self.output_file = output_file
+        self.painter = WaveformPainter(background)
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.fps = settings["fps"]
+        self.window = frame_rate // self.fps
+        self.frames_per_batch = frames_per_batch
+        self.frames_written = 0
+        self.samples_received = 0
+
+        height, width, _ = background.shape
+        audio_read, audio_write = os.pipe()
+        command = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-thread_queue_size", "512",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(self.fps), "-i", "pipe:0",
+            "-thread_queue_size", "512",
+            "-f", "s16le", "-ar", str(frame_rate), "-ac", str(channels), "-i", f"pipe:{audio_read}",
+            "-map", "0:v", "-map", "1:a",
+            "-c:v", "libx264", "-preset", settings["x264_preset"], "-crf", str(settings["crf"]), "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-b:a", audio_bitrate,
+            "-movflags", "+faststart", "-shortest", output_file,
+        ]
+        try:
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE, pass_fds=(audio_read,))
+        finally:
+            os.close(audio_read)
+        self._audio = PipeWriter(os.fdopen(audio_write, "wb"))
+        self._video = PipeWriter(self.process.stdin, max_pending_blocks=4)
+        self._mono = queue.Queue(16)
+        self._error = None
+        self._drawer = threading.Thread(target=self._run_drawer, daemon=True)
+        self._drawer.start()
+
+    # On failure keep taking blocks, so write() never blocks on a dead thread
+    def _run_drawer(self):
+        try:
+            self._draw()
+        except Exception as e:
+            self._error = e
+            while self._mono.get() is not None:
+                pass
+
+    # Turn mono audio into frames: frame k shows the window starting at sample k * rate / fps
+    def _draw(self):
+        pending = np.zeros(0, dtype=np.float32)
+        pending_start = 0
+        total = None
+        while True:
+            block = self._mono.get()
+            if block is None:
+                # Pad the tail so the last (partial) frame has a full window
+                total = pending_start + len(pending)
+                pending = np.concatenate([pending, np.zeros(self.window, dtype=np.float32)])
+            else:
+                pending = np.concatenate([pending, block])
+            while True:
+                if total is not None:
+                    last = -(-total * self.fps // self.frame_rate)
+                else:
+                    last = ((pending_start + len(pending) - self.window) * self.fps) // self.frame_rate + 1
+                count = min(self.frames_per_batch, last - self.frames_written)
+                if count <= 0:
+                    break
+                frames = np.arange(self.frames_written, self.frames_written + count)
+                starts = frames * self.frame_rate // self.fps - pending_start
+                windows = pending[starts[:, None] + np.arange(self.window)]
+                self._video.write(self.painter.paint(windows).tobytes())
+                self.frames_written += count
+                consumed = self.frames_written * self.frame_rate // self.fps - pending_start
+                pending = pending[consumed:]
+                pending_start += consumed
+            if block is None:
+                break
+
+    def write(self, samples):
+        if self._error is not None:
+            raise RuntimeError(f"Drawing video frames failed: {self._error}")
+        self._audio.write(np.ascontiguousarray(samples, dtype=np.int16).tobytes())
+        mono = samples.astype(np.float32).mean(axis=1) / 32768
+        self.samples_received += len(samples)
+        self._mono.put(mono)
+
+    def close(self):
+        self._mono.put(None)
+        self._drawer.join()
+        self._video.close()
+        self._audio.close()
+        if self._error is not None:
+            raise RuntimeError(f"Drawing video frames failed: {self._error}")
+        if self.process.wait() != 0 or self._audio.error is not None or self._video.error is not None:
+            raise RuntimeError(f"ffmpeg failed writing {self.output_file}")
+        return self.output_file
+
+
+# Render the video for a finished buffer (e.g. a memory-mapped master or a decoded MP3)
+def encode_video(samples, output_file, background, frame_rate=EPISODE_FRAME_RATE, preset="fast",
+                 block_frames=1 << 16):
+    renderer = VideoRenderer(output_file, background, frame_rate, samples.shape[1], preset)
+    for start in range(0, len(samples), block_frames):
+        renderer.write(samples[start:start + block_frames])
+    return renderer.close()
+
+
+if __name__ == "__main__":
+    from pydub import AudioSegment
+
+    from mixer import to_array
+
+    parser = argparse.ArgumentParser(description="Render an episode's MP3 as a waveform video over a background image.")
+    parser.add_argument("input", nargs="?", default="output.mp3")
+    parser.add_argument("output", nargs="?", default="output.mp4")
+    parser.add_argument("--background", default="background.png")
+    parser.add_argument("--preset", choices=list(PRESETS), default="fast")
+    args = parser.parse_args()
+    samples = to_array(AudioSegment.from_file(args.input).set_channels(EPISODE_CHANNELS))
+    encode_video(samples, args.output, load_background(args.background), preset=args.preset)